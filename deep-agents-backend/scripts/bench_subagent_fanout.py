@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark subagent fan-out: sequential vs. concurrent `task` calls.
+
+A fake main model delegates N research questions in one step; each fake
+subagent model call takes a fixed latency. The run is repeated with a
+`task` concurrency limit of 1 (sequential) and of N (fan-out).
+
+    python scripts/bench_subagent_fanout.py --tasks 5 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# src.agent builds the server graph on import, which needs settings
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from deepagents import create_deep_agent  # noqa: E402
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from src.agent.middleware import SubagentBudgetMiddleware, ToolConcurrencyMiddleware  # noqa: E402
+
+
+class FakeModel(GenericFakeChatModel):
+    """Fake chat model with a fixed per-call latency."""
+
+    latency: float = 0.0
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._generate(*args, **kwargs)
+
+
+def build(tasks: int, latency: float, concurrency: int):
+    calls = [
+        {
+            "name": "task",
+            "args": {"description": f"Research question {i}", "subagent_type": "research-agent"},
+            "id": f"call_{i}",
+        }
+        for i in range(tasks)
+    ]
+    main_model = FakeModel(
+        messages=iter([AIMessage(content="", tool_calls=calls), AIMessage(content="Summary")]),
+        latency=latency,
+    )
+    sub_model = FakeModel(
+        messages=iter([AIMessage(content=f"Findings {i}") for i in range(tasks)]),
+        latency=latency,
+    )
+    subagent = {
+        "name": "research-agent",
+        "description": "Researches one question.",
+        "system_prompt": "You research.",
+        "model": sub_model,
+        "middleware": [SubagentBudgetMiddleware(max_seconds=60, max_tokens=100_000)],
+    }
+    return create_deep_agent(
+        model=main_model,
+        subagents=[subagent],
+        middleware=[
+            ToolConcurrencyMiddleware(
+                max_concurrency=max(concurrency, 1), per_tool_limits={"task": concurrency}
+            )
+        ],
+    )
+
+
+async def run(tasks: int, latency: float, concurrency: int) -> tuple[float, list[str]]:
+    agent = build(tasks, latency, concurrency)
+    start = time.perf_counter()
+    result = await agent.ainvoke({"messages": [{"role": "user", "content": "Research"}]})
+    elapsed = time.perf_counter() - start
+    order = [m.tool_call_id for m in result["messages"] if m.type == "tool"]
+    return elapsed, order
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    sequential, _ = await run(args.tasks, args.latency, concurrency=1)
+    fanout, order = await run(args.tasks, args.latency, concurrency=args.tasks)
+
+    print(f"tasks={args.tasks} model latency={args.latency}s")
+    print(f"sequential (task limit 1): {sequential:.2f}s")
+    print(f"fan-out (task limit {args.tasks}): {fanout:.2f}s")
+    print(f"speed-up: {sequential / fanout:.1f}x")
+    print(f"results in call order: {order == [f'call_{i}' for i in range(args.tasks)]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
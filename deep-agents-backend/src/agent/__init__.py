@@ -1,6 +1,14 @@
 """Agent module - Main Deep Agent implementation."""
 
-from src.agent.deep_agent import graph, create_agent
+from typing import Any
 
-__all__ = ["graph", "create_agent"]
+from src.agent.deep_agent import create_agent, get_agent, make_graph
 
+__all__ = ["graph", "create_agent", "get_agent", "make_graph"]
+
+
+def __getattr__(name: str) -> Any:
+    # Resolve ``graph`` lazily so importing the package does not build it
+    if name == "graph":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
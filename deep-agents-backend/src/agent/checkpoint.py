@@ -0,0 +1,239 @@
+"""Durable checkpointer for the Deep Agent graph.
+
+The LangGraph server manages persistence itself, so the default is no
+checkpointer. When the graph is embedded elsewhere, a SQLite or Postgres
+checkpointer keyed by ``thread_id`` lets runs resume from the last
+checkpoint, and old checkpoints are pruned down to a fixed retention.
+
+The savers are the async ones (``AsyncSqliteSaver``/``AsyncPostgresSaver``),
+so the graph must be driven with ``ainvoke``/``astream``. They are opened on
+the first checkpoint call, inside the event loop that runs the graph, because
+graphs are built synchronously and possibly before any loop exists.
+"""
+
+import asyncio
+import random
+from collections.abc import AsyncIterator, Sequence
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from langchain.agents.middleware import AgentMiddleware, AgentState
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.config import get_config
+from langgraph.runtime import Runtime
+
+from src.config import get_settings
+
+# Retention is per (thread_id, checkpoint_ns): the root graph and every subgraph or
+# subagent namespace keep their own newest ``keep`` checkpoints. Writes are matched
+# on the full checkpoint key, so no namespace is left with orphaned writes.
+_SQLITE_PRUNE = (
+    """
+    DELETE FROM checkpoints WHERE thread_id = ? AND (checkpoint_ns, checkpoint_id) IN (
+        SELECT checkpoint_ns, checkpoint_id FROM (
+            SELECT checkpoint_ns, checkpoint_id,
+                   ROW_NUMBER() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints WHERE thread_id = ?
+        ) WHERE rn > ?
+    )
+    """,
+    """
+    DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns
+          AND c.checkpoint_id = writes.checkpoint_id
+    )
+    """,
+)
+
+_POSTGRES_PRUNE = (
+    """
+    DELETE FROM checkpoints WHERE thread_id = %(thread_id)s AND (checkpoint_ns, checkpoint_id) IN (
+        SELECT checkpoint_ns, checkpoint_id FROM (
+            SELECT checkpoint_ns, checkpoint_id,
+                   ROW_NUMBER() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints WHERE thread_id = %(thread_id)s
+        ) ranked WHERE rn > %(keep)s
+    )
+    """,
+    """
+    DELETE FROM checkpoint_writes w WHERE w.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns
+          AND c.checkpoint_id = w.checkpoint_id
+    )
+    """,
+    """
+    DELETE FROM checkpoint_blobs b WHERE b.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+          AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+    )
+    """,
+)
+
+
+class AsyncCheckpointer(BaseCheckpointSaver):
+    """Async SQLite/Postgres checkpointer opened lazily on the running event loop.
+
+    Delegates to ``AsyncSqliteSaver`` or ``AsyncPostgresSaver``; the connection
+    (or pool) is bound to the loop of the first call, which is the loop that
+    serves the graph.
+
+    Args:
+        kind: ``"sqlite"`` or ``"postgres"``.
+        target: SQLite file path or Postgres connection string.
+        pool_size: Maximum Postgres pool size.
+    """
+
+    def __init__(self, kind: str, target: str, pool_size: int = 10) -> None:
+        super().__init__()
+        self.kind = kind
+        self.target = target
+        self.pool_size = pool_size
+        self._saver: Any = None
+        self._conn: Any = None
+        self._open_lock = asyncio.Lock()
+
+    async def _open(self) -> Any:
+        if self._saver is not None:
+            return self._saver
+        async with self._open_lock:
+            if self._saver is not None:
+                return self._saver
+            if self.kind == "sqlite":
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+                conn = await aiosqlite.connect(self.target)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute("PRAGMA busy_timeout=5000")
+                saver = AsyncSqliteSaver(conn)
+            else:
+                from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+                from psycopg.rows import dict_row
+                from psycopg_pool import AsyncConnectionPool
+
+                conn = AsyncConnectionPool(
+                    conninfo=self.target,
+                    max_size=self.pool_size,
+                    kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+                    open=False,
+                )
+                await conn.open()
+                saver = AsyncPostgresSaver(conn)
+            await saver.setup()
+            self._conn, self._saver = conn, saver
+            return saver
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await (await self._open()).aget_tuple(config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,  # noqa: A002
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        saver = await self._open()
+        async for item in saver.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await (await self._open()).aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await (await self._open()).aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await (await self._open()).adelete_thread(thread_id)
+
+    def get_next_version(self, current: str | int | None, channel: None) -> str:  # noqa: ARG002
+        # Same monotonically increasing "<counter>.<random>" format as both savers
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    async def aprune(self, thread_id: str, keep: int) -> None:
+        """Keep only the newest ``keep`` checkpoints (and their writes) per namespace of a thread."""
+        if keep <= 0:
+            return
+        saver = await self._open()
+        if self.kind == "sqlite":
+            # Shares the saver's connection; its lock keeps pruning from interleaving with writes
+            async with saver.lock:
+                await self._conn.execute(_SQLITE_PRUNE[0], (thread_id, thread_id, keep))
+                await self._conn.execute(_SQLITE_PRUNE[1], (thread_id,))
+                await self._conn.commit()
+            return
+        async with self._conn.connection() as conn:
+            for sql in _POSTGRES_PRUNE:
+                await conn.execute(sql, {"thread_id": thread_id, "keep": keep})
+
+    async def aclose(self) -> None:
+        """Close the connection (or pool) if it was opened."""
+        conn, self._conn, self._saver = self._conn, None, None
+        if conn is not None:
+            await conn.close()
+
+
+@lru_cache
+def create_checkpointer() -> AsyncCheckpointer | None:
+    """Create the configured checkpointer (shared by all graphs), or None when disabled."""
+    settings = get_settings()
+
+    if settings.checkpointer_type == "sqlite":
+        path = Path(settings.checkpoint_sqlite_path).resolve()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return AsyncCheckpointer("sqlite", str(path))
+
+    if settings.checkpointer_type == "postgres":
+        if not settings.checkpoint_postgres_url:
+            raise ValueError("CHECKPOINT_POSTGRES_URL is required for the postgres checkpointer")
+        return AsyncCheckpointer(
+            "postgres", settings.checkpoint_postgres_url, settings.checkpoint_pool_size
+        )
+
+    return None
+
+
+class CheckpointRetentionMiddleware(AgentMiddleware):
+    """Prune old checkpoints of the current thread after each agent run."""
+
+    def __init__(self, checkpointer: AsyncCheckpointer, keep: int) -> None:
+        super().__init__()
+        self.checkpointer = checkpointer
+        self.keep = keep
+
+    async def aafter_agent(self, state: AgentState, runtime: Runtime[Any]) -> dict[str, Any] | None:  # noqa: ARG002
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+        if thread_id:
+            await self.checkpointer.aprune(str(thread_id), self.keep)
+        return None
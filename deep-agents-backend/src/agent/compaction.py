@@ -0,0 +1,201 @@
+"""Context compaction for long-running threads.
+
+Older messages are summarized before the context reaches its limit, keeping
+the most recent messages verbatim. Summaries are prepared in the background
+once a thread crosses a soft threshold and swapped in on a later model call,
+so the run only waits when the hard limit is reached first. The compacted
+history is written back to the thread's ``messages`` state, so subsequent runs
+start from it instead of summarizing again.
+"""
+
+import asyncio
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, NotRequired
+
+from langchain.agents.middleware import AgentState
+from langchain.agents.middleware.summarization import SummarizationMiddleware
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage, RemoveMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.config import get_config
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.runtime import Runtime
+
+
+class CompactionState(AgentState):
+    """Agent state with compaction bookkeeping."""
+
+    compaction: NotRequired[dict[str, int]]
+
+
+@dataclass
+class _Job:
+    """A background summary of the history up to message ``through_id``."""
+
+    through_id: str
+    future: Future
+
+
+class ContextCompactionMiddleware(SummarizationMiddleware):
+    """Summarize older messages before the context limit is hit.
+
+    Token counts are cached per message id, so each model call only counts
+    new messages. Once a thread exceeds ``prefetch_ratio * trigger_tokens`` a
+    summary of everything but the last ``keep_messages`` is started in the
+    background and applied on a later call; at ``trigger_tokens`` the call
+    waits for it (or summarizes inline when nothing is pending). Threads
+    without a ``thread_id`` only compact at the hard limit.
+
+    Args:
+        model: Model used to write summaries.
+        trigger_tokens: Hard limit that forces compaction.
+        keep_messages: Recent messages kept verbatim.
+        prefetch_ratio: Fraction of ``trigger_tokens`` that starts a background summary.
+        summary_input_tokens: Most recent tokens of history fed to the summarizer.
+        max_pending_jobs: Background summaries kept for threads that have not used them yet.
+    """
+
+    state_schema = CompactionState
+
+    def __init__(
+        self,
+        model: BaseChatModel,
+        trigger_tokens: int,
+        keep_messages: int = 6,
+        prefetch_ratio: float = 0.8,
+        summary_input_tokens: int = 32000,
+        max_pending_jobs: int = 256,
+    ) -> None:
+        super().__init__(
+            model,
+            trigger=("tokens", trigger_tokens),
+            keep=("messages", keep_messages),
+            trim_tokens_to_summarize=summary_input_tokens,
+        )
+        self.trigger_tokens = trigger_tokens
+        self.prefetch_tokens = int(trigger_tokens * prefetch_ratio)
+        self.keep_messages = keep_messages
+        self._token_cache: OrderedDict[str, int] = OrderedDict()
+        self._token_cache_size = 50_000
+        # Bounded: threads that stop before using their summary must not pin it forever
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()
+        self._max_jobs = max_pending_jobs
+        self._lock = threading.Lock()
+        # Serializes planning, starting and consuming jobs across concurrent model calls
+        self._jobs_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compaction")
+
+    def count_tokens(self, messages: list[AnyMessage]) -> int:
+        """Approximate token count, cached per message id."""
+        total = 0
+        for message in messages:
+            if message.id is None:
+                total += count_tokens_approximately([message])
+                continue
+            with self._lock:
+                cached = self._token_cache.get(message.id)
+                if cached is not None:
+                    self._token_cache.move_to_end(message.id)
+            if cached is None:
+                cached = count_tokens_approximately([message])
+                with self._lock:
+                    self._token_cache[message.id] = cached
+                    if len(self._token_cache) > self._token_cache_size:
+                        self._token_cache.popitem(last=False)
+            total += cached
+        return total
+
+    def _summarize(self, messages: list[AnyMessage]) -> str:
+        # Unlike the parent's ``_create_summary``, errors propagate so a failed
+        # summary never replaces the history.
+        trimmed = self._trim_messages_for_summary(messages)
+        response = self.model.invoke(self.summary_prompt.format(messages=trimmed))
+        return response.text.strip()
+
+    def _start_job(self, thread_id: str, messages: list[AnyMessage]) -> None:
+        cutoff = self._find_safe_cutoff(messages, self.keep_messages)
+        if cutoff <= 0:
+            return
+        # Run without the graph's context so summary tokens are not streamed to clients
+        future = self._executor.submit(self._summarize, list(messages[:cutoff]))
+        self._jobs[thread_id] = _Job(through_id=messages[cutoff - 1].id, future=future)
+        while len(self._jobs) > self._max_jobs:
+            _, stale = self._jobs.popitem(last=False)
+            # Not started yet: cancel; a running summary finishes and is dropped
+            stale.future.cancel()
+
+    def _compacted(
+        self, messages: list[AnyMessage], summary: str, through: int, tokens_before: int
+    ) -> dict[str, Any]:
+        new_messages = [*self._build_new_messages(summary), *messages[through + 1 :]]
+        for message in new_messages:
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+        return {
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *new_messages],
+            "compaction": {
+                "summarized_messages": through + 1,
+                "tokens_before": tokens_before,
+                "tokens_after": self.count_tokens(new_messages),
+            },
+        }
+
+    def _plan(self, messages: list[AnyMessage]) -> tuple[str | None, _Job | None, int]:
+        """Return the thread id, its usable pending job and the job's last message index."""
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+        thread_id = str(thread_id) if thread_id is not None else None
+        job = self._jobs.get(thread_id) if thread_id is not None else None
+        through = -1
+        if job is not None:
+            through = next((i for i, m in enumerate(messages) if m.id == job.through_id), -1)
+            if through < 0 or (job.future.done() and job.future.exception() is not None):
+                # History changed underneath the job, or the summary failed
+                del self._jobs[thread_id]
+                job = None
+        return thread_id, job, through
+
+    def _summary_future(self, messages: list[AnyMessage], tokens: int) -> tuple[Future | None, int]:
+        """Pick a finished or required summary: (future, index of its last message)."""
+        with self._jobs_lock:
+            thread_id, job, through = self._plan(messages)
+            if job is not None and (job.future.done() or tokens >= self.trigger_tokens):
+                del self._jobs[thread_id]
+                return job.future, through
+            if tokens >= self.trigger_tokens:
+                cutoff = self._find_safe_cutoff(messages, self.keep_messages)
+                if cutoff > 0:
+                    return self._executor.submit(self._summarize, list(messages[:cutoff])), cutoff - 1
+            elif thread_id is not None and job is None and tokens >= self.prefetch_tokens:
+                self._start_job(thread_id, messages)
+            return None, -1
+
+    def before_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:  # noqa: ARG002
+        messages = state["messages"]
+        self._ensure_message_ids(messages)
+        tokens = self.count_tokens(messages)
+        future, through = self._summary_future(messages, tokens)
+        if future is None:
+            return None
+        try:
+            summary = future.result()
+        except Exception:  # noqa: BLE001
+            # Keep the history; the next call retries
+            return None
+        return self._compacted(messages, summary, through, tokens)
+
+    async def abefore_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:  # noqa: ARG002
+        messages = state["messages"]
+        self._ensure_message_ids(messages)
+        tokens = self.count_tokens(messages)
+        future, through = self._summary_future(messages, tokens)
+        if future is None:
+            return None
+        try:
+            summary = await asyncio.wrap_future(future)
+        except Exception:  # noqa: BLE001
+            return None
+        return self._compacted(messages, summary, through, tokens)
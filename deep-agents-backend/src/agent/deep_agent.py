@@ -5,9 +5,20 @@ from typing import Any
 
 from deepagents import create_deep_agent
 from deepagents.backends import FilesystemBackend, StateBackend
-from langchain_openai import ChatOpenAI
-
+from langchain_core.runnables import RunnableConfig
+
+from src.agent.checkpoint import CheckpointRetentionMiddleware, create_checkpointer
+from src.agent.compaction import ContextCompactionMiddleware
+from src.agent.middleware import (
+    ModelRoutingMiddleware,
+    PromptCacheMiddleware,
+    SubagentBudgetMiddleware,
+    ToolConcurrencyMiddleware,
+    ToolResultEvictionMiddleware,
+)
+from src.agent.models import get_model_pool
 from src.agent.prompts import MAIN_AGENT_PROMPT
+from src.agent.registry import AgentRegistry, make_agent_key
 from src.config import get_settings
 from src.tools import internet_search
 from src.subagents import code_subagent, research_subagent
@@ -25,47 +36,146 @@ def _create_backend() -> Any:
     return lambda rt: StateBackend(rt)
 
 
-def _create_model() -> Any:
-    """Create chat model instance with optional custom OpenAI base URL."""
+_registry = AgentRegistry()
+
+
+def _describe_backend() -> str:
+    """Describe the configured backend for the registry key."""
     settings = get_settings()
+    if settings.backend_type == "filesystem":
+        return f"filesystem:{Path(settings.filesystem_root_dir).resolve()}"
+    return settings.backend_type
 
-    if settings.model_provider == "openai":
-        model_kwargs: dict[str, Any] = {
-            "model": settings.model_name,
-            "api_key": settings.openai_api_key,
-        }
-        if settings.openai_api_base:
-            model_kwargs["base_url"] = settings.openai_api_base
-        return ChatOpenAI(**model_kwargs)
 
-    # Fallback to provider string if other providers are introduced later
-    return settings.default_model
+def _create_model(model: str | None = None) -> Any:
+    """Get a pooled chat model client (default model when ``model`` is empty)."""
+    return get_model_pool().get(model)
 
 
-def create_agent():
-    """Create and configure the deep agent."""
-    # Tools that the agent can use
-    tools = [
-        internet_search,
-    ]
+def _create_tool_middleware() -> ToolConcurrencyMiddleware:
+    """Create the concurrency/timeout middleware for parallel tool calls."""
+    settings = get_settings()
+    return ToolConcurrencyMiddleware(
+        max_concurrency=settings.tool_max_concurrency,
+        # Parallel `task` calls fan out to subagents under their own limit
+        per_tool_limits={"task": settings.subagent_max_concurrency, **settings.tool_concurrency_limits},
+        default_timeout=settings.tool_timeout_seconds,
+        timeouts=settings.tool_timeouts,
+    )
+
+
+def _create_compaction_middleware(model: str) -> ContextCompactionMiddleware:
+    """Create the context compaction middleware for the main agent."""
+    settings = get_settings()
+    return ContextCompactionMiddleware(
+        _create_model(settings.compaction_model or settings.cheap_model or model),
+        trigger_tokens=settings.compaction_trigger_tokens,
+        keep_messages=settings.compaction_keep_messages,
+        prefetch_ratio=settings.compaction_prefetch_ratio,
+    )
+
+
+# Tools that the agent can use
+TOOLS = [
+    internet_search,
+]
+
+
+def create_agent(model: str | None = None):
+    """Create and configure the deep agent.
+
+    Args:
+        model: Model identifier such as ``"openai:gpt-4o"``; defaults to
+            ``Settings.default_model``.
+    """
+
+    # Subagents for delegation, each bounded by a time/token budget
+    settings = get_settings()
+    budget = SubagentBudgetMiddleware(
+        max_seconds=settings.subagent_max_seconds,
+        max_tokens=settings.subagent_max_tokens,
+    )
+    subagent_middleware: list[Any] = [budget]
+
+    backend = _create_backend()
+    tool_middleware = _create_tool_middleware()
+    middleware: list[Any] = [tool_middleware]
+    model = model or settings.default_model
+    if settings.compaction_trigger_tokens > 0:
+        middleware.insert(0, _create_compaction_middleware(model))
+    if settings.max_tokens_result_to_file > 0:
+        # Oversized tool results go to files; only a preview enters the context.
+        # Wraps the concurrency middleware, so the file write happens after the
+        # timed call returns and holds neither a tool slot nor the timeout.
+        eviction = ToolResultEvictionMiddleware(
+            backend, settings.max_tokens_result_to_file, settings.evicted_results_dir
+        )
+        middleware.insert(middleware.index(tool_middleware), eviction)
+        subagent_middleware.append(eviction)
+
+    # Route cheap steps (e.g. after todo updates) to the smaller model
+    if settings.cheap_model and settings.cheap_model != model:
+        router = ModelRoutingMiddleware(_create_model(settings.cheap_model))
+        middleware.append(router)
+        subagent_middleware.append(router)
+
+    # Last, so it sees the final system prompt, tools and (routed) model
+    prompt_cache = PromptCacheMiddleware(cache_key_routing=settings.prompt_cache_key)
+    subagent_middleware.append(prompt_cache)
 
-    # Subagents for delegation
     subagents = [
-        research_subagent,
-        code_subagent,
+        {**subagent, "middleware": [*subagent.get("middleware", []), *subagent_middleware]}
+        for subagent in (research_subagent, code_subagent)
     ]
 
+    # Durable checkpointer keyed by thread_id (disabled under the LangGraph server)
+    checkpointer = create_checkpointer()
+    if checkpointer is not None:
+        middleware.append(
+            CheckpointRetentionMiddleware(checkpointer, settings.checkpoint_retention)
+        )
+    middleware.append(prompt_cache)
+
     agent = create_deep_agent(
-        model=_create_model(),
-        tools=tools,
+        model=_create_model(model),
+        tools=TOOLS,
         system_prompt=MAIN_AGENT_PROMPT,
         subagents=subagents,
-        backend=_create_backend(),
+        backend=backend,
+        middleware=middleware,
+        checkpointer=checkpointer,
     )
 
     return agent
 
 
-# Create the graph instance for LangGraph server
-graph = create_agent()
+def get_agent(model: str | None = None):
+    """Get the compiled agent for ``model``, building it on first use.
+
+    Graphs are memoized by (model, tool set, prompt, backend), so switching
+    models per request reuses compiled graphs instead of recompiling.
+
+    Raises:
+        ValueError: If ``model`` is not in the model pool's allowlist.
+    """
+    pooled = get_model_pool().key(model)
+    model = f"{pooled.provider}:{pooled.model}"
+    key = make_agent_key(model, TOOLS, MAIN_AGENT_PROMPT, _describe_backend())
+    return _registry.get_or_build(key, lambda: create_agent(model))
+
+
+def make_graph(config: RunnableConfig):
+    """Graph factory for the LangGraph server.
+
+    Reads an optional ``model`` from ``config["configurable"]`` so a run can
+    switch models without recompiling graphs it has already built.
+    """
+    return get_agent((config.get("configurable") or {}).get("model"))
+
+
+def __getattr__(name: str) -> Any:
+    # ``graph`` is built lazily on first access instead of at import time
+    if name == "graph":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,486 @@
+"""Agent middleware for tool execution, budgets and model requests."""
+
+import asyncio
+import contextvars
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Annotated, Any, Awaitable, Callable, NotRequired
+
+from deepagents.backends.protocol import BACKEND_TYPES, BackendProtocol
+from deepagents.backends.utils import sanitize_tool_call_id
+from langchain.agents.middleware import (
+    AgentMiddleware,
+    AgentState,
+    ModelRequest,
+    ModelResponse,
+    hook_config,
+)
+from langchain.agents.middleware.types import PrivateStateAttr
+from langchain.tools.tool_node import ToolCallRequest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_openai.chat_models.base import BaseChatOpenAI
+from langgraph.runtime import Runtime
+from langgraph.types import Command
+
+
+def _timeout_message(request: ToolCallRequest, timeout: float) -> ToolMessage:
+    name = request.tool_call["name"]
+    return ToolMessage(
+        content=f"Error: tool '{name}' timed out after {timeout:g}s",
+        tool_call_id=request.tool_call["id"],
+        name=name,
+        status="error",
+    )
+
+
+def _runs_in_thread(tool: BaseTool | None) -> bool:
+    """Whether the tool has no native async implementation and runs on a worker thread."""
+    if tool is None:
+        return False
+    if isinstance(tool, StructuredTool):
+        return tool.coroutine is None
+    return type(tool)._arun is BaseTool._arun
+
+
+class ToolConcurrencyMiddleware(AgentMiddleware):
+    """Bound concurrency and enforce timeouts for parallel tool execution.
+
+    Tool calls from one model step are scheduled in parallel by the graph and
+    each result is emitted as soon as it finishes. This middleware caps the
+    total number of running tools, caps individual tools separately, and
+    applies a timeout to every call. A timed-out call returns an error
+    ``ToolMessage`` without affecting the other calls.
+
+    Args:
+        max_concurrency: Maximum number of tools running at once.
+        per_tool_limits: Per-tool concurrency caps, keyed by tool name.
+        default_timeout: Timeout in seconds for tools without an override.
+        timeouts: Per-tool timeouts; ``0`` disables the timeout for that tool.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_tool_limits: dict[str, float] | None = None,
+        default_timeout: float | None = None,
+        timeouts: dict[str, float] | None = None,
+    ):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.per_tool_limits = {name: int(limit) for name, limit in (per_tool_limits or {}).items()}
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        # Sync calls run on the graph's thread pool; async semaphores are
+        # created lazily per event loop.
+        self._sync_global = threading.BoundedSemaphore(max_concurrency)
+        self._sync_per_tool = {name: threading.BoundedSemaphore(n) for name, n in self.per_tool_limits.items()}
+        self._async_semaphores: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, tuple[asyncio.Semaphore, dict[str, asyncio.Semaphore]]
+        ] = weakref.WeakKeyDictionary()
+        # Sync timeouts require running the tool on a separate thread. A timed-out
+        # tool keeps its concurrency slot until its thread finishes, so busy
+        # workers never exceed max_concurrency.
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="tool")
+        # Shut the pool down once the middleware (and its compiled graph) is collected
+        self._finalizer = weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        """Shut down the worker pool used for sync timeouts."""
+        self._finalizer()
+
+    def _timeout_for(self, name: str) -> float | None:
+        timeout = self.timeouts.get(name, self.default_timeout)
+        return timeout if timeout and timeout > 0 else None
+
+    def _async_limits(self, name: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore | None]:
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_semaphores:
+            self._async_semaphores[loop] = (
+                asyncio.Semaphore(self.max_concurrency),
+                {tool: asyncio.Semaphore(n) for tool, n in self.per_tool_limits.items()},
+            )
+        global_sem, per_tool = self._async_semaphores[loop]
+        return global_sem, per_tool.get(name)
+
+    def _acquire_sync(self, tool_sem: threading.BoundedSemaphore | None, timeout: float | None) -> bool:
+        """Acquire the global then the per-tool slot.
+
+        Returns:
+            ``False`` if the slots were not acquired within ``timeout``; nothing is held then.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._sync_global.acquire(timeout=timeout):
+            return False
+        if tool_sem is None:
+            return True
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if tool_sem.acquire(timeout=remaining):
+            return True
+        self._sync_global.release()
+        return False
+
+    def _release_sync(self, tool_sem: threading.BoundedSemaphore | None) -> None:
+        if tool_sem is not None:
+            tool_sem.release()
+        self._sync_global.release()
+
+    def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], ToolMessage | Command],
+    ) -> ToolMessage | Command:
+        name = request.tool_call["name"]
+        timeout = self._timeout_for(name)
+        tool_sem = self._sync_per_tool.get(name)
+        # Waiting for a slot counts against the timeout: when hung tools hold every
+        # slot the call times out instead of queueing forever
+        if not self._acquire_sync(tool_sem, timeout):
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        if timeout is None:
+            try:
+                return handler(request)
+            finally:
+                self._release_sync(tool_sem)
+        # Copy the context so the tool still sees the current run config
+        ctx = contextvars.copy_context()
+        try:
+            future: Future = self._executor.submit(ctx.run, handler, request)
+        except BaseException:
+            self._release_sync(tool_sem)
+            raise
+        # Slots are returned only when the worker really finishes: a timed-out
+        # thread keeps running and keeps counting against the cap
+        future.add_done_callback(lambda _: self._release_sync(tool_sem))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return _timeout_message(request, timeout)
+
+    @staticmethod
+    async def _acquire_async(global_sem: asyncio.Semaphore, tool_sem: asyncio.Semaphore | None) -> None:
+        """Acquire the global then the per-tool slot; nothing is held if cancelled."""
+        await global_sem.acquire()
+        if tool_sem is None:
+            return
+        try:
+            await tool_sem.acquire()
+        except BaseException:
+            global_sem.release()
+            raise
+
+    @staticmethod
+    def _release_async(global_sem: asyncio.Semaphore, tool_sem: asyncio.Semaphore | None, work: asyncio.Future) -> None:
+        if not work.cancelled():
+            # Retrieve the outcome of work nobody awaits after a timeout
+            work.exception()
+        if tool_sem is not None:
+            tool_sem.release()
+        global_sem.release()
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        name = request.tool_call["name"]
+        timeout = self._timeout_for(name)
+        global_sem, tool_sem = self._async_limits(name)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        # Waiting for a slot counts against the timeout, as in the sync path
+        try:
+            await asyncio.wait_for(self._acquire_async(global_sem, tool_sem), timeout)
+        except asyncio.TimeoutError:
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        try:
+            work = asyncio.ensure_future(handler(request))
+        except BaseException:
+            if tool_sem is not None:
+                tool_sem.release()
+            global_sem.release()
+            raise
+        # Slots are returned only when the work really finishes, mirroring the
+        # sync done-callback
+        work.add_done_callback(lambda done: self._release_async(global_sem, tool_sem, done))
+        try:
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            return await asyncio.wait_for(asyncio.shield(work), remaining)
+        except asyncio.TimeoutError:
+            # Cancelling a sync tool's coroutine does not stop its worker thread;
+            # let it finish and keep counting against the cap meanwhile
+            if not _runs_in_thread(request.tool):
+                work.cancel()
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+
+
+class BudgetState(AgentState):
+    """Agent state with the private start time used by ``SubagentBudgetMiddleware``."""
+
+    budget_started_at: NotRequired[Annotated[float, PrivateStateAttr]]
+
+
+class SubagentBudgetMiddleware(AgentMiddleware):
+    """Stop a subagent once it exceeds its time or token budget.
+
+    The budget is checked before every model call. When it is exhausted the
+    subagent ends with a final message that carries its latest findings, so
+    the parent still receives a usable ``task`` result.
+
+    Args:
+        max_seconds: Wall-clock budget per subagent invocation.
+        max_tokens: Total token budget per subagent invocation.
+    """
+
+    state_schema = BudgetState
+
+    def __init__(self, max_seconds: float | None = None, max_tokens: int | None = None) -> None:
+        super().__init__()
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+
+    def before_agent(self, state: BudgetState, runtime: Runtime[Any]) -> dict[str, Any] | None:  # noqa: ARG002
+        return {"budget_started_at": time.monotonic()}
+
+    def _exceeded(self, state: BudgetState) -> str | None:
+        started_at = state.get("budget_started_at")
+        if self.max_seconds and started_at is not None:
+            if time.monotonic() - started_at > self.max_seconds:
+                return f"time budget of {self.max_seconds:g}s"
+        if self.max_tokens:
+            used = sum(
+                (message.usage_metadata or {}).get("total_tokens", 0)
+                for message in state["messages"]
+                if isinstance(message, AIMessage)
+            )
+            if used > self.max_tokens:
+                return f"token budget of {self.max_tokens} tokens"
+        return None
+
+    @hook_config(can_jump_to=["end"])
+    def before_model(self, state: BudgetState, runtime: Runtime[Any]) -> dict[str, Any] | None:  # noqa: ARG002
+        reason = self._exceeded(state)
+        if reason is None:
+            return None
+        findings = next(
+            (m.text for m in reversed(state["messages"]) if isinstance(m, AIMessage) and m.text),
+            "",
+        )
+        content = f"Stopped early: exceeded the {reason}."
+        if findings:
+            content += f" Latest findings:\n\n{findings}"
+        return {"messages": [AIMessage(content=content)], "jump_to": "end"}
+
+
+# A step that only follows todo updates rarely needs the main model
+DEFAULT_CHEAP_TOOLS = frozenset({"write_todos"})
+
+
+class ModelRoutingMiddleware(AgentMiddleware):
+    """Route cheap model steps to a smaller model.
+
+    A step is cheap when every tool result since the last AI message comes
+    from ``cheap_tools`` (by default only ``write_todos``).
+
+    Args:
+        cheap_model: Model used for cheap steps.
+        cheap_tools: Tool names whose results mark a step as cheap.
+    """
+
+    def __init__(
+        self, cheap_model: BaseChatModel, cheap_tools: frozenset[str] = DEFAULT_CHEAP_TOOLS
+    ) -> None:
+        super().__init__()
+        self.cheap_model = cheap_model
+        self.cheap_tools = cheap_tools
+
+    def _is_cheap_step(self, request: ModelRequest) -> bool:
+        results: list[ToolMessage] = []
+        for message in reversed(request.messages):
+            if isinstance(message, AIMessage):
+                break
+            if not isinstance(message, ToolMessage):
+                return False
+            results.append(message)
+        return bool(results) and all(message.name in self.cheap_tools for message in results)
+
+    def _route(self, request: ModelRequest) -> ModelRequest:
+        if self._is_cheap_step(request):
+            return request.override(model=self.cheap_model)
+        return request
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        return handler(self._route(request))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        return await handler(self._route(request))
+
+
+def _tool_name(tool: Any) -> str:
+    return tool.name if hasattr(tool, "name") else tool.get("name", "")
+
+
+class PromptCacheMiddleware(AgentMiddleware):
+    """Keep the request prefix byte-identical so provider prompt caches hit.
+
+    Providers cache the longest exact prefix of a request (tool schemas and
+    system prompt first, then messages). Tools are sorted by name so their
+    schemas serialize the same way whatever order middleware registered them
+    in, and OpenAI requests get a ``prompt_cache_key`` derived from the prefix
+    so calls sharing it are routed to the same cache. Add this middleware last
+    so it sees the final system prompt, tools and model.
+
+    Args:
+        cache_key_routing: Send ``prompt_cache_key`` on OpenAI models.
+    """
+
+    def __init__(self, cache_key_routing: bool = True) -> None:
+        super().__init__()
+        self.cache_key_routing = cache_key_routing
+
+    def _stabilize(self, request: ModelRequest) -> ModelRequest:
+        tools = sorted(request.tools, key=_tool_name)
+        overrides: dict[str, Any] = {"tools": tools}
+        if self.cache_key_routing and isinstance(request.model, BaseChatOpenAI):
+            prefix = "\n".join([request.system_prompt or "", *(_tool_name(tool) for tool in tools)])
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:32]
+            overrides["model_settings"] = {"prompt_cache_key": key, **request.model_settings}
+        return request.override(**overrides)
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        return handler(self._stabilize(request))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        return await handler(self._stabilize(request))
+
+
+EVICTED_RESULT_MESSAGE = """Tool result too large ({size} bytes); the full output was saved to {path}.
+Read it in slices with read_file (offset/limit) when you need details; do not read it whole.
+Head and tail preview:
+{preview}"""
+
+
+def preview_text(content: str, head_lines: int = 20, tail_lines: int = 10, max_line_chars: int = 500) -> str:
+    """Return the first and last lines of ``content``, truncating long lines."""
+    lines = content.splitlines()
+    if len(lines) > head_lines + tail_lines:
+        omitted = len(lines) - head_lines - tail_lines
+        lines = [*lines[:head_lines], f"... ({omitted} lines omitted) ...", *lines[-tail_lines:]]
+    return "\n".join(line if len(line) <= max_line_chars else line[:max_line_chars] + "…" for line in lines)
+
+
+class ToolResultEvictionMiddleware(AgentMiddleware):
+    """Write oversized tool results to the backend and keep only a preview.
+
+    Each result is checked as soon as its tool call finishes, so large
+    outputs never enter the message list or checkpoints. The model gets a
+    head/tail preview plus the file path; the path and size are recorded in
+    ``ToolMessage.response_metadata["evicted"]``. Place it before
+    ``ToolConcurrencyMiddleware`` so the write runs outside the timed call.
+    Subagents evict into the same backend; their files are returned with the
+    task result's state update, while the ``evicted`` metadata stays in the
+    subagent's own messages.
+
+    Args:
+        backend: Backend instance or factory (as passed to ``create_deep_agent``).
+        max_tokens: Results above this many tokens (4 chars per token) are evicted.
+        directory: Backend directory for evicted results.
+    """
+
+    def __init__(self, backend: BACKEND_TYPES, max_tokens: int, directory: str = "/outputs") -> None:
+        super().__init__()
+        self.backend = backend
+        self.max_chars = max_tokens * 4
+        self.directory = directory.rstrip("/")
+
+    def _resolve_backend(self, request: ToolCallRequest) -> BackendProtocol:
+        return self.backend(request.runtime) if callable(self.backend) else self.backend
+
+    def _write(self, backend: BackendProtocol, tool_call_id: str, content: str) -> Any:
+        name = sanitize_tool_call_id(tool_call_id)
+        result = backend.write(f"{self.directory}/{name}.txt", content)
+        if result.error:
+            # The file already exists (e.g. a replayed call); use a fresh name
+            result = backend.write(f"{self.directory}/{name}-{uuid.uuid4().hex[:8]}.txt", content)
+        return None if result.error else result
+
+    def _evict(self, backend: BackendProtocol, message: ToolMessage) -> tuple[ToolMessage, dict | None]:
+        content = message.content
+        if not isinstance(content, str) or len(content) <= self.max_chars:
+            return message, None
+        result = self._write(backend, message.tool_call_id, content)
+        if result is None:
+            return message, None
+        size = len(content.encode("utf-8"))
+        evicted = ToolMessage(
+            content=EVICTED_RESULT_MESSAGE.format(size=size, path=result.path, preview=preview_text(content)),
+            tool_call_id=message.tool_call_id,
+            name=message.name,
+            id=message.id,
+            status=message.status,
+            artifact=message.artifact,
+            response_metadata={**message.response_metadata, "evicted": {"path": result.path, "size": size}},
+        )
+        return evicted, result.files_update
+
+    def _process(self, request: ToolCallRequest, result: ToolMessage | Command) -> ToolMessage | Command:
+        if isinstance(result, ToolMessage):
+            if not isinstance(result.content, str) or len(result.content) <= self.max_chars:
+                return result
+            message, files_update = self._evict(self._resolve_backend(request), result)
+            # State-backed files must be written through the graph state
+            return Command(update={"files": files_update, "messages": [message]}) if files_update else message
+        if isinstance(result, Command) and isinstance(result.update, dict) and result.update.get("messages"):
+            backend = self._resolve_backend(request)
+            files = dict(result.update.get("files") or {})
+            messages = []
+            for message in result.update["messages"]:
+                if isinstance(message, ToolMessage):
+                    message, files_update = self._evict(backend, message)
+                    files.update(files_update or {})
+                messages.append(message)
+            update = {**result.update, "messages": messages, **({"files": files} if files else {})}
+            return Command(graph=result.graph, update=update, resume=result.resume, goto=result.goto)
+        return result
+
+    def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], ToolMessage | Command],
+    ) -> ToolMessage | Command:
+        return self._process(request, handler(request))
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        result = await handler(request)
+        # File writes run in a thread so other tool calls on the loop keep going
+        return await asyncio.to_thread(self._process, request, result)
@@ -0,0 +1,64 @@
+"""Memoized registry of compiled agent graphs."""
+
+import hashlib
+import threading
+from collections.abc import Callable, Hashable, Sequence
+from typing import Any, NamedTuple
+
+
+class AgentKey(NamedTuple):
+    """Identity of a compiled agent graph."""
+
+    model: str
+    tools: tuple[str, ...]
+    prompt: str
+    backend: str
+
+
+def make_agent_key(model: str, tools: Sequence[Any], prompt: str, backend: str) -> AgentKey:
+    """Build a registry key from the inputs that shape the compiled graph.
+
+    Args:
+        model: Model identifier, e.g. ``"openai:gpt-4o-mini"``.
+        tools: Tools bound to the agent; only their names are used.
+        prompt: System prompt; stored as a digest.
+        backend: Backend description, e.g. ``"filesystem:/abs/workspace"``.
+
+    Returns:
+        A hashable key for ``AgentRegistry``.
+    """
+    names = tuple(sorted(getattr(tool, "name", None) or tool.__name__ for tool in tools))
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    return AgentKey(model=model, tools=names, prompt=digest, backend=backend)
+
+
+class AgentRegistry:
+    """Thread-safe cache of compiled graphs, built on first use.
+
+    Building a deep agent sets up the model client, generates tool schemas and
+    compiles the graph, so each distinct key is built once and reused.
+    """
+
+    def __init__(self) -> None:
+        self._agents: dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Return the graph for ``key``, building it with ``build`` if missing."""
+        agent = self._agents.get(key)
+        if agent is not None:
+            return agent
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                agent = build()
+                self._agents[key] = agent
+            return agent
+
+    def clear(self) -> None:
+        """Drop all cached graphs."""
+        with self._lock:
+            self._agents.clear()
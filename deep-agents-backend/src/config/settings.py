@@ -22,14 +22,66 @@ class Settings(BaseSettings):
     # Search Tool API Key
     tavily_api_key: str | None = None
 
+    # Search HTTP client (pooled, shared by all calls)
+    search_timeout_seconds: float = 30.0
+    search_max_concurrency: int = 8
+
+    # Search Result Cache (ttl 0 disables caching)
+    search_cache_ttl_seconds: int = 3600
+    search_cache_max_entries: int = 512
+    search_cache_path: str | None = None
+
     # Agent Configuration
     default_model: str = "openai:gpt-4o-mini"
+    # Smaller model for cheap steps (e.g. right after a todo update); None disables routing
+    cheap_model: str | None = None
+    # Extra models a run may select via ``configurable.model``; default, cheap and compaction
+    # models are always allowed. Each allowed model keeps one client and one compiled graph.
+    allowed_models: list[str] = []
+    # Input/output price in USD per million tokens, for cost counters
+    model_prices: dict[str, tuple[float, float]] = {}
+    # Send a prompt_cache_key derived from the stable prefix on OpenAI requests
+    prompt_cache_key: bool = True
     max_recursion_limit: int = 100
 
+    # Context compaction: summarize older messages above compaction_trigger_tokens
+    # (0 disables), starting in the background at compaction_prefetch_ratio of it.
+    # Keep the trigger below deepagents' built-in 170k summarization.
+    compaction_trigger_tokens: int = 150000
+    compaction_prefetch_ratio: float = 0.8
+    compaction_keep_messages: int = 6
+    # Model that writes summaries; defaults to cheap_model, then the agent's model
+    compaction_model: str | None = None
+
+    # Tool results above this many tokens (~4 chars each) are written to
+    # evicted_results_dir and replaced by a head/tail preview (0 disables)
+    max_tokens_result_to_file: int = 20000
+    evicted_results_dir: str = "/outputs"
+
+    # Tool Execution (parallel tool calls within one model step)
+    tool_max_concurrency: int = 8
+    tool_concurrency_limits: dict[str, int] = {}
+    tool_timeout_seconds: float = 60.0
+    # Per-tool timeout overrides; 0 disables the timeout (e.g. for `task`)
+    tool_timeouts: dict[str, float] = {"task": 0}
+
+    # Subagent fan-out: concurrent `task` calls and per-subagent budgets
+    subagent_max_concurrency: int = 4
+    subagent_max_seconds: float = 300.0
+    subagent_max_tokens: int = 200_000
+
     # Backend Configuration
     backend_type: Literal["state", "filesystem"] = "filesystem"
     filesystem_root_dir: str = "./workspace"
 
+    # Checkpointer Configuration ("none" when served by the LangGraph server,
+    # which provides its own persistence)
+    checkpointer_type: Literal["none", "sqlite", "postgres"] = "none"
+    checkpoint_sqlite_path: str = "./workspace/.checkpoints.db"
+    checkpoint_postgres_url: str | None = None
+    checkpoint_pool_size: int = 10
+    checkpoint_retention: int = 20
+
     @property
     def model_provider(self) -> str:
         """Extract model provider from default_model string."""
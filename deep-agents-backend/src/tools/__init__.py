@@ -1,6 +1,7 @@
 """Tools module - Custom tools for the Deep Agent."""
 
-from src.tools.search import internet_search
+from src.tools.cache import TTLCache
+from src.tools.search import get_search_cache, internet_search
 
-__all__ = ["internet_search"]
+__all__ = ["TTLCache", "get_search_cache", "internet_search"]
 
@@ -0,0 +1,253 @@
+"""In-memory TTL cache with request coalescing for tool results."""
+
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable
+
+# Handed to waiters when the owning call is cancelled rather than failed: they
+# race to re-claim the key and one of them performs the fetch instead.
+_RETRY = object()
+
+
+def search_cache_key(query: str, topic: str, max_results: int, include_raw_content: bool) -> tuple:
+    """Build a cache key from search arguments.
+
+    Queries that only differ in case or whitespace map to the same key.
+    """
+    normalized = " ".join(query.split()).casefold()
+    return (normalized, topic, int(max_results), bool(include_raw_content))
+
+
+class TTLCache:
+    """Size-bounded LRU cache with per-entry TTL and in-flight request coalescing.
+
+    Concurrent lookups of the same missing key share a single upstream call.
+    Failures are not cached; the exception is raised to every waiter. If the
+    owning call is cancelled, waiters are unaffected and one of them retries.
+    When ``persist_path`` is set, entries are saved as JSON (off the event loop
+    on the async path) and reloaded on start. Writes are debounced: at most one
+    per ``persist_interval``, with ``flush`` saving the remainder at shutdown.
+
+    Args:
+        ttl_seconds: Lifetime of a cached entry.
+        max_entries: Maximum number of entries before LRU eviction.
+        persist_path: Optional JSON file used to persist entries.
+        persist_interval: Minimum seconds between two writes of the file.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        persist_path: str | Path | None = None,
+        persist_interval: float = 30.0,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.persist_interval = persist_interval
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Version of the in-memory entries and of the last snapshot written
+        self._version = 0
+        self._saved_version = 0
+        self._saved_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+    def _lookup(self, key: Hashable) -> tuple[bool, Any]:
+        """Look up a key; must be called with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _claim(self, key: Hashable) -> tuple[bool, Any, Future, bool]:
+        """Return ``(hit, value, future, owner)``; the owner performs the upstream call."""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return True, value, None, False  # type: ignore[return-value]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, None, future, False
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return False, None, future, True
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._version += 1
+
+    def _persist(self) -> None:
+        """Write the latest snapshot; queued calls that find it already saved return early."""
+        if self.persist_path is None:
+            return
+        # Snapshot and write under one lock so an older snapshot never wins
+        with self._save_lock:
+            with self._lock:
+                if self._saved_version == self._version:
+                    return
+                version = self._version
+                snapshot = list(self._entries.items())
+            self._save(snapshot)
+            self._saved_version = version
+            self._saved_at = time.monotonic()
+
+    def _persist_due(self) -> bool:
+        """Whether there are unsaved changes and the debounce interval has passed."""
+        return (
+            self.persist_path is not None
+            and self._saved_version != self._version
+            and time.monotonic() - self._saved_at >= self.persist_interval
+        )
+
+    def flush(self) -> None:
+        """Write unsaved changes now; call at shutdown."""
+        self._persist()
+
+    def _settle(self, key: Hashable, future: Future, value: Any = None, error: BaseException | None = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value or call ``fetch``, sharing in-flight calls."""
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if not owner:
+                value = future.result()
+                if value is _RETRY:
+                    continue
+                return value
+            try:
+                value = fetch()
+            except Exception as exc:
+                self._settle(key, future, error=exc)
+                raise
+            except BaseException:
+                self._settle(key, future, _RETRY)
+                raise
+            self._store(key, value)
+            self._settle(key, future, value)
+            if self._persist_due():
+                self._persist()
+            return value
+
+    async def aget_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Async variant of ``get_or_fetch``; shares entries and in-flight calls with it.
+
+        Cancelling a waiter only affects that waiter (the shared future is
+        shielded). Cancelling the owner hands waiters a retry signal, and the
+        first to re-claim the key performs the fetch.
+        """
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if not owner:
+                value = await asyncio.shield(asyncio.wrap_future(future))
+                if value is _RETRY:
+                    continue
+                return value
+            try:
+                value = await fetch()
+            except Exception as exc:
+                self._settle(key, future, error=exc)
+                raise
+            except BaseException:
+                # CancelledError belongs to this call and must not reach other runs
+                self._settle(key, future, _RETRY)
+                raise
+            self._store(key, value)
+            self._settle(key, future, value)
+            if self._persist_due():
+                # Write off the event loop; waiters already have their result
+                await asyncio.to_thread(self._persist)
+            return value
+
+    def _load(self) -> None:
+        if self.persist_path is None or not self.persist_path.exists():
+            return
+        try:
+            rows = json.loads(self.persist_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(rows, list):
+            return
+        now = time.time()
+        for row in rows:
+            # Skip malformed rows instead of discarding the whole file
+            try:
+                key, expires_at, value = row
+                if float(expires_at) > now:
+                    self._entries[tuple(key)] = (float(expires_at), value)
+            except (TypeError, ValueError):
+                continue
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self, snapshot: list) -> None:
+        """Write entries atomically; persistence errors never affect lookups."""
+        rows = [[list(key), expires_at, value] for key, (expires_at, value) in snapshot]
+        tmp_path = None
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.persist_path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.persist_path)
+            tmp_path = None
+        except OSError:
+            return
+        finally:
+            # Never leave a partial temp file behind when the write or rename fails
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_path)
@@ -1,14 +1,34 @@
 """Web search tool using Tavily API."""
 
+import atexit
+from functools import lru_cache
 from typing import Literal
 
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
 
 from src.config import get_settings
+from src.tools.cache import TTLCache, search_cache_key
+from src.tools.tavily_client import get_search_client
 
 
-@tool
-def internet_search(
+@lru_cache
+def get_search_cache() -> TTLCache | None:
+    """Get the shared search result cache, or None when caching is disabled."""
+    settings = get_settings()
+    if settings.search_cache_ttl_seconds <= 0:
+        return None
+    cache = TTLCache(
+        ttl_seconds=settings.search_cache_ttl_seconds,
+        max_entries=settings.search_cache_max_entries,
+        persist_path=settings.search_cache_path,
+    )
+    if cache.persist_path is not None:
+        # Writes are debounced; save whatever is left when the server exits
+        atexit.register(cache.flush)
+    return cache
+
+
+def _search(
     query: str,
     max_results: int = 5,
     topic: Literal["general", "news", "finance"] = "general",
@@ -26,22 +46,59 @@ def internet_search(
     Returns:
         Search results containing titles, URLs, and content snippets
     """
-    settings = get_settings()
-
-    if not settings.tavily_api_key:
+    if not get_settings().tavily_api_key:
         return {"error": "Tavily API key not configured"}
 
+    def fetch() -> dict:
+        return get_search_client().search(
+            query=query,
+            max_results=max_results,
+            topic=topic,
+            include_raw_content=include_raw_content,
+        )
+
     try:
-        from tavily import TavilyClient
+        cache = get_search_cache()
+        if cache is None:
+            return fetch()
+        key = search_cache_key(query, topic, max_results, include_raw_content)
+        return cache.get_or_fetch(key, fetch)
+    except Exception as e:
+        return {"error": f"Search failed: {str(e)}"}
+
+
+async def _asearch(
+    query: str,
+    max_results: int = 5,
+    topic: Literal["general", "news", "finance"] = "general",
+    include_raw_content: bool = False,
+) -> dict:
+    """Async counterpart of ``_search`` that never blocks the event loop."""
+    if not get_settings().tavily_api_key:
+        return {"error": "Tavily API key not configured"}
 
-        client = TavilyClient(api_key=settings.tavily_api_key)
-        results = client.search(
+    async def fetch() -> dict:
+        return await get_search_client().asearch(
             query=query,
             max_results=max_results,
             topic=topic,
             include_raw_content=include_raw_content,
         )
-        return results
+
+    try:
+        cache = get_search_cache()
+        if cache is None:
+            return await fetch()
+        key = search_cache_key(query, topic, max_results, include_raw_content)
+        return await cache.aget_or_fetch(key, fetch)
     except Exception as e:
         return {"error": f"Search failed: {str(e)}"}
 
+
+# Sync and async implementations behind one tool: ainvoke runs the coroutine
+# on the event loop instead of a worker thread.
+internet_search = StructuredTool.from_function(
+    func=_search,
+    coroutine=_asearch,
+    name="internet_search",
+)
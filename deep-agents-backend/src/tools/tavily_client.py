@@ -0,0 +1,142 @@
+"""Pooled Tavily search client shared by all tool calls."""
+
+import asyncio
+import threading
+import weakref
+from functools import lru_cache
+from typing import Any
+
+import httpx
+
+from src.config import get_settings
+
+TAVILY_BASE_URL = "https://api.tavily.com"
+
+
+class TavilySearchClient:
+    """Keep-alive HTTP client for the Tavily search API.
+
+    One sync and one async ``httpx`` client are reused across calls so
+    connections stay pooled. Each request uses the configured timeout, and a
+    semaphore bounds how many searches run at once.
+
+    Args:
+        api_key: Tavily API key.
+        timeout: Per-request timeout in seconds.
+        max_concurrency: Maximum number of in-flight searches.
+        base_url: Tavily API base URL.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float,
+        max_concurrency: int,
+        base_url: str = TAVILY_BASE_URL,
+    ) -> None:
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.base_url = base_url
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._limits = httpx.Limits(
+            max_connections=max_concurrency,
+            max_keepalive_connections=max_concurrency,
+        )
+        self._client: httpx.Client | None = None
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+        # An AsyncClient and a Semaphore only work on the loop that first used them, so each
+        # event loop (e.g. a new one per ``asyncio.run``) gets its own pair
+        self._async_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, tuple[httpx.AsyncClient, asyncio.Semaphore]
+        ] = weakref.WeakKeyDictionary()
+        self._init_lock = threading.Lock()
+
+    def _payload(
+        self, query: str, max_results: int, topic: str, include_raw_content: bool
+    ) -> dict[str, Any]:
+        return {
+            "query": query,
+            "max_results": max_results,
+            "topic": topic,
+            "include_raw_content": include_raw_content,
+        }
+
+    def _get_client(self) -> httpx.Client:
+        with self._init_lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    base_url=self.base_url,
+                    headers=self._headers,
+                    timeout=self.timeout,
+                    limits=self._limits,
+                )
+            return self._client
+
+    def _get_async_client(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        with self._init_lock:
+            pair = self._async_clients.get(loop)
+            if pair is None:
+                client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers=self._headers,
+                    timeout=self.timeout,
+                    limits=self._limits,
+                )
+                pair = (client, asyncio.Semaphore(self.max_concurrency))
+                self._async_clients[loop] = pair
+            return pair
+
+    def search(
+        self,
+        query: str,
+        max_results: int = 5,
+        topic: str = "general",
+        include_raw_content: bool = False,
+    ) -> dict:
+        """Run a blocking search."""
+        client = self._get_client()
+        with self._sync_semaphore:
+            response = client.post(
+                "/search", json=self._payload(query, max_results, topic, include_raw_content)
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def asearch(
+        self,
+        query: str,
+        max_results: int = 5,
+        topic: str = "general",
+        include_raw_content: bool = False,
+    ) -> dict:
+        """Run a search without blocking the event loop."""
+        client, semaphore = self._get_async_client()
+        async with semaphore:
+            response = await client.post(
+                "/search", json=self._payload(query, max_results, topic, include_raw_content)
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self) -> None:
+        """Close the pooled connections (the async ones of the running loop)."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        with self._init_lock:
+            pair = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if pair is not None:
+            await pair[0].aclose()
+
+
+@lru_cache
+def get_search_client() -> TavilySearchClient:
+    """Get the shared Tavily search client."""
+    settings = get_settings()
+    return TavilySearchClient(
+        api_key=settings.tavily_api_key or "",
+        timeout=settings.search_timeout_seconds,
+        max_concurrency=settings.search_max_concurrency,
+    )
@@ -0,0 +1,23 @@
+"""Custom HTTP routes mounted alongside the LangGraph server API."""
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from src.agent.models import get_model_pool
+from src.tools import get_search_cache
+
+
+async def stats(request: Request) -> JSONResponse:
+    """Per-model usage counters and search cache statistics."""
+    cache = get_search_cache()
+    return JSONResponse(
+        {
+            "models": get_model_pool().stats(),
+            "search_cache": cache.stats() if cache is not None else None,
+        }
+    )
+
+
+app = Starlette(routes=[Route("/stats", stats, methods=["GET"])])
@@ -22,6 +22,66 @@ class TestDeepAgent:
         assert hasattr(agent, "invoke")
         assert hasattr(agent, "stream")
 
+    def test_eviction_wraps_tool_concurrency(self, monkeypatch):
+        """Evicted results are written after the timed tool call returns."""
+        from src.agent import deep_agent
+        from src.agent.middleware import ToolConcurrencyMiddleware, ToolResultEvictionMiddleware
+
+        captured = {}
+        monkeypatch.setattr(deep_agent, "create_deep_agent", lambda **kwargs: captured.update(kwargs))
+        deep_agent.create_agent()
+
+        kinds = [type(m) for m in captured["middleware"]]
+        assert kinds.index(ToolResultEvictionMiddleware) < kinds.index(ToolConcurrencyMiddleware)
+
+    @pytest.fixture
+    def allowed_models(self, monkeypatch):
+        """Allow one extra model besides the default."""
+        from src.agent.models import get_model_pool
+        from src.config import get_settings
+
+        monkeypatch.setenv("ALLOWED_MODELS", '["openai:gpt-4o"]')
+        get_settings.cache_clear()
+        get_model_pool.cache_clear()
+        yield
+        get_settings.cache_clear()
+        get_model_pool.cache_clear()
+
+    def test_get_agent_is_memoized(self, allowed_models):
+        """Test that compiled graphs are reused per model and built lazily."""
+        from src.agent import deep_agent
+
+        deep_agent._registry.clear()
+        default = deep_agent.get_agent()
+        assert deep_agent.get_agent() is default
+        assert deep_agent.make_graph({"configurable": {}}) is default
+
+        other = deep_agent.make_graph({"configurable": {"model": "openai:gpt-4o"}})
+        assert other is not default
+        assert deep_agent.get_agent("openai:gpt-4o") is other
+        assert len(deep_agent._registry) == 2
+
+    def test_unknown_model_is_rejected(self, allowed_models):
+        """Test that models outside the allowlist build neither a client nor a graph."""
+        from src.agent import deep_agent
+        from src.agent.models import get_model_pool
+
+        deep_agent._registry.clear()
+        with pytest.raises(ValueError, match="not enabled"):
+            deep_agent.make_graph({"configurable": {"model": "openai:gpt-unknown"}})
+        assert len(deep_agent._registry) == 0
+        assert get_model_pool().stats() == {}
+        # Provider defaults to openai, so both spellings share one graph
+        assert deep_agent.get_agent("gpt-4o") is deep_agent.get_agent("openai:gpt-4o")
+
+    def test_graph_attribute_is_lazy(self):
+        """Test that the module-level graph resolves through the registry."""
+        from src.agent import deep_agent
+
+        deep_agent._registry.clear()
+        assert len(deep_agent._registry) == 0
+        assert deep_agent.graph is deep_agent.get_agent()
+
     @pytest.mark.skip(reason="Requires real OpenAI credentials for integration testing")
     @pytest.mark.asyncio
     async def test_agent_invoke(self):
@@ -0,0 +1,87 @@
+"""Tests for the async checkpointer and checkpoint retention."""
+
+import asyncio
+import operator
+from typing import Annotated, TypedDict
+
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite")
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import END, START, StateGraph
+
+from src.agent.checkpoint import AsyncCheckpointer
+
+
+async def _put(saver: AsyncCheckpointer, thread_id: str, ns: str, count: int) -> list[str]:
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns}}
+    ids = []
+    for _ in range(count):
+        checkpoint = empty_checkpoint()
+        config = await saver.aput(config, checkpoint, {}, {})
+        await saver.aput_writes(config, [("messages", "x")], task_id="t")
+        ids.append(checkpoint["id"])
+    return ids
+
+
+class _State(TypedDict):
+    steps: Annotated[list[int], operator.add]
+
+
+def _graph(checkpointer):
+    builder = StateGraph(_State)
+    builder.add_node("step", lambda state: {"steps": [len(state["steps"])]})
+    builder.add_edge(START, "step")
+    builder.add_edge("step", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def test_graph_resumes_across_event_loops(tmp_path):
+    """ainvoke works with the async saver, and a later loop sees the thread's state."""
+    checkpointer = AsyncCheckpointer("sqlite", str(tmp_path / "checkpoints.db"))
+    graph = _graph(checkpointer)
+    config = {"configurable": {"thread_id": "t1"}}
+
+    async def run():
+        try:
+            return await graph.ainvoke({"steps": []}, config)
+        finally:
+            await checkpointer.aclose()
+
+    assert asyncio.run(run())["steps"] == [0]
+
+    reopened = AsyncCheckpointer("sqlite", str(tmp_path / "checkpoints.db"))
+
+    async def resume():
+        try:
+            return await _graph(reopened).ainvoke({"steps": []}, config)
+        finally:
+            await reopened.aclose()
+
+    assert asyncio.run(resume())["steps"] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_prune_keeps_newest_per_namespace(tmp_path):
+    """Each namespace keeps its own newest checkpoints and no orphaned writes."""
+    saver = AsyncCheckpointer("sqlite", str(tmp_path / "checkpoints.db"))
+    try:
+        root = await _put(saver, "t1", "", 4)
+        sub = await _put(saver, "t1", "task:abc", 3)
+        other = await _put(saver, "t2", "", 3)
+
+        await saver.aprune("t1", keep=2)
+
+        conn = saver._conn
+        async with conn.execute("SELECT thread_id, checkpoint_ns, checkpoint_id FROM checkpoints") as cur:
+            kept = set(await cur.fetchall())
+        assert kept == {
+            *(("t1", "", cid) for cid in root[-2:]),
+            *(("t1", "task:abc", cid) for cid in sub[-2:]),
+            *(("t2", "", cid) for cid in other),
+        }
+        async with conn.execute("SELECT DISTINCT thread_id, checkpoint_ns, checkpoint_id FROM writes") as cur:
+            assert set(await cur.fetchall()) == kept
+    finally:
+        await saver.aclose()
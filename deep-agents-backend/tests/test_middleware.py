@@ -0,0 +1,426 @@
+"""Tests for agent middleware."""
+
+import asyncio
+import gc
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from langchain.agents import create_agent
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+
+class FakeToolCallingModel(GenericFakeChatModel):
+    """Fake chat model that accepts tool binding."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@tool
+async def wait(seconds: float) -> str:
+    """Sleep for the given number of seconds."""
+    await asyncio.sleep(seconds)
+    return f"waited {seconds}"
+
+
+def _model(durations: list[float]) -> FakeToolCallingModel:
+    tool_calls = [
+        {"name": "wait", "args": {"seconds": seconds}, "id": f"call_{i}"}
+        for i, seconds in enumerate(durations)
+    ]
+    return FakeToolCallingModel(
+        messages=iter([AIMessage(content="", tool_calls=tool_calls), AIMessage(content="done")])
+    )
+
+
+async def _tool_messages(agent) -> list:
+    """Collect tool messages in the order they are streamed."""
+    messages = []
+    async for chunk in agent.astream({"messages": [("user", "go")]}, stream_mode="updates"):
+        for update in chunk.values():
+            for message in (update or {}).get("messages", []):
+                if message.type == "tool":
+                    messages.append(message)
+    return messages
+
+
+class TestToolConcurrencyMiddleware:
+    """Test cases for ToolConcurrencyMiddleware."""
+
+    @pytest.mark.asyncio
+    async def test_parallel_results_stream_as_they_finish(self):
+        """Independent tool calls run concurrently and stream in completion order."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        agent = create_agent(
+            _model([0.3, 0.1, 0.2]),
+            tools=[wait],
+            middleware=[ToolConcurrencyMiddleware(max_concurrency=8, default_timeout=5)],
+        )
+        start = time.perf_counter()
+        messages = await _tool_messages(agent)
+        elapsed = time.perf_counter() - start
+
+        assert [m.tool_call_id for m in messages] == ["call_1", "call_2", "call_0"]
+        assert elapsed < 0.55
+
+    @pytest.mark.asyncio
+    async def test_per_tool_limit_and_timeout(self):
+        """Per-tool limits serialize calls and slow calls time out with an error."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        agent = create_agent(
+            _model([0.1, 0.1, 1.0]),
+            tools=[wait],
+            middleware=[
+                ToolConcurrencyMiddleware(
+                    max_concurrency=8, per_tool_limits={"wait": 1}, timeouts={"wait": 0.5}
+                )
+            ],
+        )
+        start = time.perf_counter()
+        messages = await _tool_messages(agent)
+        elapsed = time.perf_counter() - start
+
+        statuses = {m.tool_call_id: m.status for m in messages}
+        assert statuses == {"call_0": "success", "call_1": "success", "call_2": "error"}
+        assert elapsed >= 0.2
+
+
+    def test_timed_out_sync_tools_keep_their_slot_until_they_finish(self):
+        """A hung sync tool counts against the cap until its worker thread exits."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        middleware = ToolConcurrencyMiddleware(max_concurrency=2, default_timeout=0.1)
+        release = threading.Event()
+        started = []
+
+        def hang(request):
+            started.append(request.tool_call["id"])
+            release.wait(5)
+            return "late"
+
+        def request(call_id):
+            return SimpleNamespace(tool_call={"name": "wait", "id": call_id})
+
+        try:
+            assert middleware.wrap_tool_call(request("a"), hang).status == "error"
+            assert middleware.wrap_tool_call(request("b"), hang).status == "error"
+            # Both slots are held by the hung workers: the next call times out without running
+            assert middleware.wrap_tool_call(request("c"), hang).status == "error"
+            assert started == ["a", "b"]
+
+            release.set()
+            deadline = time.monotonic() + 2
+            while middleware._sync_global._value < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert middleware._sync_global._value == 2
+            assert middleware.wrap_tool_call(request("d"), lambda r: "ok") == "ok"
+        finally:
+            release.set()
+            middleware.close()
+
+    @pytest.mark.asyncio
+    async def test_async_slot_wait_counts_against_timeout(self):
+        """An async call that cannot get a slot in time times out without running."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        middleware = ToolConcurrencyMiddleware(max_concurrency=1, default_timeout=0.1)
+        release = asyncio.Event()
+        started = []
+
+        async def hang(request):
+            started.append(request.tool_call["id"])
+            await release.wait()
+            return "late"
+
+        def request(call_id):
+            return SimpleNamespace(tool_call={"name": "wait", "id": call_id}, tool=wait)
+
+        try:
+            first = asyncio.create_task(middleware.awrap_tool_call(request("a"), hang))
+            await asyncio.sleep(0)
+            second = await middleware.awrap_tool_call(request("b"), hang)
+            assert second.status == "error"
+            assert started == ["a"]
+            # The timed-out async tool is cancelled; its slot returns once it has unwound
+            assert (await first).status == "error"
+            await asyncio.sleep(0.01)
+            global_sem, _ = middleware._async_limits("wait")
+            assert global_sem._value == 1
+        finally:
+            middleware.close()
+
+    @pytest.mark.asyncio
+    async def test_timed_out_thread_tools_keep_their_async_slot(self):
+        """A sync tool run on a thread holds its slot until the thread finishes."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        @tool
+        def block(seconds: float) -> str:
+            """Block the worker thread."""
+            release.wait(seconds)
+            return "late"
+
+        middleware = ToolConcurrencyMiddleware(max_concurrency=1, default_timeout=0.1)
+        release = threading.Event()
+        request = SimpleNamespace(tool_call={"name": "block", "id": "a"}, tool=block)
+
+        async def handler(req):
+            return await req.tool.ainvoke({"seconds": 5})
+
+        try:
+            assert (await middleware.awrap_tool_call(request, handler)).status == "error"
+            global_sem, _ = middleware._async_limits("block")
+            assert global_sem._value == 0
+            release.set()
+            for _ in range(200):
+                if global_sem._value == 1:
+                    break
+                await asyncio.sleep(0.01)
+            assert global_sem._value == 1
+        finally:
+            release.set()
+            middleware.close()
+
+    def test_async_semaphores_do_not_outlive_their_loop(self):
+        """Per-loop semaphores are dropped when the event loop goes away."""
+        from src.agent.middleware import ToolConcurrencyMiddleware
+
+        middleware = ToolConcurrencyMiddleware(max_concurrency=2)
+
+        async def touch():
+            middleware._async_limits("wait")
+
+        for _ in range(3):
+            asyncio.run(touch())
+        gc.collect()
+        assert len(middleware._async_semaphores) == 0
+        middleware.close()
+
+
+class TestSubagentBudgetMiddleware:
+    """Test cases for SubagentBudgetMiddleware."""
+
+    @pytest.mark.asyncio
+    async def test_token_budget_stops_agent(self):
+        """The agent ends with its latest findings once the token budget is spent."""
+        from src.agent.middleware import SubagentBudgetMiddleware
+
+        usage = {"input_tokens": 15, "output_tokens": 5, "total_tokens": 20}
+        model = FakeToolCallingModel(
+            messages=iter(
+                [
+                    AIMessage(
+                        content="Found part one.",
+                        tool_calls=[{"name": "wait", "args": {"seconds": 0}, "id": "call_0"}],
+                        usage_metadata=usage,
+                    ),
+                    AIMessage(content="Should not be reached."),
+                ]
+            )
+        )
+        agent = create_agent(
+            model, tools=[wait], middleware=[SubagentBudgetMiddleware(max_tokens=10)]
+        )
+        result = await agent.ainvoke({"messages": [("user", "go")]})
+
+        final = result["messages"][-1]
+        assert final.text.startswith("Stopped early: exceeded the token budget")
+        assert "Found part one." in final.text
+        assert "budget_started_at" not in result
+
+
+@tool
+def write_todos(todos: list[str]) -> str:
+    """Record the todo list."""
+    return "ok"
+
+
+class TestModelRoutingMiddleware:
+    """Test cases for ModelRoutingMiddleware."""
+
+    @pytest.mark.asyncio
+    async def test_step_after_todo_update_uses_cheap_model(self):
+        """Only the step following a write_todos result is routed to the cheap model."""
+        from src.agent.middleware import ModelRoutingMiddleware
+        from src.agent.models import ModelStats
+
+        main_stats, cheap_stats = ModelStats(), ModelStats()
+        todo_call = {"name": "write_todos", "args": {"todos": ["a"]}, "id": "call_0"}
+        wait_call = {"name": "wait", "args": {"seconds": 0}, "id": "call_1"}
+        main = FakeToolCallingModel(
+            messages=iter(
+                [
+                    AIMessage(content="", tool_calls=[todo_call]),
+                    AIMessage(content="done"),
+                ]
+            ),
+            callbacks=[main_stats],
+        )
+        cheap = FakeToolCallingModel(
+            messages=iter([AIMessage(content="", tool_calls=[wait_call])]),
+            callbacks=[cheap_stats],
+        )
+        agent = create_agent(
+            main, tools=[write_todos, wait], middleware=[ModelRoutingMiddleware(cheap)]
+        )
+        result = await agent.ainvoke({"messages": [("user", "go")]})
+
+        assert result["messages"][-1].text == "done"
+        assert main_stats.snapshot()["calls"] == 2
+        assert cheap_stats.snapshot()["calls"] == 1
+
+
+class TestPromptCacheMiddleware:
+    """Test cases for PromptCacheMiddleware."""
+
+    def _request(self, model, tool_order):
+        from langchain.agents.middleware import ModelRequest
+
+        tools = {"wait": wait, "write_todos": write_todos}
+        return ModelRequest(
+            model=model,
+            messages=[],
+            system_prompt="You are a deep agent.",
+            tools=[tools[name] for name in tool_order],
+            model_settings={},
+        )
+
+    def test_prefix_is_stable_across_tool_order(self):
+        """Tools are sorted and OpenAI requests share one prompt_cache_key."""
+        from langchain_openai import ChatOpenAI
+
+        from src.agent.middleware import PromptCacheMiddleware
+
+        middleware = PromptCacheMiddleware()
+        model = ChatOpenAI(model="gpt-4o-mini", api_key="test")
+        first = middleware._stabilize(self._request(model, ["write_todos", "wait"]))
+        second = middleware._stabilize(self._request(model, ["wait", "write_todos"]))
+
+        assert [t.name for t in first.tools] == [t.name for t in second.tools] == ["wait", "write_todos"]
+        assert first.model_settings["prompt_cache_key"] == second.model_settings["prompt_cache_key"]
+
+    def test_cache_key_only_for_openai_models(self):
+        """Other providers get sorted tools but no prompt_cache_key."""
+        from src.agent.middleware import PromptCacheMiddleware
+
+        model = FakeToolCallingModel(messages=iter([]))
+        request = PromptCacheMiddleware()._stabilize(self._request(model, ["write_todos", "wait"]))
+
+        assert "prompt_cache_key" not in request.model_settings
+
+    def test_cache_reads_are_counted(self):
+        """ModelStats reports cache reads from provider usage data."""
+        from langchain_core.outputs import ChatGeneration, LLMResult
+
+        from src.agent.models import ModelStats
+
+        stats = ModelStats()
+        message = AIMessage(
+            content="ok",
+            usage_metadata={
+                "input_tokens": 2000,
+                "output_tokens": 10,
+                "total_tokens": 2010,
+                "input_token_details": {"cache_read": 1536},
+            },
+        )
+        stats.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=None)
+
+        snapshot = stats.snapshot()
+        assert snapshot["cache_read_tokens"] == 1536
+        assert snapshot["cache_hit_ratio"] == 0.768
+
+
+class TestContextCompactionMiddleware:
+    """Test cases for ContextCompactionMiddleware."""
+
+    def test_background_summary_is_applied_on_next_run(self):
+        """A summary started past the soft threshold replaces old history in the next run."""
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        from src.agent.compaction import ContextCompactionMiddleware
+
+        summarizer = GenericFakeChatModel(messages=iter([AIMessage(content="summary text")]))
+        compaction = ContextCompactionMiddleware(
+            summarizer, trigger_tokens=1000, keep_messages=2, prefetch_ratio=0.1
+        )
+        model = FakeToolCallingModel(
+            messages=iter([AIMessage(content="first"), AIMessage(content="second")])
+        )
+        agent = create_agent(model, middleware=[compaction], checkpointer=InMemorySaver())
+        config = {"configurable": {"thread_id": "t1"}}
+
+        first = agent.invoke(
+            {"messages": [("user", "x" * 400), ("assistant", "ok"), ("user", "y" * 400)]}, config
+        )
+        assert "compaction" not in first
+        compaction._jobs["t1"].future.result(timeout=5)
+
+        second = agent.invoke({"messages": [("user", "next")]}, config)
+        messages = second["messages"]
+        assert "summary text" in messages[0].text
+        assert [m.text for m in messages[-3:]] == ["first", "next", "second"]
+        assert second["compaction"]["summarized_messages"] == 1
+        assert "t1" not in compaction._jobs
+
+    def test_pending_summaries_are_bounded(self):
+        """Summaries of threads that never come back are dropped oldest first."""
+        from langchain_core.messages import HumanMessage
+
+        from src.agent.compaction import ContextCompactionMiddleware
+
+        summarizer = GenericFakeChatModel(messages=iter([AIMessage(content="s")] * 10))
+        compaction = ContextCompactionMiddleware(
+            summarizer, trigger_tokens=1000, keep_messages=1, max_pending_jobs=2
+        )
+        history = [
+            HumanMessage("a", id="m1"),
+            AIMessage("b", id="m2"),
+            HumanMessage("c", id="m3"),
+        ]
+        for thread_id in ("t1", "t2", "t3"):
+            compaction._start_job(thread_id, history)
+        assert list(compaction._jobs) == ["t2", "t3"]
+
+
+@tool
+def dump(lines: int) -> str:
+    """Return a large text result."""
+    return "\n".join(f"row {i}" for i in range(lines))
+
+
+class TestToolResultEvictionMiddleware:
+    """Test cases for ToolResultEvictionMiddleware."""
+
+    @pytest.mark.asyncio
+    async def test_large_result_is_written_to_file(self, tmp_path):
+        """Oversized results are saved to the backend and replaced by a preview."""
+        from deepagents.backends import FilesystemBackend
+
+        from src.agent.middleware import ToolResultEvictionMiddleware
+
+        backend = FilesystemBackend(root_dir=str(tmp_path), virtual_mode=True)
+        tool_calls = [
+            {"name": "dump", "args": {"lines": 2000}, "id": "call_big"},
+            {"name": "dump", "args": {"lines": 3}, "id": "call_small"},
+        ]
+        model = FakeToolCallingModel(
+            messages=iter([AIMessage(content="", tool_calls=tool_calls), AIMessage(content="done")])
+        )
+        agent = create_agent(
+            model, tools=[dump], middleware=[ToolResultEvictionMiddleware(backend, max_tokens=1000)]
+        )
+        result = await agent.ainvoke({"messages": [("user", "go")]})
+
+        big, small = [m for m in result["messages"] if m.type == "tool"]
+        assert big.response_metadata["evicted"]["path"] == "/outputs/call_big.txt"
+        assert "row 0" in big.text and "row 1999" in big.text and "row 1000" not in big.text
+        assert (tmp_path / "outputs" / "call_big.txt").read_text() == dump.invoke({"lines": 2000})
+        assert small.text == "row 0\nrow 1\nrow 2"
+        assert "evicted" not in small.response_metadata
@@ -0,0 +1,295 @@
+"""Tests for the internet_search result cache."""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from src.tools.cache import TTLCache, search_cache_key
+
+
+class FakeTavilyClient:
+    """Tavily stand-in that counts upstream calls."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _result(self, query):
+        with self._lock:
+            self.calls += 1
+        return {"query": query, "results": [{"title": "t", "url": "https://example.com"}]}
+
+    def search(self, query, max_results=5, topic="general", include_raw_content=False):
+        result = self._result(query)
+        time.sleep(self.delay)
+        return result
+
+    async def asearch(self, query, max_results=5, topic="general", include_raw_content=False):
+        result = self._result(query)
+        await asyncio.sleep(self.delay)
+        return result
+
+
+@pytest.fixture
+def search_module(monkeypatch):
+    """Point internet_search at a fake client and a fresh cache."""
+    from src.config import get_settings
+    from src.tools import search
+
+    get_settings.cache_clear()
+    search.get_search_cache.cache_clear()
+    client = FakeTavilyClient(delay=0.05)
+    monkeypatch.setattr(search, "get_search_client", lambda: client)
+    yield search, client
+    search.get_search_cache.cache_clear()
+
+
+class TestTTLCache:
+    """Test cases for TTLCache."""
+
+    def test_key_normalization(self):
+        """Queries differing only in case/whitespace share a key."""
+        assert search_cache_key("  Deep   Agents ", "general", 5, False) == search_cache_key(
+            "deep agents", "general", 5, False
+        )
+        assert search_cache_key("deep agents", "news", 5, False) != search_cache_key(
+            "deep agents", "general", 5, False
+        )
+
+    def test_ttl_expiry(self):
+        """Expired entries are fetched again."""
+        cache = TTLCache(ttl_seconds=0.05, max_entries=10)
+        assert cache.get_or_fetch("k", lambda: 1) == 1
+        assert cache.get_or_fetch("k", lambda: 2) == 1
+        time.sleep(0.1)
+        assert cache.get_or_fetch("k", lambda: 3) == 3
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first."""
+        cache = TTLCache(ttl_seconds=60, max_entries=2)
+        cache.get_or_fetch("a", lambda: "a")
+        cache.get_or_fetch("b", lambda: "b")
+        cache.get_or_fetch("a", lambda: "stale")
+        cache.get_or_fetch("c", lambda: "c")
+        assert cache.get_or_fetch("a", lambda: "new") == "a"
+        assert cache.get_or_fetch("b", lambda: "new") == "new"
+        assert cache.stats()["evictions"] == 2
+
+    def test_errors_are_not_cached(self):
+        """A failed fetch is retried on the next lookup."""
+        cache = TTLCache(ttl_seconds=60, max_entries=10)
+
+        def boom():
+            raise RuntimeError("upstream down")
+
+        with pytest.raises(RuntimeError):
+            cache.get_or_fetch("k", boom)
+        assert cache.get_or_fetch("k", lambda: "ok") == "ok"
+
+    @pytest.mark.asyncio
+    async def test_owner_cancellation_does_not_cancel_waiters(self):
+        """Cancelling the caller that owns a fetch hands the fetch to a waiter."""
+        cache = TTLCache(ttl_seconds=60, max_entries=10)
+        started = asyncio.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            started.set()
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        owner = asyncio.create_task(cache.aget_or_fetch("k", fetch))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.aget_or_fetch("k", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        owner.cancel()
+
+        results = await asyncio.gather(*waiters)
+        assert owner.cancelled()
+        assert not any(waiter.cancelled() for waiter in waiters)
+        assert results == [2, 2, 2]
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_waiter_cancellation_does_not_affect_owner(self):
+        """A cancelled waiter leaves the shared fetch and other waiters running."""
+        cache = TTLCache(ttl_seconds=60, max_entries=10)
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "value"
+
+        owner = asyncio.create_task(cache.aget_or_fetch("k", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aget_or_fetch("k", fetch))
+        other = asyncio.create_task(cache.aget_or_fetch("k", fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+
+        assert await owner == "value"
+        assert await other == "value"
+        assert waiter.cancelled()
+
+    def test_persistence(self, tmp_path):
+        """Entries survive a restart when a persist path is set."""
+        path = tmp_path / "cache.json"
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+        cache.get_or_fetch(("q", "general", 5, False), lambda: {"results": [1]})
+
+        reloaded = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+        assert reloaded.get_or_fetch(("q", "general", 5, False), lambda: None) == {"results": [1]}
+        assert reloaded.stats()["hits"] == 1
+
+
+    @pytest.mark.asyncio
+    async def test_async_persistence_does_not_block_loop(self, tmp_path, monkeypatch):
+        """The async path writes the persistence file off the event loop."""
+        path = tmp_path / "cache.json"
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+        loop_thread = threading.get_ident()
+        writers = []
+        save = cache._save
+
+        def tracking_save(snapshot):
+            writers.append(threading.get_ident())
+            save(snapshot)
+
+        monkeypatch.setattr(cache, "_save", tracking_save)
+
+        async def fetch():
+            return {"results": [1]}
+
+        await cache.aget_or_fetch(("q", "general", 5, False), fetch)
+        assert writers and loop_thread not in writers
+        reloaded = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+        assert len(reloaded) == 1
+
+    def test_queued_persists_write_once(self, tmp_path, monkeypatch):
+        """Persisting an unchanged cache does not rewrite the file."""
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=tmp_path / "cache.json")
+        cache.get_or_fetch("k", lambda: 1)
+        writes = []
+        monkeypatch.setattr(cache, "_save", writes.append)
+        cache._persist()
+        assert writes == []
+
+    def test_persist_is_debounced_until_flush(self, tmp_path, monkeypatch):
+        """Stores inside the interval do not rewrite the file; flush saves them."""
+        path = tmp_path / "cache.json"
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path, persist_interval=60)
+        writes = []
+        save = cache._save
+
+        def counting_save(snapshot):
+            writes.append(len(snapshot))
+            save(snapshot)
+
+        monkeypatch.setattr(cache, "_save", counting_save)
+        for key in ("a", "b", "c"):
+            cache.get_or_fetch(key, lambda: 1)
+        assert writes == [1]
+        cache.flush()
+        assert writes == [1, 3]
+        assert len(TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)) == 3
+
+    def test_load_skips_malformed_rows(self, tmp_path):
+        """One bad row does not discard the rest of the file."""
+        path = tmp_path / "cache.json"
+        expires_at = time.time() + 60
+        rows = [
+            [["ok"], expires_at, 1],
+            ["short"],
+            [5, expires_at, 2],
+            [["bad"], "soon", 3],
+            [["also"], expires_at, 4],
+        ]
+        path.write_text(json.dumps(rows))
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+        assert cache.get_or_fetch(("ok",), lambda: None) == 1
+        assert cache.get_or_fetch(("also",), lambda: None) == 4
+        assert len(cache) == 2
+
+    def test_failed_replace_removes_temp_file(self, tmp_path, monkeypatch):
+        """A failed rename leaves neither a temp file nor a broken cache."""
+        cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=tmp_path / "cache.json")
+
+        def fail_replace(src, dst):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(os, "replace", fail_replace)
+        assert cache.get_or_fetch("k", lambda: 1) == 1
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestTavilySearchClient:
+    """Test cases for the pooled Tavily client."""
+
+    def test_async_client_is_bound_per_event_loop(self):
+        """Each event loop gets its own AsyncClient and semaphore."""
+        from src.tools.tavily_client import TavilySearchClient
+
+        client = TavilySearchClient(api_key="k", timeout=5, max_concurrency=2)
+
+        async def pair():
+            first = client._get_async_client()
+            assert client._get_async_client() is first
+            return first
+
+        first = asyncio.run(pair())
+        second = asyncio.run(pair())
+        assert first[0] is not second[0]
+        assert first[1] is not second[1]
+
+        async def close():
+            client._get_async_client()
+            await client.aclose()
+            return len(client._async_clients)
+
+        assert asyncio.run(close()) == 0
+
+
+class TestInternetSearchCache:
+    """Test cases for internet_search with the cache enabled."""
+
+    def test_repeated_query_hits_cache(self, search_module):
+        """A repeated, differently formatted query does not call Tavily again."""
+        search, client = search_module
+        first = search.internet_search.invoke({"query": "LangGraph checkpoints"})
+        second = search.internet_search.invoke({"query": "  langgraph   CHECKPOINTS"})
+        assert first == second
+        assert client.calls == 1
+        assert search.get_search_cache().stats()["hits"] == 1
+
+    def test_concurrent_queries_are_coalesced(self, search_module):
+        """Concurrent identical queries share one upstream call."""
+        search, client = search_module
+        threads = [
+            threading.Thread(target=search.internet_search.invoke, args=({"query": "deep agents"},))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert client.calls == 1
+        stats = search.get_search_cache().stats()
+        assert stats["misses"] == 1
+        assert stats["coalesced"] + stats["hits"] == 7
+
+    @pytest.mark.asyncio
+    async def test_async_queries_are_coalesced(self, search_module):
+        """Concurrent ainvoke calls share one upstream call on the event loop."""
+        search, client = search_module
+        results = await asyncio.gather(
+            *[search.internet_search.ainvoke({"query": "deep agents"}) for _ in range(8)]
+        )
+        assert all(result == results[0] for result in results)
+        assert client.calls == 1
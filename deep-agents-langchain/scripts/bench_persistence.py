@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Benchmark run persistence: per-row commits vs. batched unit of work.
+
+Measures commits per run and run-setup latency (create run + store input
+messages) against a temporary SQLite file.
+
+    python scripts/bench_persistence.py --runs 200 --messages 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from deep_agents_langchain.storage.buffer import ToolCallBuffer  # noqa: E402
+from deep_agents_langchain.storage.models import Base  # noqa: E402
+from deep_agents_langchain.storage.repositories import (  # noqa: E402
+    append_message,
+    append_messages,
+    create_run,
+    create_thread,
+    finish_run,
+)
+
+
+async def legacy_run(session, thread_id: str, messages: list[dict], tool_calls: int) -> float:
+    """Previous behaviour: one commit per row."""
+    start = time.perf_counter()
+    run = await create_run(session, thread_id, {"messages": messages})
+    for idx, msg in enumerate(messages):
+        await append_message(session, thread_id, msg["role"], msg["content"], order_num=idx)
+    setup = time.perf_counter() - start
+    await append_message(session, thread_id, "assistant", "done", order_num=len(messages))
+    await finish_run(session, run.id, status="completed", output={"content": "done"})
+    return setup
+
+
+async def batched_run(session, thread_id: str, messages: list[dict], tool_calls: int) -> float:
+    """Current behaviour: one commit per run phase, tool calls written behind."""
+    start = time.perf_counter()
+    run = await create_run(session, thread_id, {"messages": messages}, commit=False)
+    await append_messages(session, thread_id, messages, commit=False)
+    await session.commit()
+    setup = time.perf_counter() - start
+    buffer = ToolCallBuffer(run.id)
+    for idx in range(tool_calls):
+        buffer.record_call({"id": f"{run.id}-tc{idx}", "name": "read_file", "args": {}})
+        buffer.record_result(f"{run.id}-tc{idx}", "read_file", "completed", "ok")
+    await append_message(session, thread_id, "assistant", "done", order_num=len(messages), commit=False)
+    buffer.flush(session)
+    await finish_run(session, run.id, status="completed", output={"content": "done"}, commit=False)
+    await session.commit()
+    return setup
+
+
+async def bench(name: str, runner, runs: int, message_count: int, tool_calls: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{Path(tmp) / 'bench.db'}")
+        commits = 0
+
+        @event.listens_for(engine.sync_engine, "commit")
+        def _count_commit(conn):  # noqa: ARG001
+            nonlocal commits
+            commits += 1
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+        messages = [{"role": "user", "content": f"message {i}"} for i in range(message_count)]
+        async with sessionmaker() as session:
+            thread = await create_thread(session)
+            commits = 0
+            setups = []
+            started = time.perf_counter()
+            for _ in range(runs):
+                setups.append(await runner(session, thread.id, messages, tool_calls))
+            elapsed = time.perf_counter() - started
+        await engine.dispose()
+
+    setups_ms = sorted(s * 1000 for s in setups)
+    p99 = setups_ms[min(len(setups_ms) - 1, int(len(setups_ms) * 0.99))]
+    print(
+        f"{name:<8} commits/run={commits / runs:6.1f}  "
+        f"setup p50={statistics.median(setups_ms):7.2f}ms  p99={p99:7.2f}ms  "
+        f"total={elapsed:6.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--tool-calls", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(bench("legacy", legacy_run, args.runs, args.messages, args.tool_calls))
+    asyncio.run(bench("batched", batched_run, args.runs, args.messages, args.tool_calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import mmap
+import os
+import re
+from pathlib import Path
+
+from deepagents.backends import FilesystemBackend
+from deepagents.backends.protocol import EditResult, FileInfo, FileUploadResponse, GrepMatch, WriteResult
+from deepagents.backends.utils import format_content_with_line_numbers
+
+from deep_agents_langchain.storage.line_index import LineIndexStore
+from deep_agents_langchain.storage.workspace_index import WorkspaceIndex, required_literals
+
+
+class IndexedFilesystemBackend(FilesystemBackend):
+    """带行偏移索引与工作区索引的文件系统后端。
+
+    超过 min_indexed_bytes 的文件通过 mmap + 行索引读取：read_file 在任意 offset 的代价只与 limit
+    相关，agent 反复分页读取大日志不再每次从头扫描。小文件沿用父类实现。
+
+    传入 workspace_index 且已完成首次扫描时，glob 直接在索引上匹配，grep 只打开三元组索引给出的候选文件
+    （正则中提取不出必含字面量时交给父类）；
+    经本后端写入的文件立即更新索引，外部改动在下一次轮询后可见。
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        line_index: LineIndexStore,
+        min_indexed_bytes: int = 4 * 1024 * 1024,
+        workspace_index: WorkspaceIndex | None = None,
+        **kwargs,
+    ):
+        super().__init__(root_dir=root_dir, **kwargs)
+        self.line_index = line_index
+        self.min_indexed_bytes = min_indexed_bytes
+        self.workspace_index = workspace_index
+
+    def read(self, file_path: str, offset: int = 0, limit: int = 2000) -> str:
+        resolved_path = self._resolve_path(file_path)
+        if not resolved_path.is_file():
+            return f"Error: File '{file_path}' not found"
+        try:
+            fd = os.open(resolved_path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+        except OSError as e:
+            return f"Error reading file '{file_path}': {e}"
+        try:
+            stat = os.fstat(fd)
+            if stat.st_size < self.min_indexed_bytes:
+                return super().read(file_path, offset, limit)
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                index = self.line_index.get(resolved_path, mm, stat)
+                if offset >= index.total_lines:
+                    return f"Error: Line offset {offset} exceeds file length ({index.total_lines} lines)"
+                lines = index.read_lines(mm, offset, limit)
+            return format_content_with_line_numbers(lines, start_line=offset + 1)
+        except (OSError, ValueError) as e:
+            # UnicodeDecodeError 是 ValueError 的子类
+            return f"Error reading file '{file_path}': {e}"
+        finally:
+            os.close(fd)
+
+    def _indexed(self, path: Path) -> str | None:
+        """索引可用且 path 在索引根目录下时返回相对路径。"""
+        index = self.workspace_index
+        if index is None or not index.ready:
+            return None
+        return index.relative(path)
+
+    def _output_path(self, rel: str) -> str:
+        return "/" + rel if self.virtual_mode else str(self.workspace_index.root / rel)
+
+    def _reindex(self, file_path: str) -> None:
+        if self.workspace_index is None:
+            return
+        try:
+            self.workspace_index.update(self._resolve_path(file_path))
+        except (OSError, ValueError):
+            pass
+
+    def write(self, file_path: str, content: str) -> WriteResult:
+        result = super().write(file_path, content)
+        if result.error is None:
+            self._reindex(file_path)
+        return result
+
+    def edit(self, file_path: str, old_string: str, new_string: str, replace_all: bool = False) -> EditResult:
+        result = super().edit(file_path, old_string, new_string, replace_all)
+        if result.error is None:
+            self._reindex(file_path)
+        return result
+
+    def upload_files(self, files: list[tuple[str, bytes]]) -> list[FileUploadResponse]:
+        responses = super().upload_files(files)
+        for response in responses:
+            if response.error is None:
+                self._reindex(response.path)
+        return responses
+
+    def glob_info(self, pattern: str, path: str = "/") -> list[FileInfo]:
+        search_path = self.cwd if path == "/" else self._resolve_path(path)
+        base = self._indexed(search_path)
+        if base is None:
+            return super().glob_info(pattern, path)
+        return [
+            {"path": self._output_path(rel), "is_dir": False, "size": entry.size, "modified_at": entry.modified_at.isoformat()}
+            for rel, entry in self.workspace_index.glob(pattern.lstrip("/"), base)
+        ]
+
+    def grep_raw(self, pattern: str, path: str | None = None, glob: str | None = None) -> list[GrepMatch] | str:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            return f"Invalid regex pattern: {e}"
+        try:
+            base_full = self._resolve_path(path or ".")
+        except ValueError:
+            return []
+        base = self._indexed(base_full)
+        if base is None or not required_literals(pattern):
+            # 没有可用的必含字面量时候选就是全部文件，直接交给父类（ripgrep 优先）
+            return super().grep_raw(pattern, path, glob)
+
+        matches: list[GrepMatch] = []
+        for rel, entry in self.workspace_index.candidates(pattern, base, glob):
+            if entry.size > self.max_file_size_bytes:
+                continue
+            try:
+                content = (self.workspace_index.root / rel).read_text()
+            except (UnicodeDecodeError, OSError):
+                continue
+            output_path = self._output_path(rel)
+            for line_num, line in enumerate(content.splitlines(), 1):
+                if regex.search(line):
+                    matches.append({"path": output_path, "line": line_num, "text": line})
+        return matches
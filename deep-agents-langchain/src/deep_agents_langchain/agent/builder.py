@@ -1,9 +1,24 @@
-from typing import Callable, Literal
+from pathlib import Path
+from typing import Any, Callable, Literal
 
 from deepagents import create_deep_agent
 from deepagents.backends import FilesystemBackend
+from langchain_core.language_models import BaseChatModel
+from deep_agents_langchain.agent.backend import IndexedFilesystemBackend
+from deep_agents_langchain.agent.compaction import ContextCompactionMiddleware
+from deep_agents_langchain.agent.middleware import (
+    ModelRoutingMiddleware,
+    PromptCacheMiddleware,
+    ToolConcurrencyMiddleware,
+    ToolResultEvictionMiddleware,
+    TracingMiddleware,
+    parse_tool_limits,
+)
 from deep_agents_langchain.agent.prompts import SYSTEM_PROMPT
 from deep_agents_langchain.config.settings import Settings
+from deep_agents_langchain.storage.line_index import LineIndexStore
+from deep_agents_langchain.storage.workspace_index import WorkspaceIndex
+from deep_agents_langchain.utils.cache import TTLCache, search_cache_key
 
 try:
     from tavily import TavilyClient
@@ -11,10 +26,22 @@ except ImportError:  # pragma: no cover - 可选依赖
     TavilyClient = None  # type: ignore
 
 
-def _build_search_tool(settings: Settings):
-    """构建 internet_search 工具；缺少 Key 时返回占位实现。"""
-    if settings.tavily_api_key and TavilyClient is not None:
+def build_search_cache(settings: Settings) -> TTLCache | None:
+    """按配置创建搜索结果缓存；TTL 为 0 时不缓存。"""
+    if settings.search_cache_ttl_seconds <= 0:
+        return None
+    return TTLCache(
+        ttl_seconds=settings.search_cache_ttl_seconds,
+        max_entries=settings.search_cache_max_entries,
+        persist_path=settings.search_cache_path,
+    )
+
+
+def _build_search_tool(settings: Settings, cache: TTLCache | None = None, client: Any | None = None):
+    """构建 internet_search 工具；缺少 Key 时返回占位实现。传入 cache 时相同查询复用结果。"""
+    if client is None and settings.tavily_api_key and TavilyClient is not None:
         client = TavilyClient(api_key=settings.tavily_api_key)
+    if client is not None:
 
         def internet_search(
             query: str,
@@ -22,12 +49,17 @@ def _build_search_tool(settings: Settings):
             topic: Literal["general", "news", "finance"] = "general",
             include_raw_content: bool = False,
         ):
-            return client.search(
-                query=query,
-                max_results=max_results,
-                include_raw_content=include_raw_content,
-                topic=topic,
-            )
+            def fetch():
+                return client.search(
+                    query=query,
+                    max_results=max_results,
+                    include_raw_content=include_raw_content,
+                    topic=topic,
+                )
+
+            if cache is None:
+                return fetch()
+            return cache.get_or_fetch(search_cache_key(query, topic, max_results, include_raw_content), fetch)
 
         internet_search.__doc__ = "Run a web search via Tavily."
         return internet_search
@@ -44,15 +76,110 @@ def _build_search_tool(settings: Settings):
     return internet_search
 
 
-def build_agent(settings: Settings):
-    """按设计文档创建 deep agent。"""
-    tools: list[Callable] = [_build_search_tool(settings)]
-    backend = FilesystemBackend(root_dir=settings.workspace_root, virtual_mode=True)
+def build_tool_middleware(settings: Settings) -> ToolConcurrencyMiddleware:
+    """并行工具执行的并发/超时配置；task 委派子智能体，默认不受单次工具超时限制。"""
+    return ToolConcurrencyMiddleware(
+        max_concurrency=settings.tool_max_concurrency,
+        per_tool_limits=parse_tool_limits(settings.tool_concurrency_limits),
+        default_timeout=settings.timeout_seconds,
+        timeouts={"task": 0, **parse_tool_limits(settings.tool_timeouts)},
+    )
+
+
+def build_workspace_index(settings: Settings) -> WorkspaceIndex | None:
+    """按配置创建工作区索引并载入上次持久化的内容；轮询间隔为 0 时不建索引。"""
+    if settings.workspace_index_interval_seconds <= 0:
+        return None
+    # 默认的 SQLite 库放在工作区里，库文件及其 WAL/SHM 不进索引
+    ignore = []
+    if not settings.database_url:
+        db_path = Path(settings.sqlite_path).resolve()
+        root = Path(settings.workspace_root).resolve()
+        if db_path.is_relative_to(root):
+            rel = db_path.relative_to(root).as_posix()
+            ignore = [rel + suffix for suffix in ("", "-wal", "-shm", "-journal")]
+    index = WorkspaceIndex(
+        settings.workspace_root,
+        max_file_bytes=settings.workspace_index_max_file_bytes,
+        persist_path=settings.workspace_index_path,
+        ignore=ignore,
+    )
+    index.load()
+    return index
+
+
+def build_backend(settings: Settings, workspace_index: WorkspaceIndex | None = None) -> FilesystemBackend:
+    """工作区文件系统后端，根目录为 WORKSPACE_ROOT；大文件的 read_file 走行偏移索引。
+
+    传入 workspace_index 时 glob/grep 走工作区索引（由 WorkspaceIndexer 负责刷新）。
+    """
+    return IndexedFilesystemBackend(
+        root_dir=settings.workspace_root,
+        virtual_mode=True,
+        line_index=LineIndexStore(settings.line_index_dir),
+        min_indexed_bytes=settings.line_index_min_bytes,
+        workspace_index=workspace_index,
+    )
+
+
+def build_tools(settings: Settings, search_cache: TTLCache | None = None) -> list[Callable]:
+    """构建 agent 使用的自定义工具。"""
+    return [_build_search_tool(settings, cache=search_cache)]
+
+
+def build_agent(
+    settings: Settings,
+    checkpointer: Any | None = None,
+    search_cache: TTLCache | None = None,
+    model: str | BaseChatModel | None = None,
+    tools: list[Callable] | None = None,
+    cheap_model: BaseChatModel | None = None,
+    compaction_model: BaseChatModel | None = None,
+    backend: FilesystemBackend | None = None,
+):
+    """按设计文档创建 deep agent；传入 checkpointer 时按 thread_id 持久化图状态。
+
+    model 为空时使用 DEFAULT_MODEL；tools 为空时按配置新建；传入 cheap_model 时廉价步骤改用小模型。
+    上下文压缩的摘要依次使用 compaction_model、cheap_model、当前模型生成；backend 为空时按配置新建。
+    """
+    if tools is None:
+        tools = build_tools(settings, search_cache=search_cache)
+    model = model or settings.default_model
+    tool_middleware = build_tool_middleware(settings)
+    middleware: list[Any] = [tool_middleware]
+    if settings.compaction_trigger_tokens > 0:
+        middleware.insert(
+            0,
+            ContextCompactionMiddleware(
+                compaction_model or cheap_model or model,
+                trigger_tokens=settings.compaction_trigger_tokens,
+                keep_messages=settings.compaction_keep_messages,
+                prefetch_ratio=settings.compaction_prefetch_ratio,
+            ),
+        )
+    if backend is None:
+        backend = build_backend(settings)
+    if settings.max_tokens_result_to_file > 0:
+        # 大结果写入工作区 /outputs，消息与落库数据只保留预览；
+        # 包在并发控制外层，写文件在计时的调用返回之后进行，不占工具名额也不计入超时
+        middleware.insert(
+            middleware.index(tool_middleware),
+            ToolResultEvictionMiddleware(backend, settings.max_tokens_result_to_file),
+        )
+    if cheap_model is not None:
+        middleware.append(ModelRoutingMiddleware(cheap_model))
+    # 放在最后：稳定最终请求的前缀，提高提示缓存命中
+    middleware.append(PromptCacheMiddleware(cache_key_routing=settings.prompt_cache_key))
+    if settings.run_tracing:
+        # 最外层：耗时包含其余中间件的处理与工具并发排队
+        middleware.insert(0, TracingMiddleware())
     agent = create_deep_agent(
         tools=tools,
         backend=backend,
         system_prompt=SYSTEM_PROMPT,
-        model=settings.default_model,
+        model=model,
+        middleware=middleware,
+        checkpointer=checkpointer,
     )
     return agent
 
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, NotRequired
+
+from langchain.agents.middleware import AgentState
+from langchain.agents.middleware.summarization import SummarizationMiddleware
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage, RemoveMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.config import get_config
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.runtime import Runtime
+
+
+class CompactionState(AgentState):
+    """附带压缩记录（摘要条数、压缩前后 token）的 agent 状态。"""
+
+    compaction: NotRequired[dict[str, int]]
+
+
+@dataclass
+class _Job:
+    """后台生成中的摘要，覆盖到 through_id 这条消息为止。"""
+
+    through_id: str
+    future: Future
+
+
+class ContextCompactionMiddleware(SummarizationMiddleware):
+    """上下文压缩：在达到上限前把较早的消息替换为摘要，保留最近 keep_messages 条原文。
+
+    token 数按消息 id 缓存，每次调用只统计新增消息。线程超过 prefetch_ratio * trigger_tokens
+    时在后台开始生成摘要，之后的模型调用里替换；达到 trigger_tokens 时才等待摘要（没有进行中的
+    摘要则当场生成）。压缩结果写回线程的 messages 状态，后续运行直接从压缩后的上下文开始。
+    没有 thread_id 的运行只在达到上限时压缩。
+    """
+
+    state_schema = CompactionState
+
+    def __init__(
+        self,
+        model: str | BaseChatModel,
+        trigger_tokens: int,
+        keep_messages: int = 6,
+        prefetch_ratio: float = 0.8,
+        summary_input_tokens: int = 32000,
+        max_pending_jobs: int = 256,
+    ):
+        super().__init__(
+            model,
+            trigger=("tokens", trigger_tokens),
+            keep=("messages", keep_messages),
+            trim_tokens_to_summarize=summary_input_tokens,
+        )
+        self.trigger_tokens = trigger_tokens
+        self.prefetch_tokens = int(trigger_tokens * prefetch_ratio)
+        self.keep_messages = keep_messages
+        self._token_cache: OrderedDict[str, int] = OrderedDict()
+        self._token_cache_size = 50_000
+        # 有上限：线程没等到用上摘要就结束时，不能让摘要一直留在内存里
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()
+        self._max_jobs = max_pending_jobs
+        self._lock = threading.Lock()
+        # 并发的模型调用之间串行化后台摘要的查找、启动与取用
+        self._jobs_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compaction")
+
+    def count_tokens(self, messages: list[AnyMessage]) -> int:
+        """近似 token 数，按消息 id 缓存。"""
+        total = 0
+        for message in messages:
+            if message.id is None:
+                total += count_tokens_approximately([message])
+                continue
+            with self._lock:
+                cached = self._token_cache.get(message.id)
+                if cached is not None:
+                    self._token_cache.move_to_end(message.id)
+            if cached is None:
+                cached = count_tokens_approximately([message])
+                with self._lock:
+                    self._token_cache[message.id] = cached
+                    if len(self._token_cache) > self._token_cache_size:
+                        self._token_cache.popitem(last=False)
+            total += cached
+        return total
+
+    def _summarize(self, messages: list[AnyMessage]) -> str:
+        # 与父类 _create_summary 不同，失败时抛出异常，避免用错误文本替换历史
+        trimmed = self._trim_messages_for_summary(messages)
+        response = self.model.invoke(self.summary_prompt.format(messages=trimmed))
+        return response.text.strip()
+
+    def _start_job(self, thread_id: str, messages: list[AnyMessage]) -> None:
+        cutoff = self._find_safe_cutoff(messages, self.keep_messages)
+        if cutoff <= 0:
+            return
+        # 在线程池里执行，不继承图的上下文，摘要 token 不会流式推给客户端
+        future = self._executor.submit(self._summarize, list(messages[:cutoff]))
+        self._jobs[thread_id] = _Job(through_id=messages[cutoff - 1].id, future=future)
+        while len(self._jobs) > self._max_jobs:
+            _, stale = self._jobs.popitem(last=False)
+            # 尚未开始的直接取消；已在执行的跑完后丢弃
+            stale.future.cancel()
+
+    def _compacted(
+        self, messages: list[AnyMessage], summary: str, through: int, tokens_before: int
+    ) -> dict[str, Any]:
+        new_messages = [*self._build_new_messages(summary), *messages[through + 1 :]]
+        for message in new_messages:
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+        return {
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *new_messages],
+            "compaction": {
+                "summarized_messages": through + 1,
+                "tokens_before": tokens_before,
+                "tokens_after": self.count_tokens(new_messages),
+            },
+        }
+
+    def _plan(self, messages: list[AnyMessage]) -> tuple[str | None, _Job | None, int]:
+        """返回 thread_id、可用的后台摘要及其最后一条消息的下标。"""
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+        thread_id = str(thread_id) if thread_id is not None else None
+        job = self._jobs.get(thread_id) if thread_id is not None else None
+        through = -1
+        if job is not None:
+            through = next((i for i, m in enumerate(messages) if m.id == job.through_id), -1)
+            if through < 0 or (job.future.done() and job.future.exception() is not None):
+                # 历史已被改写或摘要失败，丢弃
+                del self._jobs[thread_id]
+                job = None
+        return thread_id, job, through
+
+    def _summary_future(self, messages: list[AnyMessage], tokens: int) -> tuple[Future | None, int]:
+        """选出已完成或必须等待的摘要：(future, 最后一条被摘要消息的下标)。"""
+        with self._jobs_lock:
+            thread_id, job, through = self._plan(messages)
+            if job is not None and (job.future.done() or tokens >= self.trigger_tokens):
+                del self._jobs[thread_id]
+                return job.future, through
+            if tokens >= self.trigger_tokens:
+                cutoff = self._find_safe_cutoff(messages, self.keep_messages)
+                if cutoff > 0:
+                    return self._executor.submit(self._summarize, list(messages[:cutoff])), cutoff - 1
+            elif thread_id is not None and job is None and tokens >= self.prefetch_tokens:
+                self._start_job(thread_id, messages)
+            return None, -1
+
+    def before_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:
+        messages = state["messages"]
+        self._ensure_message_ids(messages)
+        tokens = self.count_tokens(messages)
+        future, through = self._summary_future(messages, tokens)
+        if future is None:
+            return None
+        try:
+            summary = future.result()
+        except Exception:
+            # 保留原历史，下一次调用重试
+            return None
+        return self._compacted(messages, summary, through, tokens)
+
+    async def abefore_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:
+        messages = state["messages"]
+        self._ensure_message_ids(messages)
+        tokens = self.count_tokens(messages)
+        future, through = self._summary_future(messages, tokens)
+        if future is None:
+            return None
+        try:
+            summary = await asyncio.wrap_future(future)
+        except Exception:
+            return None
+        return self._compacted(messages, summary, through, tokens)
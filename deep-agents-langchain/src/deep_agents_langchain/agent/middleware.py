@@ -0,0 +1,475 @@
+import asyncio
+import contextvars
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable
+
+from deepagents.backends import FilesystemBackend
+from deepagents.backends.utils import sanitize_tool_call_id
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain.tools.tool_node import ToolCallRequest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_openai.chat_models.base import BaseChatOpenAI
+from langgraph.types import Command
+
+from deep_agents_langchain.utils.tracing import current_model_call, current_trace
+
+
+def parse_tool_limits(spec: str | None) -> dict[str, float]:
+    """解析 "internet_search=4,read_file=16" 形式的按工具配置。"""
+    limits: dict[str, float] = {}
+    for item in (spec or "").split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            limits[name.strip()] = float(value)
+    return limits
+
+
+def _timeout_message(request: ToolCallRequest, timeout: float) -> ToolMessage:
+    name = request.tool_call["name"]
+    return ToolMessage(
+        content=f"Error: tool '{name}' timed out after {timeout:g}s",
+        tool_call_id=request.tool_call["id"],
+        name=name,
+        status="error",
+    )
+
+
+def _runs_in_thread(tool: BaseTool | None) -> bool:
+    """工具没有原生异步实现、在线程池里执行时返回 True。"""
+    if tool is None:
+        return False
+    if isinstance(tool, StructuredTool):
+        return tool.coroutine is None
+    return type(tool)._arun is BaseTool._arun
+
+
+class ToolConcurrencyMiddleware(AgentMiddleware):
+    """并行工具执行的并发与超时控制。
+
+    同一步里的多个工具调用由图并行调度，各自完成后立即产出结果；这里用全局信号量
+    限制总并发，用按工具的信号量限制单个工具的并发，并对每次调用设置超时。
+    超时返回 status=error 的 ToolMessage，不中断其他调用。timeouts 中值为 0 的工具不设超时。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_tool_limits: dict[str, float] | None = None,
+        default_timeout: float | None = None,
+        timeouts: dict[str, float] | None = None,
+    ):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.per_tool_limits = {name: int(limit) for name, limit in (per_tool_limits or {}).items()}
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        # 同步调用跑在图的线程池里，用线程信号量；异步信号量按事件循环惰性创建
+        self._sync_global = threading.BoundedSemaphore(max_concurrency)
+        self._sync_per_tool = {name: threading.BoundedSemaphore(n) for name, n in self.per_tool_limits.items()}
+        self._async_semaphores: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, tuple[asyncio.Semaphore, dict[str, asyncio.Semaphore]]
+        ] = weakref.WeakKeyDictionary()
+        # 同步超时需要在独立线程里执行工具才能按时返回；超时的工具线程结束前一直占着并发名额，
+        # 所以忙碌的工作线程不会超过 max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="tool")
+        # 中间件（随编译好的图）被回收时关闭线程池
+        self._finalizer = weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        """关闭同步超时使用的线程池；已在执行的工具跑完后线程退出。"""
+        self._finalizer()
+
+    def _timeout_for(self, name: str) -> float | None:
+        timeout = self.timeouts.get(name, self.default_timeout)
+        return timeout if timeout and timeout > 0 else None
+
+    def _async_limits(self, name: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore | None]:
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_semaphores:
+            self._async_semaphores[loop] = (
+                asyncio.Semaphore(self.max_concurrency),
+                {tool: asyncio.Semaphore(n) for tool, n in self.per_tool_limits.items()},
+            )
+        global_sem, per_tool = self._async_semaphores[loop]
+        return global_sem, per_tool.get(name)
+
+    def _acquire_sync(self, tool_sem: threading.BoundedSemaphore | None, timeout: float | None) -> bool:
+        """按顺序获取全局与按工具的名额，超时未获取到时释放已拿到的并返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._sync_global.acquire(timeout=timeout):
+            return False
+        if tool_sem is None:
+            return True
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if tool_sem.acquire(timeout=remaining):
+            return True
+        self._sync_global.release()
+        return False
+
+    def _release_sync(self, tool_sem: threading.BoundedSemaphore | None) -> None:
+        if tool_sem is not None:
+            tool_sem.release()
+        self._sync_global.release()
+
+    def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], ToolMessage | Command],
+    ) -> ToolMessage | Command:
+        name = request.tool_call["name"]
+        timeout = self._timeout_for(name)
+        tool_sem = self._sync_per_tool.get(name)
+        # 等待名额也计入超时，所有名额都被卡住的工具占满时按超时返回，而不是无限排队
+        if not self._acquire_sync(tool_sem, timeout):
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        if timeout is None:
+            try:
+                return handler(request)
+            finally:
+                self._release_sync(tool_sem)
+        # 复制上下文，工具里仍能拿到当前运行的 config
+        ctx = contextvars.copy_context()
+        try:
+            future: Future = self._executor.submit(ctx.run, handler, request)
+        except BaseException:
+            self._release_sync(tool_sem)
+            raise
+        # 名额在工作线程真正结束时才归还：超时返回后线程仍在跑，继续计入并发上限
+        future.add_done_callback(lambda _: self._release_sync(tool_sem))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return _timeout_message(request, timeout)
+
+    @staticmethod
+    async def _acquire_async(global_sem: asyncio.Semaphore, tool_sem: asyncio.Semaphore | None) -> None:
+        """按顺序获取全局与按工具的名额；等待中被取消时释放已拿到的。"""
+        await global_sem.acquire()
+        if tool_sem is None:
+            return
+        try:
+            await tool_sem.acquire()
+        except BaseException:
+            global_sem.release()
+            raise
+
+    @staticmethod
+    def _release_async(global_sem: asyncio.Semaphore, tool_sem: asyncio.Semaphore | None, work: asyncio.Future) -> None:
+        if not work.cancelled():
+            # 超时后无人等待结果，这里取走异常避免告警
+            work.exception()
+        if tool_sem is not None:
+            tool_sem.release()
+        global_sem.release()
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        name = request.tool_call["name"]
+        timeout = self._timeout_for(name)
+        global_sem, tool_sem = self._async_limits(name)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        # 与同步路径一致，等待名额也计入超时
+        try:
+            await asyncio.wait_for(self._acquire_async(global_sem, tool_sem), timeout)
+        except asyncio.TimeoutError:
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        try:
+            work = asyncio.ensure_future(handler(request))
+        except BaseException:
+            if tool_sem is not None:
+                tool_sem.release()
+            global_sem.release()
+            raise
+        # 名额在工作真正结束时才归还，与同步路径的 done 回调一致
+        work.add_done_callback(lambda done: self._release_async(global_sem, tool_sem, done))
+        try:
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            return await asyncio.wait_for(asyncio.shield(work), remaining)
+        except asyncio.TimeoutError:
+            # 同步工具在线程里执行，取消协程停不下线程：让它跑完，期间继续占用名额
+            if not _runs_in_thread(request.tool):
+                work.cancel()
+            return _timeout_message(request, timeout)  # type: ignore[arg-type]
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+
+
+# 只更新待办的步骤，下一次模型调用通常只是继续执行，交给小模型即可
+DEFAULT_CHEAP_TOOLS = frozenset({"write_todos"})
+
+
+class ModelRoutingMiddleware(AgentMiddleware):
+    """把“廉价步骤”路由到小模型：上一轮的工具结果全部来自 cheap_tools 时改用 cheap_model。"""
+
+    def __init__(self, cheap_model: BaseChatModel, cheap_tools: frozenset[str] = DEFAULT_CHEAP_TOOLS):
+        super().__init__()
+        self.cheap_model = cheap_model
+        self.cheap_tools = cheap_tools
+
+    def _is_cheap_step(self, request: ModelRequest) -> bool:
+        results: list[ToolMessage] = []
+        for message in reversed(request.messages):
+            if isinstance(message, AIMessage):
+                break
+            if not isinstance(message, ToolMessage):
+                return False
+            results.append(message)
+        return bool(results) and all(message.name in self.cheap_tools for message in results)
+
+    def _route(self, request: ModelRequest) -> ModelRequest:
+        if self._is_cheap_step(request):
+            return request.override(model=self.cheap_model)
+        return request
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        return handler(self._route(request))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        return await handler(self._route(request))
+
+
+def _tool_name(tool: Any) -> str:
+    return tool.name if hasattr(tool, "name") else tool.get("name", "")
+
+
+class PromptCacheMiddleware(AgentMiddleware):
+    """保持请求前缀（工具 schema + 系统提示）逐字节稳定，命中服务端提示缓存。
+
+    服务端按最长完全相同的前缀缓存：这里按名称排序工具，使 schema 的序列化与中间件注册顺序无关；
+    OpenAI 模型额外按前缀摘要设置 prompt_cache_key，让同前缀的请求落到同一缓存。
+    需放在中间件列表最后，才能看到最终的系统提示、工具和（路由后的）模型。
+    """
+
+    def __init__(self, cache_key_routing: bool = True):
+        super().__init__()
+        self.cache_key_routing = cache_key_routing
+
+    def _stabilize(self, request: ModelRequest) -> ModelRequest:
+        tools = sorted(request.tools, key=_tool_name)
+        overrides: dict[str, Any] = {"tools": tools}
+        if self.cache_key_routing and isinstance(request.model, BaseChatOpenAI):
+            prefix = "\n".join([request.system_prompt or "", *(_tool_name(tool) for tool in tools)])
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:32]
+            overrides["model_settings"] = {"prompt_cache_key": key, **request.model_settings}
+        return request.override(**overrides)
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        return handler(self._stabilize(request))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        return await handler(self._stabilize(request))
+
+
+EVICTED_RESULT_MESSAGE = """工具结果过大（{size} 字节），完整内容已写入 {path}。
+需要细节时用 read_file 按 offset/limit 分段读取该文件，不要整体读取。
+首尾预览：
+{preview}"""
+
+
+def preview_text(content: str, head_lines: int = 20, tail_lines: int = 10, max_line_chars: int = 500) -> str:
+    """取首尾若干行作为预览，过长的行截断。"""
+    lines = content.splitlines()
+    if len(lines) > head_lines + tail_lines:
+        omitted = len(lines) - head_lines - tail_lines
+        lines = [*lines[:head_lines], f"...（省略 {omitted} 行）...", *lines[-tail_lines:]]
+    return "\n".join(line if len(line) <= max_line_chars else line[:max_line_chars] + "…" for line in lines)
+
+
+class ToolResultEvictionMiddleware(AgentMiddleware):
+    """超过 max_tokens（按 4 字符/token 估算）的工具结果写入工作区文件，消息里只留首尾预览与路径。
+
+    并行工具调用各自完成时立即处理，大结果不会进入消息列表、checkpoint 和 runs/tool_calls 行。
+    文件信息写在 ToolMessage.response_metadata["evicted"]，由运行服务记录到 files_meta。
+    需放在 ToolConcurrencyMiddleware 之前，写文件才不落在计时的调用里。
+    只作用于主 agent：子 agent 使用 deepagents 的默认中间件，其内部工具结果不转存，
+    也就没有需要记录的文件；子 agent 的最终回答作为 task 工具结果仍由主 agent 转存并记录。
+    """
+
+    def __init__(self, backend: FilesystemBackend, max_tokens: int, directory: str = "/outputs"):
+        super().__init__()
+        self.backend = backend
+        self.max_chars = max_tokens * 4
+        self.directory = directory.rstrip("/")
+
+    def _write(self, tool_call_id: str, content: str) -> str | None:
+        path = f"{self.directory}/{sanitize_tool_call_id(tool_call_id)}.txt"
+        result = self.backend.write(path, content)
+        if result.error:
+            # 同名文件已存在（如重放同一调用），换一个文件名
+            path = f"{self.directory}/{sanitize_tool_call_id(tool_call_id)}-{uuid.uuid4().hex[:8]}.txt"
+            result = self.backend.write(path, content)
+        return None if result.error else path
+
+    def _evict(self, message: ToolMessage) -> ToolMessage:
+        content = message.content
+        if not isinstance(content, str) or len(content) <= self.max_chars:
+            return message
+        path = self._write(message.tool_call_id, content)
+        if path is None:
+            return message
+        size = len(content.encode("utf-8"))
+        return ToolMessage(
+            content=EVICTED_RESULT_MESSAGE.format(size=size, path=path, preview=preview_text(content)),
+            tool_call_id=message.tool_call_id,
+            name=message.name,
+            id=message.id,
+            status=message.status,
+            artifact=message.artifact,
+            response_metadata={**message.response_metadata, "evicted": {"path": path, "size": size}},
+        )
+
+    def _process(self, result: ToolMessage | Command) -> ToolMessage | Command:
+        if isinstance(result, ToolMessage):
+            return self._evict(result)
+        if isinstance(result, Command) and isinstance(result.update, dict) and result.update.get("messages"):
+            messages = [self._evict(m) if isinstance(m, ToolMessage) else m for m in result.update["messages"]]
+            return Command(
+                graph=result.graph,
+                update={**result.update, "messages": messages},
+                resume=result.resume,
+                goto=result.goto,
+            )
+        return result
+
+    def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], ToolMessage | Command],
+    ) -> ToolMessage | Command:
+        return self._process(handler(request))
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        result = await handler(request)
+        # 写文件放到线程里，不阻塞事件循环上的其他工具调用
+        return await asyncio.to_thread(self._process, result)
+
+
+def _model_attrs(response: ModelResponse | None) -> dict[str, Any]:
+    attrs: dict[str, Any] = {"status": "ok" if response is not None else "error"}
+    messages = response.result if response is not None else []
+    usage = next((m.usage_metadata for m in messages if isinstance(m, AIMessage) and m.usage_metadata), None)
+    if usage:
+        attrs["input_tokens"] = usage.get("input_tokens", 0)
+        attrs["output_tokens"] = usage.get("output_tokens", 0)
+    return attrs
+
+
+def _model_name(request: ModelRequest) -> str:
+    return getattr(request.model, "model_name", None) or getattr(request.model, "model", None) or "model"
+
+
+def _tool_status(result: ToolMessage | Command | None) -> str:
+    if result is None:
+        return "error"
+    return result.status if isinstance(result, ToolMessage) else "success"
+
+
+class TracingMiddleware(AgentMiddleware):
+    """把每次模型调用与工具调用的耗时写入当前运行的 RunTrace；不在运行上下文中时直接透传。
+
+    放在中间件最外层：工具耗时包含并发排队与超时在内的墙钟时间，模型耗时包含路由等处理。
+    """
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        trace = current_trace.get()
+        if trace is None:
+            return handler(request)
+        call = trace.begin_model()
+        # 模型回调据此把首 token 时间记到本次调用上
+        token = current_model_call.set(call)
+        response = None
+        try:
+            response = handler(request)
+            return response
+        finally:
+            current_model_call.reset(token)
+            trace.end_model(call, _model_name(request), _model_attrs(response))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        trace = current_trace.get()
+        if trace is None:
+            return await handler(request)
+        call = trace.begin_model()
+        # 模型回调据此把首 token 时间记到本次调用上
+        token = current_model_call.set(call)
+        response = None
+        try:
+            response = await handler(request)
+            return response
+        finally:
+            current_model_call.reset(token)
+            trace.end_model(call, _model_name(request), _model_attrs(response))
+
+    def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], ToolMessage | Command],
+    ) -> ToolMessage | Command:
+        trace = current_trace.get()
+        if trace is None:
+            return handler(request)
+        start = time.perf_counter_ns()
+        result = None
+        try:
+            result = handler(request)
+            return result
+        finally:
+            trace.end_tool(start, request.tool_call["name"], request.tool_call.get("id"), _tool_status(result))
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        trace = current_trace.get()
+        if trace is None:
+            return await handler(request)
+        start = time.perf_counter_ns()
+        result = None
+        try:
+            result = await handler(request)
+            return result
+        finally:
+            trace.end_tool(start, request.tool_call["name"], request.tool_call.get("id"), _tool_status(result))
@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Any, NamedTuple
+from uuid import UUID
+
+from langchain.chat_models import init_chat_model
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from langchain_core.outputs import LLMResult
+
+from deep_agents_langchain.config.settings import Settings
+
+
+class ModelKey(NamedTuple):
+    provider: str
+    model: str
+    base_url: str | None
+
+
+def parse_model_id(model_id: str) -> tuple[str, str]:
+    """拆分 "provider:model"，缺省 provider 为 openai。"""
+    provider, sep, name = model_id.partition(":")
+    return (provider, name) if sep else ("openai", model_id)
+
+
+def parse_model_prices(spec: str | None) -> dict[str, tuple[float, float]]:
+    """解析 "openai:gpt-4o-mini=0.15/0.6,..."：每百万 token 的输入/输出价格（美元）。"""
+    prices: dict[str, tuple[float, float]] = {}
+    for item in (spec or "").split(","):
+        model_id, sep, value = item.rpartition("=")
+        if not sep or not model_id.strip():
+            continue
+        input_price, _, output_price = value.partition("/")
+        prices[model_id.strip()] = (float(input_price or 0), float(output_price or 0))
+    return prices
+
+
+def _usage_from_result(response: LLMResult) -> dict[str, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return dict(usage)
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return {
+        "input_tokens": int(token_usage.get("prompt_tokens") or 0),
+        "output_tokens": int(token_usage.get("completion_tokens") or 0),
+        "total_tokens": int(token_usage.get("total_tokens") or 0),
+        "input_token_details": {
+            "cache_read": int((token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        },
+    }
+
+
+class ModelStats(BaseCallbackHandler):
+    """挂在模型客户端上的回调：按模型累计调用次数、错误、token、提示缓存命中、延迟和费用。"""
+
+    # 只做计数，直接在调用线程执行，避免额外的线程池调度
+    run_inline = True
+
+    def __init__(self, price: tuple[float, float] | None = None):
+        self.price = price
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+        self.cost_usd = 0.0
+        self._started: dict[UUID, float] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id: UUID) -> float:
+        started = self._started.pop(run_id, None)
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        latency_ms = self._finish(run_id)
+        usage = _usage_from_result(response)
+        input_tokens = int(usage.get("input_tokens") or 0)
+        output_tokens = int(usage.get("output_tokens") or 0)
+        cache_read = int((usage.get("input_token_details") or {}).get("cache_read") or 0)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cache_read_tokens += cache_read
+            self.latency_ms_total += latency_ms
+            self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+            if self.price:
+                self.cost_usd += (input_tokens * self.price[0] + output_tokens * self.price[1]) / 1_000_000
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cache_read_tokens": self.cache_read_tokens,
+                "cache_hit_ratio": round(self.cache_read_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+                "latency_ms_avg": round(self.latency_ms_total / self.calls, 1) if self.calls else 0.0,
+                "latency_ms_max": round(self.latency_ms_max, 1),
+                "cost_usd": round(self.cost_usd, 6),
+            }
+
+
+class ModelPool:
+    """按 (provider, model, base_url) 复用已初始化的模型客户端（连接池随客户端复用）。"""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.prices = parse_model_prices(settings.model_prices)
+        self._models: dict[ModelKey, BaseChatModel] = {}
+        self._stats: dict[ModelKey, ModelStats] = {}
+        self._lock = threading.Lock()
+        # 客户端与编译好的图按模型常驻，只接受配置过的模型，避免任意模型串撑大缓存
+        configured = [settings.default_model, settings.cheap_model, settings.compaction_model]
+        self.allowed = frozenset(
+            self._resolve(model_id.strip())
+            for model_id in [*configured, *settings.warm_models.split(",")]
+            if model_id and model_id.strip()
+        )
+
+    def _resolve(self, model_id: str) -> ModelKey:
+        provider, name = parse_model_id(model_id)
+        base_url = self.settings.openai_api_base if provider == "openai" else None
+        return ModelKey(provider, name, base_url)
+
+    def key(self, model_id: str | None = None) -> ModelKey:
+        """解析模型标识；不在 DEFAULT/CHEAP/COMPACTION_MODEL 与 WARM_MODELS 之列时抛出 ValueError。"""
+        key = self._resolve(model_id or self.settings.default_model)
+        if key not in self.allowed:
+            allowed = ", ".join(sorted(f"{k.provider}:{k.model}" for k in self.allowed))
+            raise ValueError(f"model {model_id!r} is not enabled (allowed: {allowed})")
+        return key
+
+    def _create(self, key: ModelKey, stats: ModelStats) -> BaseChatModel:
+        kwargs: dict[str, Any] = {"callbacks": [stats]}
+        if key.provider == "openai":
+            kwargs.update(base_url=key.base_url, api_key=self.settings.openai_api_key, stream_usage=True)
+        return init_chat_model(key.model, model_provider=key.provider, **kwargs)
+
+    def get(self, model_id: str | None = None) -> BaseChatModel:
+        """获取模型客户端；未启用的模型抛出 ValueError。"""
+        key = self.key(model_id)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            if key not in self._models:
+                stats = ModelStats(self.prices.get(f"{key.provider}:{key.model}"))
+                self._models[key] = self._create(key, stats)
+                self._stats[key] = stats
+            return self._models[key]
+
+    def warm(self, model_ids: list[str]) -> None:
+        """启动时预先创建客户端，首个请求不再承担初始化开销。"""
+        for model_id in model_ids:
+            self.get(model_id)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {f"{key.provider}:{key.model}": stats.snapshot() for key, stats in list(self._stats.items())}
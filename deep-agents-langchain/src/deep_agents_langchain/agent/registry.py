@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+from deep_agents_langchain.agent.builder import build_agent, build_backend, build_tools
+from deep_agents_langchain.agent.models import ModelPool
+from deep_agents_langchain.agent.prompts import SYSTEM_PROMPT
+from deep_agents_langchain.config.settings import Settings
+from deep_agents_langchain.storage.workspace_index import WorkspaceIndex
+from deep_agents_langchain.utils.cache import TTLCache
+
+
+class AgentKey(NamedTuple):
+    model: str
+    tools: tuple[str, ...]
+    prompt: str
+    backend: str
+
+
+class AgentRegistry:
+    """按 (model, 工具集, prompt, backend) 缓存编译好的 agent，首次使用时才构建。
+
+    构建 deep agent 需要初始化模型客户端、生成工具 schema 并编译图；同一个 key 只构建一次，
+    按请求切换模型时直接复用已编译的图。
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        checkpointer: Any | None = None,
+        search_cache: TTLCache | None = None,
+        models: ModelPool | None = None,
+        workspace_index: WorkspaceIndex | None = None,
+    ):
+        self.settings = settings
+        self.checkpointer = checkpointer
+        self.models = models or ModelPool(settings)
+        # 工具与模型无关，所有图共用一份（含搜索客户端与缓存）
+        self.tools: list[Callable] = build_tools(settings, search_cache=search_cache)
+        # 工作区后端（含 read_file 行索引缓存与 glob/grep 工作区索引）同样共用
+        self.backend = build_backend(settings, workspace_index=workspace_index)
+        self._agents: dict[AgentKey, Any] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def key(self, model: str | None = None) -> AgentKey:
+        """模型统一成 "provider:model"；未启用的模型抛出 ValueError，不会为其构建图。"""
+        pooled = self.models.key(model)
+        return AgentKey(
+            model=f"{pooled.provider}:{pooled.model}",
+            tools=tuple(sorted(getattr(tool, "name", None) or tool.__name__ for tool in self.tools)),
+            prompt=hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16],
+            backend=str(Path(self.settings.workspace_root).resolve()),
+        )
+
+    def _build(self, key: AgentKey) -> Any:
+        cheap = self.settings.cheap_model and self.key(self.settings.cheap_model).model
+        compaction = self.settings.compaction_model
+        return build_agent(
+            self.settings,
+            checkpointer=self.checkpointer,
+            model=self.models.get(key.model),
+            tools=self.tools,
+            cheap_model=self.models.get(cheap) if cheap and cheap != key.model else None,
+            compaction_model=self.models.get(compaction) if compaction else None,
+            backend=self.backend,
+        )
+
+    def get(self, model: str | None = None) -> Any:
+        """同步获取；未命中时在当前线程构建。"""
+        key = self.key(model)
+        if key not in self._agents:
+            self._agents[key] = self._build(key)
+        return self._agents[key]
+
+    async def aget(self, model: str | None = None) -> Any:
+        """异步获取；构建放到线程里执行，不阻塞事件循环，并发请求同一模型只构建一次。"""
+        key = self.key(model)
+        agent = self._agents.get(key)
+        if agent is not None:
+            return agent
+        async with self._lock:
+            if key not in self._agents:
+                self._agents[key] = await asyncio.to_thread(self._build, key)
+            return self._agents[key]
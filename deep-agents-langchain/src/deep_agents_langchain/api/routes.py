@@ -1,13 +1,29 @@
 from typing import Any, Literal
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import StreamingResponse
+from uuid import uuid4
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from deep_agents_langchain.agent.registry import AgentRegistry
 from deep_agents_langchain.config.settings import Settings
-from deep_agents_langchain.service.runs import run_and_stream
-from deep_agents_langchain.service.threads import create_new_thread, read_state, write_state
+from deep_agents_langchain.service.run_manager import RunManager
+from deep_agents_langchain.service.runs import MultitaskStrategy, RunScheduler, cancel_run, open_run_stream, run_and_stream
+from deep_agents_langchain.service.threads import (
+    create_new_thread,
+    ensure_thread,
+    list_thread_messages,
+    list_thread_runs,
+    list_threads,
+    read_state,
+    write_state,
+)
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.checkpoints import CheckpointStore
+from deep_agents_langchain.storage.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from deep_agents_langchain.utils.metrics import render_metrics
 from deep_agents_langchain.utils.sse import sse_stream
+from deep_agents_langchain.utils.tracing import RunTrace
 
 
 router = APIRouter()
@@ -19,12 +35,19 @@ class MessagePayload(BaseModel):
 
 
 class RunInput(BaseModel):
+    # 只需提交本轮新消息，历史由服务端按 thread 读取
     messages: list[MessagePayload]
 
 
 class RunRequest(BaseModel):
     input: RunInput
     stream: bool = True
+    # 本次运行使用的模型，如 openai:gpt-4o；为空时使用 DEFAULT_MODEL
+    model: str | None = None
+    # 线程已有运行时：enqueue 排队，reject 返回 409，interrupt 打断当前运行后优先执行
+    multitask_strategy: MultitaskStrategy = "enqueue"
+    # 客户端全部断开且宽限期内未重连时：cancel 取消运行，continue 在后台跑完
+    on_disconnect: Literal["cancel", "continue"] = "cancel"
 
 
 class ThreadCreateRequest(BaseModel):
@@ -35,6 +58,8 @@ class ThreadCreateRequest(BaseModel):
 class StateUpdateRequest(BaseModel):
     state: dict = Field(default_factory=dict)
     replace: bool = False
+    # 乐观锁：传入读取时的 version，版本不一致返回 409
+    expected_version: int | None = None
 
 
 async def get_session(request: Request) -> AsyncSession:
@@ -43,14 +68,30 @@ async def get_session(request: Request) -> AsyncSession:
         yield session
 
 
-def get_agent(request: Request):
-    return request.app.state.agent
+def get_agents(request: Request) -> AgentRegistry:
+    return request.app.state.agents
 
 
 def get_settings_dep(request: Request) -> Settings:
     return request.app.state.settings
 
 
+def get_blob_store(request: Request) -> BlobStore:
+    return request.app.state.blob_store
+
+
+def get_scheduler(request: Request) -> RunScheduler:
+    return request.app.state.scheduler
+
+
+def get_run_manager(request: Request) -> RunManager:
+    return request.app.state.runs
+
+
+def get_checkpoints(request: Request) -> CheckpointStore | None:
+    return request.app.state.checkpoints
+
+
 @router.get("/assistants")
 async def list_assistants(settings: Settings = Depends(get_settings_dep)):
     return [
@@ -64,6 +105,44 @@ async def list_assistants(settings: Settings = Depends(get_settings_dep)):
     ]
 
 
+@router.get("/stats")
+async def get_stats(request: Request):
+    """运行时计数器：搜索缓存命中/未命中、各模型的调用次数/延迟/费用、工作区索引规模等。"""
+    search_cache = request.app.state.search_cache
+    indexer = request.app.state.workspace_indexer
+    return {
+        "search_cache": search_cache.stats() if search_cache is not None else None,
+        "models": request.app.state.models.stats(),
+        "runs": {**request.app.state.scheduler.stats(), **request.app.state.runs.stats()},
+        "workspace_index": indexer.index.stats() if indexer is not None else None,
+    }
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus 抓取端点：运行/模型/工具/数据库耗时直方图、并发运行与 SSE 流、事件循环延迟。"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.post("/workspace/refresh")
+async def refresh_workspace(request: Request):
+    """立即重新扫描工作区（资源管理器的“刷新”），返回变化的文件数。"""
+    indexer = request.app.state.workspace_indexer
+    if indexer is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="workspace index disabled")
+    return await indexer.refresh()
+
+
+@router.get("/threads")
+async def get_threads(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    fields: str | None = Query(None, description="逗号分隔的返回字段，如 id,created_at"),
+    session: AsyncSession = Depends(get_session),
+):
+    return await list_threads(session, limit, cursor=cursor, fields=fields)
+
+
 @router.post("/threads")
 async def create_thread(req: ThreadCreateRequest, session: AsyncSession = Depends(get_session)):
     thread = await create_new_thread(session, metadata=req.metadata)
@@ -77,11 +156,78 @@ async def stream_run(
     thread_id: str,
     req: RunRequest,
     session: AsyncSession = Depends(get_session),
-    agent=Depends(get_agent),
+    agents: AgentRegistry = Depends(get_agents),
+    settings: Settings = Depends(get_settings_dep),
+    blob_store: BlobStore = Depends(get_blob_store),
+    checkpoints: CheckpointStore | None = Depends(get_checkpoints),
+    scheduler: RunScheduler = Depends(get_scheduler),
+    runs: RunManager = Depends(get_run_manager),
+    x_trace_id: str | None = Header(None),
 ):
-    run_payload = req.input.model_dump()
-    generator = run_and_stream(agent, session, thread_id, run_payload)
-    return StreamingResponse(sse_stream(generator), media_type="text/event-stream")
+    # 从收到请求开始计时；调用方传入 X-Trace-Id 时沿用，便于前后端关联
+    trace = RunTrace(x_trace_id)
+    # 本次指定的模型优先，其次是线程 metadata.model，最后是 DEFAULT_MODEL
+    thread = await ensure_thread(session, thread_id)
+    try:
+        model = agents.key(req.model or (thread.metadata_ or {}).get("model")).model
+        agent = await agents.aget(model)
+    except ValueError as exc:
+        # 未启用或无法识别的模型标识
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    # 记录本次运行实际使用的模型，便于在消息上标注
+    run_payload = {**req.input.model_dump(), "model": model}
+    # 准入控制：拒绝或排队满时在开始推流前直接返回 409/429
+    ticket = scheduler.submit(thread_id, req.multitask_strategy)
+    run_id = str(uuid4())
+
+    def events(run_session: AsyncSession):
+        return run_and_stream(
+            agent,
+            run_session,
+            thread_id,
+            run_payload,
+            blob_store=blob_store,
+            inline_bytes=settings.run_output_inline_bytes,
+            checkpoints=checkpoints,
+            trace=trace,
+            scheduler=scheduler,
+            ticket=ticket,
+            run_id=run_id,
+        )
+
+    # 运行在后台任务中执行，本响应只跟随其事件日志；断开后可用 run_id 重连
+    run = runs.start(run_id, thread_id, trace.trace_id, events, on_disconnect=req.on_disconnect)
+    return StreamingResponse(
+        sse_stream(runs.follow(run)),
+        media_type="text/event-stream",
+        headers={"X-Trace-Id": trace.trace_id, "X-Run-Id": run_id},
+    )
+
+
+@router.get("/threads/{thread_id}/runs/{run_id}/stream")
+async def join_run_stream(
+    thread_id: str,
+    run_id: str,
+    last_event_id: int | None = Query(None, ge=-1, description="从该事件编号之后回放，缺省从头"),
+    last_event_id_header: int | None = Header(None, alias="Last-Event-ID"),
+    session: AsyncSession = Depends(get_session),
+    runs: RunManager = Depends(get_run_manager),
+):
+    """重连运行的 SSE 流：EventSource 自动重连时带 Last-Event-ID 头，也可用 last_event_id 参数指定。"""
+    after = last_event_id if last_event_id is not None else last_event_id_header
+    generator = await open_run_stream(runs, session, thread_id, run_id, after)
+    return StreamingResponse(sse_stream(generator), media_type="text/event-stream", headers={"X-Run-Id": run_id})
+
+
+@router.post("/threads/{thread_id}/runs/{run_id}/cancel")
+async def cancel_thread_run(
+    thread_id: str,
+    run_id: str,
+    session: AsyncSession = Depends(get_session),
+    runs: RunManager = Depends(get_run_manager),
+):
+    """取消运行：停止模型请求、子 agent 与工具调用，未返回的工具调用记为 interrupted，运行记为 cancelled。"""
+    return await cancel_run(runs, session, thread_id, run_id)
 
 
 @router.get("/threads/{thread_id}/state")
@@ -90,16 +236,44 @@ async def get_state(thread_id: str, session: AsyncSession = Depends(get_session)
     return {
         "thread_id": thread_id,
         "state": state.kv if state else {},
+        "version": state.version if state else 0,
         "updated_at": state.updated_at if state else None,
     }
 
 
 @router.put("/threads/{thread_id}/state")
 async def update_state(thread_id: str, req: StateUpdateRequest, session: AsyncSession = Depends(get_session)):
-    state = await write_state(session, thread_id, kv=req.state, replace=req.replace)
+    state = await write_state(
+        session, thread_id, kv=req.state, replace=req.replace, expected_version=req.expected_version
+    )
     return {
         "thread_id": thread_id,
         "state": state.kv,
+        "version": state.version,
         "updated_at": state.updated_at,
     }
 
+
+@router.get("/threads/{thread_id}/messages")
+async def get_messages(
+    thread_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    order: Literal["asc", "desc"] = "asc",
+    fields: str | None = Query(None, description="逗号分隔的返回字段，如 id,role,order_num"),
+    session: AsyncSession = Depends(get_session),
+):
+    return await list_thread_messages(
+        session, thread_id, limit, cursor=cursor, fields=fields, descending=order == "desc"
+    )
+
+
+@router.get("/threads/{thread_id}/runs")
+async def get_runs(
+    thread_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    fields: str | None = Query(None, description="逗号分隔的返回字段，如 id,status,started_at"),
+    session: AsyncSession = Depends(get_session),
+):
+    return await list_thread_runs(session, thread_id, limit, cursor=cursor, fields=fields)
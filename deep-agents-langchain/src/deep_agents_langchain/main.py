@@ -2,14 +2,25 @@ import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from deep_agents_langchain.agent.builder import build_agent
+from deep_agents_langchain.agent.builder import build_search_cache, build_workspace_index
+from deep_agents_langchain.agent.models import ModelPool
+from deep_agents_langchain.agent.registry import AgentRegistry
 from deep_agents_langchain.api.routes import router
 from deep_agents_langchain.config.settings import get_settings
+from deep_agents_langchain.service.run_manager import RunManager
+from deep_agents_langchain.service.runs import RunScheduler
+from deep_agents_langchain.service.workspace import WorkspaceIndexer
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.checkpoints import open_checkpoint_store
 from deep_agents_langchain.storage.db import build_engine, build_sessionmaker, init_db
+from deep_agents_langchain.utils.metrics import monitor_event_loop_lag
+from deep_agents_langchain.utils.tracing import install_trace_log_records
 
 
 def create_app() -> FastAPI:
     settings = get_settings()
+    # 运行期间的日志都带上 trace_id
+    install_trace_log_records()
     app = FastAPI(title="deep-agents-langchain", version="0.1.0")
 
     app.add_middleware(
@@ -22,16 +33,65 @@ def create_app() -> FastAPI:
 
     engine = build_engine(settings)
     sessionmaker = build_sessionmaker(engine)
-    agent = build_agent(settings)
+    blob_store = BlobStore(settings.blob_root)
 
     app.state.settings = settings
     app.state.engine = engine
     app.state.sessionmaker = sessionmaker
-    app.state.agent = agent
+    app.state.blob_store = blob_store
+    app.state.checkpoints = None
+    app.state.loop_monitor = None
+    # 搜索缓存跨线程、跨运行共享
+    app.state.search_cache = build_search_cache(settings)
+    app.state.models = ModelPool(settings)
+    app.state.scheduler = RunScheduler(settings.run_max_concurrency, settings.run_max_queued)
+    app.state.runs = RunManager(
+        sessionmaker,
+        settings.run_event_log_max_events,
+        settings.run_event_log_retention_seconds,
+        disconnect_grace_seconds=settings.run_disconnect_grace_seconds,
+    )
+    workspace_index = build_workspace_index(settings)
+    app.state.workspace_indexer = (
+        WorkspaceIndexer(workspace_index, sessionmaker, settings.workspace_index_interval_seconds)
+        if workspace_index is not None
+        else None
+    )
 
     @app.on_event("startup")
     async def _startup():
-        await init_db(engine)
+        app.state.loop_monitor = asyncio.create_task(monitor_event_loop_lag())
+        await init_db(engine, blob_store=blob_store, inline_bytes=settings.run_output_inline_bytes)
+        # 预先创建常用模型的客户端；图仍在首次使用时编译
+        warm = [settings.default_model, settings.cheap_model, *settings.warm_models.split(",")]
+        app.state.models.warm([model for model in warm if model and model.strip()])
+        checkpoints = await open_checkpoint_store(settings)
+        app.state.checkpoints = checkpoints
+        # agent 不在启动时编译，首次请求对应模型时再构建并缓存
+        app.state.agents = AgentRegistry(
+            settings,
+            checkpointer=checkpoints.saver if checkpoints else None,
+            search_cache=app.state.search_cache,
+            models=app.state.models,
+            workspace_index=workspace_index,
+        )
+        # 首次全量扫描在后台进行，完成前 glob/grep 沿用直接遍历磁盘的实现
+        if app.state.workspace_indexer is not None:
+            app.state.workspace_indexer.start()
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        if app.state.loop_monitor is not None:
+            app.state.loop_monitor.cancel()
+        await app.state.runs.shutdown()
+        if app.state.workspace_indexer is not None:
+            await app.state.workspace_indexer.stop()
+        if app.state.checkpoints is not None:
+            await app.state.checkpoints.aclose()
+        # 搜索缓存的写盘有去抖，关闭前写入剩余的变更
+        if app.state.search_cache is not None:
+            await asyncio.to_thread(app.state.search_cache.flush)
+        await engine.dispose()
 
     app.include_router(router)
     return app
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+
+def _is_delta(item: dict) -> bool:
+    return item["event"] == "message" and "delta" in item["data"]
+
+
+class RunEventLog:
+    """单次运行的事件日志：按顺序编号（SSE id），只保留最近 max_events 条，可从任意编号之后回放并继续跟随。
+
+    事件存放在列表里，编号减去 _base 即下标，跟随者每次唤醒只切出新事件；窗口之外的旧事件
+    攒满一个窗口再整体删除，均摊 O(1)。还没有任何跟随者读到的末尾 token 增量会与同一消息的
+    后续增量合并，客户端跟不上或断开期间日志不会按 token 膨胀。
+    """
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        self._events: list[dict] = []
+        # _events[0] 的编号
+        self._base = 0
+        self.next_id = 0
+        # 已交给跟随者的最大编号；之后的事件还可以合并
+        self.delivered = -1
+        self.closed = False
+        self._waiter: asyncio.Future | None = None
+
+    @property
+    def first_id(self) -> int:
+        """仍保留的最早事件编号。"""
+        return max(self._base, self.next_id - self.max_events)
+
+    def available(self, after: int) -> bool:
+        """编号 after 之后的事件是否都还在日志里。"""
+        return after + 1 >= self.first_id
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    def append(self, item: dict) -> None:
+        last = self._events[-1] if self._events else None
+        if (
+            last is not None
+            and last["id"] > self.delivered
+            and _is_delta(item)
+            and _is_delta(last)
+            and last["data"].get("message_id") == item["data"].get("message_id")
+        ):
+            last["data"] = {**last["data"], "delta": last["data"]["delta"] + item["data"]["delta"]}
+            return
+        self._events.append({**item, "id": self.next_id})
+        self.next_id += 1
+        excess = len(self._events) - self.max_events
+        if excess >= self.max_events:
+            del self._events[:excess]
+            self._base += excess
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    async def follow(self, after: int = -1) -> AsyncIterator[dict]:
+        """产出编号大于 after 的事件，运行未结束时等待新事件；跟随者断开不影响运行本身。"""
+        next_id = after + 1
+        while True:
+            first = self.first_id
+            if next_id < first:
+                # 跟随得太慢，中间的事件已被挤出日志
+                yield {"event": "error", "data": {"code": "EVENTS_EXPIRED", "message": f"events {next_id}..{first - 1} expired"}}
+                next_id = first
+            batch = self._events[next_id - self._base :]
+            if batch:
+                self.delivered = max(self.delivered, batch[-1]["id"])
+            for item in batch:
+                yield item
+            next_id += len(batch)
+            if next_id < self.next_id:
+                continue
+            if self.closed:
+                return
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self._waiter)
+
+
+class BackgroundRun:
+    __slots__ = ("run_id", "thread_id", "trace_id", "log", "task", "on_disconnect", "followers", "abandon_timer")
+
+    def __init__(self, run_id: str, thread_id: str, trace_id: str, log: RunEventLog, on_disconnect: str):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.trace_id = trace_id
+        self.log = log
+        self.task: asyncio.Task | None = None
+        # cancel：所有跟随者断开且宽限期内无人重连时取消运行；continue：始终跑完
+        self.on_disconnect = on_disconnect
+        self.followers = 0
+        self.abandon_timer: asyncio.TimerHandle | None = None
+
+
+class RunManager:
+    """后台运行：运行作为独立的 asyncio 任务执行，事件写入有界日志，HTTP 流只是日志的跟随者。
+
+    客户端断开后运行继续执行，重连时凭 run_id 与 Last-Event-ID 回放；on_disconnect=cancel 的运行在
+    最后一个跟随者断开 disconnect_grace_seconds 秒后仍无人重连则取消。运行结束后日志再保留
+    retention_seconds 秒供重连读取。
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        max_events: int,
+        retention_seconds: float,
+        disconnect_grace_seconds: float = 15.0,
+    ):
+        self.sessionmaker = sessionmaker
+        self.max_events = max_events
+        self.retention_seconds = retention_seconds
+        self.disconnect_grace_seconds = disconnect_grace_seconds
+        self._runs: dict[str, BackgroundRun] = {}
+
+    def start(
+        self,
+        run_id: str,
+        thread_id: str,
+        trace_id: str,
+        events: Callable[[AsyncSession], AsyncIterator[dict]],
+        on_disconnect: str = "cancel",
+    ) -> BackgroundRun:
+        """启动后台运行；events 用运行专属的 session 产出事件（请求的 session 随响应结束而关闭）。"""
+        run = BackgroundRun(run_id, thread_id, trace_id, RunEventLog(self.max_events), on_disconnect)
+        self._runs[run_id] = run
+        run.task = asyncio.create_task(self._drive(run, events), name=f"run-{run_id}")
+        # 响应还没开始迭代客户端就断开时不会有跟随者，也按断开处理
+        self._watch(run)
+        return run
+
+    async def follow(self, run: BackgroundRun, after: int = -1) -> AsyncIterator[dict]:
+        """HTTP 流跟随运行的事件日志；断开（生成器被取消或关闭）时登记，供无人跟随时取消运行。"""
+        run.followers += 1
+        if run.abandon_timer is not None:
+            run.abandon_timer.cancel()
+            run.abandon_timer = None
+        try:
+            async for item in run.log.follow(after):
+                yield item
+        finally:
+            run.followers -= 1
+            if run.followers == 0:
+                self._watch(run)
+
+    def _watch(self, run: BackgroundRun) -> None:
+        if run.on_disconnect != "cancel" or run.log.closed or run.abandon_timer is not None:
+            return
+        run.abandon_timer = asyncio.get_running_loop().call_later(self.disconnect_grace_seconds, self._abandoned, run)
+
+    def _abandoned(self, run: BackgroundRun) -> None:
+        run.abandon_timer = None
+        if run.followers == 0 and run.task is not None and not run.task.done():
+            logger.info("run %s cancelled: no client reconnected", run.run_id)
+            run.task.cancel()
+
+    async def cancel(self, run: BackgroundRun, wait_seconds: float) -> None:
+        """取消运行任务，并等待其完成收尾（落库 cancelled、发送 end 事件），最多 wait_seconds 秒。"""
+        if run.task is None or run.task.done():
+            return
+        run.task.cancel()
+        await asyncio.wait({run.task}, timeout=wait_seconds)
+
+    async def _drive(self, run: BackgroundRun, events: Callable[[AsyncSession], AsyncIterator[dict]]) -> None:
+        try:
+            async with self.sessionmaker() as session:
+                async for item in events(session):
+                    run.log.append(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            # run_and_stream 自身会把运行失败转成 error/end 事件，这里只兜底准备阶段的异常（如线程不存在）
+            logger.warning("run %s aborted: %s", run.run_id, exc)
+            message = getattr(exc, "detail", None) or str(exc)
+            run.log.append({"event": "error", "data": {"message": message, "code": "RUN_FAILED", "trace_id": run.trace_id}})
+            run.log.append(
+                {"event": "end", "data": {"run_id": run.run_id, "status": "error", "error": message, "trace_id": run.trace_id}}
+            )
+        finally:
+            run.log.close()
+            if run.abandon_timer is not None:
+                run.abandon_timer.cancel()
+                run.abandon_timer = None
+            asyncio.get_running_loop().call_later(self.retention_seconds, self._evict, run)
+
+    def _evict(self, run: BackgroundRun) -> None:
+        if self._runs.get(run.run_id) is run:
+            del self._runs[run.run_id]
+
+    def get(self, thread_id: str, run_id: str) -> BackgroundRun | None:
+        run = self._runs.get(run_id)
+        return run if run is not None and run.thread_id == thread_id else None
+
+    def stats(self) -> dict[str, int]:
+        live = sum(1 for run in self._runs.values() if not run.log.closed)
+        return {"live": live, "retained": len(self._runs) - live}
+
+    async def shutdown(self) -> None:
+        """进程退出时取消仍在执行的运行。"""
+        tasks = [run.task for run in self._runs.values() if run.task is not None and not run.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
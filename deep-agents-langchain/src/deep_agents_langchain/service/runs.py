@@ -1,10 +1,195 @@
 import asyncio
-from typing import Any, AsyncIterator
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, Literal
+from uuid import uuid4
 from fastapi import HTTPException, status
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from deep_agents_langchain.storage.repositories import append_message, create_run, finish_run, get_thread
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.buffer import ToolCallBuffer
+from deep_agents_langchain.service.run_manager import RunManager
+from deep_agents_langchain.storage.checkpoints import CheckpointStore
+from deep_agents_langchain.storage.models import Message, Run
+from deep_agents_langchain.storage.repositories import (
+    add_run_spans,
+    append_messages,
+    create_run,
+    finish_run,
+    get_run,
+    get_thread,
+    list_messages,
+    next_order_num,
+    upsert_files_meta,
+)
+from deep_agents_langchain.storage.run_output import add_usage, compact_run_output, empty_usage
+from deep_agents_langchain.utils.metrics import (
+    MODEL_LATENCY,
+    RUN_DURATION,
+    RUN_QUEUE_WAIT,
+    RUNS_ACTIVE,
+    RUNS_QUEUED,
+    RUNS_REJECTED,
+    TOOL_LATENCY,
+)
+from deep_agents_langchain.utils.tracing import RunTrace, current_trace
+
+logger = logging.getLogger(__name__)
+
+# create_agent 图中的节点名：模型节点产出助手消息，工具节点产出 ToolMessage
+MODEL_NODE = "model"
+TOOLS_NODE = "tools"
+STREAM_MODES = ["messages", "updates"]
+# 节点增量中不计入运行状态增量的键
+NON_STATE_KEYS = {"messages", "jump_to"}
+
+
+MultitaskStrategy = Literal["reject", "enqueue", "interrupt"]
+
+
+class RunTicket:
+    """一次运行在调度器里的位置：排队时等待 granted，获得执行权后记录执行它的任务以便被打断。"""
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task | None = None
+        self.interrupted = False
+        self.queued_at = time.perf_counter()
+
+
+class _ThreadQueue:
+    __slots__ = ("active", "waiting")
+
+    def __init__(self):
+        self.active: RunTicket | None = None
+        self.waiting: deque[RunTicket] = deque()
+
+
+class RunScheduler:
+    """运行准入控制：每个线程同时只执行一个运行，其余按 FIFO 排队；全局并发不超过 max_concurrency。
+
+    有空位时按线程轮转发放执行权（一个线程跑完一次后排到队尾），单个线程连续提交不会饿死其他线程。
+    所有状态只在事件循环线程里修改，无需加锁。
+    """
+
+    def __init__(self, max_concurrency: int, max_queued: int):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self._threads: dict[str, _ThreadQueue] = {}
+        # 没有活动运行、队首在等全局空位的线程，按轮转顺序
+        self._ready: deque[str] = deque()
+        self._running = 0
+        self._queued = 0
+
+    def submit(self, thread_id: str, strategy: MultitaskStrategy = "enqueue") -> RunTicket:
+        """按 multitask_strategy 登记一次运行：reject 在线程忙时返回 409，interrupt 打断当前运行并插到队首。
+
+        排队总数达到 max_queued 时返回 429。
+        """
+        queue = self._threads.get(thread_id)
+        busy = queue is not None and (queue.active is not None or bool(queue.waiting))
+        if busy and strategy == "reject":
+            RUNS_REJECTED.inc("busy")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="thread has a run in progress")
+        if self.max_queued and self._queued >= self.max_queued:
+            RUNS_REJECTED.inc("queue_full")
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="too many queued runs")
+        if queue is None:
+            queue = self._threads[thread_id] = _ThreadQueue()
+        ticket = RunTicket(thread_id)
+        if strategy == "interrupt":
+            queue.waiting.appendleft(ticket)
+            if queue.active is not None:
+                self._interrupt(queue.active)
+        else:
+            queue.waiting.append(ticket)
+        self._queued += 1
+        RUNS_QUEUED.inc()
+        if queue.active is None and thread_id not in self._ready:
+            self._ready.append(thread_id)
+        self._dispatch()
+        return ticket
+
+    @staticmethod
+    def _interrupt(ticket: RunTicket) -> None:
+        ticket.interrupted = True
+        if ticket.task is not None:
+            ticket.task.cancel()
+
+    def _dispatch(self) -> None:
+        while self._ready and (not self.max_concurrency or self._running < self.max_concurrency):
+            queue = self._threads[self._ready.popleft()]
+            ticket = queue.waiting.popleft()
+            queue.active = ticket
+            self._running += 1
+            self._queued -= 1
+            RUNS_QUEUED.dec()
+            RUN_QUEUE_WAIT.observe(time.perf_counter() - ticket.queued_at)
+            ticket.granted.set_result(None)
+
+    async def acquire(self, ticket: RunTicket) -> None:
+        """等待执行权；等待期间被取消（客户端断开）时退出队列。"""
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+        ticket.task = asyncio.current_task()
+        if ticket.interrupted and ticket.task is not None:
+            # 排队期间已被后来的 interrupt 打断
+            ticket.task.cancel()
+
+    def release(self, ticket: RunTicket) -> None:
+        """运行结束或放弃排队时调用，可重复调用。"""
+        queue = self._threads.get(ticket.thread_id)
+        if queue is None:
+            return
+        if queue.active is ticket:
+            queue.active = None
+            self._running -= 1
+            if queue.waiting:
+                self._ready.append(ticket.thread_id)
+        elif ticket in queue.waiting:
+            queue.waiting.remove(ticket)
+            self._queued -= 1
+            RUNS_QUEUED.dec()
+            if not queue.waiting and ticket.thread_id in self._ready:
+                self._ready.remove(ticket.thread_id)
+        if queue.active is None and not queue.waiting:
+            del self._threads[ticket.thread_id]
+        self._dispatch()
+
+    def position(self, ticket: RunTicket) -> int:
+        """在所属线程队列中的位置（从 0 开始）；已获得执行权时为 -1。"""
+        queue = self._threads.get(ticket.thread_id)
+        if queue is None or ticket not in queue.waiting:
+            return -1
+        return queue.waiting.index(ticket)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "threads": len(self._threads),
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+def _content_text(content: Any) -> Any:
+    """把消息内容统一成文本；多段内容只拼接 text 块。"""
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return content
 
 
 async def _extract_last_content(result: Any):
@@ -19,50 +204,403 @@ async def _extract_last_content(result: Any):
     return result
 
 
-async def run_and_stream(agent, session: AsyncSession, thread_id: str, payload: dict) -> AsyncIterator[dict]:
+def _tool_call_payload(tool_call: dict) -> dict:
+    return {
+        "id": tool_call.get("id"),
+        "name": tool_call.get("name"),
+        "args": tool_call.get("args") or {},
+        "status": "pending",
+    }
+
+
+def _assistant_entry(content: Any, tool_calls: list[dict]) -> dict:
+    entry = {"role": "assistant", "content": content}
+    if tool_calls:
+        entry["tool_calls"] = [
+            {"id": tc.get("id"), "name": tc.get("name"), "args": tc.get("args") or {}} for tc in tool_calls
+        ]
+    return entry
+
+
+def _iter_node_messages(update: Any) -> Iterator[tuple[str, BaseMessage]]:
+    """从 updates 模式的增量中取出 (节点名, 新消息)；Overwrite 等非列表写入直接跳过。"""
+    if not isinstance(update, dict):
+        return
+    for node, node_update in update.items():
+        if node not in (MODEL_NODE, TOOLS_NODE) or not isinstance(node_update, dict):
+            continue
+        messages = node_update.get("messages")
+        if isinstance(messages, list):
+            for message in messages:
+                if isinstance(message, BaseMessage):
+                    yield node, message
+
+
+def _history_entry(row: Message) -> dict:
+    """库中的消息转成 agent 输入；工具调用与工具结果带上对应字段，重放时与 checkpoint 一致。"""
+    entry = {"role": row.role, "content": row.content}
+    if row.tool_calls:
+        entry["tool_calls"] = row.tool_calls
+    if row.tool_call_id:
+        entry["tool_call_id"] = row.tool_call_id
+    return entry
+
+
+def _strip_replayed_prefix(history: list[dict], incoming: list[dict]) -> list[dict]:
+    """兼容仍提交完整历史的旧客户端：与已存对话完全一致的前缀不再重复写入。
+
+    旧客户端只持有用户消息与最终回答，比对时跳过发起工具调用的助手消息和工具结果。
+    """
+    visible = [m for m in history if m["role"] != "tool" and not m.get("tool_calls")]
+    if not visible or len(incoming) <= len(visible):
+        return incoming
+    prefix = incoming[: len(visible)]
+    if all(a.get("role") == b["role"] and a.get("content") == b["content"] for a, b in zip(prefix, visible)):
+        return incoming[len(visible):]
+    return incoming
+
+
+async def _stream_agent_events(
+    agent,
+    thread_id: str,
+    agent_input: dict,
+    config: dict,
+    final: dict,
+    tool_calls: ToolCallBuffer,
+    trace: RunTrace,
+) -> AsyncIterator[dict]:
+    """基于 astream 的增量事件：token 增量、完整助手消息、工具结果（含耗时）。
+
+    final 用于回传本次运行产出的消息（按产出顺序，含发起工具调用的助手消息与工具结果）、token 用量、
+    非消息的状态增量和转存的大结果文件，调用方据此落库；工具调用另写入 tool_calls 缓冲，运行结束时统一落库。
+    """
+    async for mode, chunk in agent.astream(agent_input, config=config, stream_mode=STREAM_MODES):
+        if mode == "messages":
+            message, metadata = chunk
+            # 只转发主模型节点的 token；摘要等中间件的模型调用不推给前端
+            if not isinstance(message, AIMessageChunk) or (metadata or {}).get("langgraph_node") != MODEL_NODE:
+                continue
+            delta = _content_text(message.content)
+            if delta:
+                trace.first_token()
+                yield {
+                    "event": "message",
+                    "data": {
+                        "message_id": message.id,
+                        "thread_id": thread_id,
+                        "role": "assistant",
+                        "delta": delta,
+                    },
+                }
+            continue
+
+        if isinstance(chunk, dict):
+            for node_update in chunk.values():
+                if isinstance(node_update, dict):
+                    final["state_delta"].update({k: v for k, v in node_update.items() if k not in NON_STATE_KEYS})
+        for node, message in _iter_node_messages(chunk):
+            if isinstance(message, AIMessage):
+                content = _content_text(message.content)
+                add_usage(final["usage"], message.usage_metadata)
+                final["messages"].append(_assistant_entry(content, message.tool_calls))
+                for tool_call in message.tool_calls:
+                    tool_calls.record_call(tool_call)
+                yield {
+                    "event": "message",
+                    "data": {
+                        "message_id": message.id,
+                        "thread_id": thread_id,
+                        "role": "assistant",
+                        "content": content,
+                        "tool_calls": [_tool_call_payload(tc) for tc in message.tool_calls],
+                    },
+                }
+            elif isinstance(message, ToolMessage):
+                tool_status = "error" if message.status == "error" else "completed"
+                result = _content_text(message.content)
+                duration_ms = trace.tool_durations.get(message.tool_call_id)
+                tool_calls.record_result(message.tool_call_id, message.name, tool_status, result, duration_ms)
+                final["messages"].append({"role": "tool", "content": result, "tool_call_id": message.tool_call_id})
+                data = {
+                    "tool_call_id": message.tool_call_id,
+                    "name": message.name,
+                    "status": tool_status,
+                    "result": result,
+                    "duration_ms": duration_ms,
+                }
+                # 大结果已转存为工作区文件，result 只是首尾预览
+                evicted = (message.response_metadata or {}).get("evicted")
+                if evicted:
+                    final["files"].append(evicted)
+                    data["file"] = evicted
+                yield {"event": "tool", "data": data}
+
+
+async def _replay_agent_result(
+    agent, run_id: str, thread_id: str, agent_input: dict, config: dict, final: dict
+) -> AsyncIterator[dict]:
+    """不支持 astream 的 agent 兜底：整体执行后一次性回放。"""
+    if hasattr(agent, "ainvoke"):
+        result = await agent.ainvoke(agent_input, config=config)  # deepagents 返回 dict 含 messages
+    else:  # pragma: no cover - 同步实现兜底
+        result = await asyncio.get_event_loop().run_in_executor(None, agent.invoke, agent_input, config)
+    content = await _extract_last_content(result)
+    final["messages"].append(_assistant_entry(content, []))
+    yield {
+        "event": "message",
+        "data": {
+            "message_id": f"{run_id}-assistant",
+            "thread_id": thread_id,
+            "role": "assistant",
+            "content": content,
+            "tool_calls": [],
+        },
+    }
+
+
+async def run_and_stream(
+    agent,
+    session: AsyncSession,
+    thread_id: str,
+    payload: dict,
+    blob_store: BlobStore | None = None,
+    inline_bytes: int = 4096,
+    checkpoints: CheckpointStore | None = None,
+    trace: RunTrace | None = None,
+    scheduler: RunScheduler | None = None,
+    ticket: RunTicket | None = None,
+    run_id: str | None = None,
+) -> AsyncIterator[dict]:
+    """执行一次运行并产出 SSE 事件；结束前发送 metrics 事件（总耗时、排队、首 token、模型与工具耗时）。
+
+    trace 由路由在收到请求时创建，排队等待从那一刻算起；运行期间设为 current_trace，供中间件与日志使用。
+    传入调度器登记的 ticket 时先等待执行权，排队期间发送 queued 事件。
+    第一个事件是 metadata（run_id、trace_id），客户端据此断线重连。
+    """
+    trace = trace or RunTrace()
+    run_id = run_id or str(uuid4())
+    trace_token = current_trace.set(trace)
+    # 没走到 end 事件就被关闭（如客户端断开）记为 cancelled
+    run_status = "cancelled"
+    active = False
+    try:
+        yield {"event": "metadata", "data": {"run_id": run_id, "thread_id": thread_id, "trace_id": trace.trace_id}}
+        if scheduler is not None and ticket is not None:
+            if not ticket.granted.done():
+                yield {
+                    "event": "queued",
+                    "data": {"thread_id": thread_id, "position": scheduler.position(ticket), "trace_id": trace.trace_id},
+                }
+                # 排队期间不占用数据库连接
+                await session.close()
+            await scheduler.acquire(ticket)
+        RUNS_ACTIVE.inc()
+        active = True
+        async for item in _run_and_stream(
+            agent, session, thread_id, payload, blob_store, inline_bytes, checkpoints, trace, run_id, ticket
+        ):
+            if item["event"] == "end":
+                run_status = item["data"]["status"]
+            yield item
+    except asyncio.CancelledError:
+        # 排队或准备阶段就被取消：运行尚未落库，直接结束事件流
+        _uncancel()
+        run_status = _cancelled_status(ticket)
+        yield {"event": "end", "data": {"run_id": run_id, "status": run_status, "error": None, "trace_id": trace.trace_id}}
+    finally:
+        if scheduler is not None and ticket is not None:
+            scheduler.release(ticket)
+        if active:
+            RUNS_ACTIVE.dec()
+        _observe_run(trace, run_status)
+        # 生成器可能在其他上下文里被关闭，此时无需也无法复位
+        with contextlib.suppress(ValueError):
+            current_trace.reset(trace_token)
+
+
+def _uncancel() -> None:
+    """收回当前任务的取消请求（3.11+），让运行在取消后还能完成落库收尾。"""
+    task = asyncio.current_task()
+    if task is not None and hasattr(task, "uncancel"):
+        task.uncancel()
+
+
+def _cancelled_status(ticket: RunTicket | None) -> str:
+    return "interrupted" if ticket is not None and ticket.interrupted else "cancelled"
+
+
+async def open_run_stream(
+    manager: RunManager, session: AsyncSession, thread_id: str, run_id: str, last_event_id: int | None = None
+) -> AsyncIterator[dict]:
+    """重连运行的事件流：从编号 last_event_id 之后回放并继续跟随；不传时从头回放。
+
+    日志已过期的已结束运行只补发一个 end 事件；回放起点已被挤出日志时返回 410，客户端改读消息列表。
+    """
+    run = manager.get(thread_id, run_id)
+    if run is not None:
+        after = -1 if last_event_id is None else last_event_id
+        if not run.log.available(after):
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail=f"events after {after} expired")
+        return manager.follow(run, after)
+    row = await get_run(session, thread_id, run_id)
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="run not found")
+    if row.status == "running":
+        # 运行可能在其他进程中执行，或进程重启前未能收尾
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="run is not active in this process")
+    return _finished_run_events(row.id, row.status, row.error, row.trace_id)
+
+
+async def _finished_run_events(run_id: str, run_status: str, error: str | None, trace_id: str | None) -> AsyncIterator[dict]:
+    yield {"event": "end", "data": {"run_id": run_id, "status": run_status, "error": error, "trace_id": trace_id}}
+
+
+async def cancel_run(
+    manager: RunManager, session: AsyncSession, thread_id: str, run_id: str, wait_seconds: float = 10.0
+) -> dict:
+    """取消运行并等待其收尾（最多 wait_seconds 秒），返回运行的最新状态；已结束的运行直接返回其状态。"""
+    run = manager.get(thread_id, run_id)
+    if run is not None:
+        await manager.cancel(run, wait_seconds)
+    row = await get_run(session, thread_id, run_id)
+    if row is None:
+        if run is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="run not found")
+        # 排队中被取消的运行不会落库
+        return {"run_id": run_id, "status": "cancelled"}
+    if run is None and row.status == "running":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="run is not active in this process")
+    return {"run_id": row.id, "status": row.status}
+
+
+def _observe_run(trace: RunTrace, run_status: str) -> None:
+    """运行结束时把总耗时与各模型/工具调用耗时计入 /metrics 直方图。"""
+    RUN_DURATION.observe((time.perf_counter_ns() - trace.started_ns) / 1e9, run_status)
+    for span in trace.spans:
+        if span.kind == "model":
+            MODEL_LATENCY.observe(span.duration_ns / 1e9, span.name)
+        elif span.kind == "tool":
+            TOOL_LATENCY.observe(span.duration_ns / 1e9, span.name)
+
+
+async def _restore_run(session: AsyncSession, run: Run, run_id: str) -> None:
+    """回滚后确认运行记录在库：准备阶段的提交被取消或失败时回滚会丢掉新建的运行，重新加入以记录结束状态。"""
+    if await session.get(Run, run_id) is None:
+        session.add(run)
+
+
+async def _run_and_stream(
+    agent,
+    session: AsyncSession,
+    thread_id: str,
+    payload: dict,
+    blob_store: BlobStore | None,
+    inline_bytes: int,
+    checkpoints: CheckpointStore | None,
+    trace: RunTrace,
+    run_id: str,
+    ticket: RunTicket | None = None,
+) -> AsyncIterator[dict]:
     thread = await get_thread(session, thread_id)
     if thread is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="thread not found")
 
-    run = await create_run(session, thread_id, payload)
-    messages = payload.get("messages") or []
+    # 线程历史由服务端持有：客户端只提交新的一轮。
+    # 已有 checkpoint 时图状态从 checkpoint 恢复，只把新消息交给 agent；否则从库里读取历史重放。
+    # 多条消息可能是旧客户端重放的完整历史，此时也读取历史用于去重
+    incoming = payload.get("messages") or []
+    next_order = await next_order_num(session, thread_id)
+    resume = checkpoints is not None and await checkpoints.has_thread(thread_id)
+    history: list[dict] = []
+    if not resume or len(incoming) > 1:
+        history = [_history_entry(row) for row in await list_messages(session, thread_id)]
+    messages = _strip_replayed_prefix(history, incoming)
+    config = {"configurable": {"thread_id": thread_id}, "callbacks": [trace.callback]}
+    # 准备阶段：运行记录与新消息同一事务提交
+    run = await create_run(
+        session, thread_id, {**payload, "messages": messages}, commit=False, trace_id=trace.trace_id, run_id=run_id
+    )
+    # 回滚会让 run 过期，之后只用 run_id，避免在异步 session 上触发懒加载
+    tool_calls = ToolCallBuffer(run_id)
+    final: dict = {"messages": [], "usage": empty_usage(), "state_delta": {}, "files": []}
     try:
-        # 存储用户消息
-        for idx, msg in enumerate(messages):
-            role = msg.get("role", "user")
-            content = msg.get("content")
-            await append_message(session, thread_id, role, content, order_num=idx)
-
-        if hasattr(agent, "ainvoke"):
-            result = await agent.ainvoke({"messages": messages})  # deepagents 返回 dict 含 messages
-        else:  # pragma: no cover - 同步实现兜底
-            result = await asyncio.get_event_loop().run_in_executor(None, agent.invoke, {"messages": messages})
-        content = await _extract_last_content(result)
-        await append_message(session, thread_id, "assistant", content, order_num=len(messages))
-        await finish_run(session, run.id, status="completed", output=result)
-
-        async def generator():
+        await append_messages(session, thread_id, messages, start_order=next_order, commit=False)
+        await session.commit()
+
+        agent_input = {"messages": messages if resume else history + messages}
+        trace.agent_started()
+        if hasattr(agent, "astream"):
+            events = _stream_agent_events(agent, thread_id, agent_input, config, final, tool_calls, trace)
+        else:
+            events = _replay_agent_result(agent, run_id, thread_id, agent_input, config, final)
+        async for item in events:
+            yield item
+
+        # 收尾阶段：本次产出的全部消息、工具调用、运行状态同一事务提交；runs.output 只存引用与增量。
+        # 消息按产出顺序逐条写入，库中历史与 checkpoint 一致，next_order_num 也与之对应
+        rows = await append_messages(
+            session, thread_id, final["messages"], start_order=next_order + len(messages), commit=False
+        )
+        assistant_ids = [row.id for row in rows if row.role == "assistant"]
+        output = await asyncio.to_thread(
+            compact_run_output,
+            message_id=assistant_ids[-1] if assistant_ids else None,
+            usage=final["usage"],
+            tool_call_ids=tool_calls.call_ids,
+            state_delta=final["state_delta"],
+            blob_store=blob_store,
+            inline_bytes=inline_bytes,
+        )
+        tool_calls.flush(session)
+        add_run_spans(session, run_id, trace.rows())
+        await upsert_files_meta(session, thread_id, final["files"], commit=False)
+        await finish_run(session, run_id, status="completed", output=output, commit=False)
+        await session.commit()
+    except asyncio.CancelledError:
+        # 取消（cancel 接口、断开后无人重连、进程退出）或被同线程 interrupt 的新运行打断：
+        # 任务取消已传到模型请求与子 agent，这里收回取消、完成收尾后正常结束事件流
+        _uncancel()
+        run_status = _cancelled_status(ticket)
+        await session.rollback()
+        await _restore_run(session, run, run_id)
+        for call in tool_calls.interrupt_pending():
             yield {
-                "event": "message",
+                "event": "tool",
                 "data": {
-                    "message_id": f"{run.id}-assistant",
-                    "thread_id": thread_id,
-                    "role": "assistant",
-                    "content": content,
-                    "tool_calls": [],
+                    "tool_call_id": call["id"],
+                    "name": call["name"],
+                    "status": "interrupted",
+                    "result": None,
+                    "duration_ms": None,
                 },
             }
-            yield {"event": "end", "data": {"run_id": run.id, "status": "completed", "error": None}}
-
-        async for item in generator():
-            yield item
+        tool_calls.flush(session)
+        add_run_spans(session, run_id, trace.rows())
+        await finish_run(session, run_id, status=run_status)
+        logger.info("run %s %s", run_id, run_status)
+        yield {"event": "metrics", "data": trace.summary(run_id, final["usage"])}
+        yield {"event": "end", "data": {"run_id": run_id, "status": run_status, "error": None, "trace_id": trace.trace_id}}
     except Exception as exc:  # noqa: BLE001
-        await finish_run(session, run.id, status="error", error=str(exc))
-
-        async def error_generator():
-            yield {"event": "error", "data": {"message": str(exc), "code": "RUN_FAILED"}}
-            yield {"event": "end", "data": {"run_id": run.id, "status": "error", "error": str(exc)}}
-
-        async for item in error_generator():
-            yield item
-
+        # 失败的语句会让事务处于不可用状态；先回滚，再在新事务里写入工具调用、耗时与错误状态
+        await session.rollback()
+        await _restore_run(session, run, run_id)
+        tool_calls.flush(session)
+        add_run_spans(session, run_id, trace.rows())
+        await finish_run(session, run_id, status="error", error=str(exc))
+        logger.warning("run %s failed: %s", run_id, exc)
+        yield {"event": "error", "data": {"message": str(exc), "code": "RUN_FAILED", "trace_id": trace.trace_id}}
+        yield {"event": "metrics", "data": trace.summary(run_id)}
+        yield {"event": "end", "data": {"run_id": run_id, "status": "error", "error": str(exc), "trace_id": trace.trace_id}}
+    else:
+        # 运行已提交为 completed，此后的取消或裁剪失败都不再改变运行结果
+        if checkpoints is not None:
+            try:
+                await checkpoints.prune(thread_id)
+            except asyncio.CancelledError:
+                _uncancel()
+            except Exception:  # noqa: BLE001
+                logger.debug("checkpoint prune failed for thread %s", thread_id, exc_info=True)
+        metrics = trace.summary(run_id, final["usage"])
+        logger.info("run %s completed in %.1fms", run_id, metrics["total_ms"])
+        yield {"event": "metrics", "data": metrics}
+        yield {"event": "end", "data": {"run_id": run_id, "status": "completed", "error": None, "trace_id": trace.trace_id}}
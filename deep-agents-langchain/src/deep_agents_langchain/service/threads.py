@@ -1,10 +1,15 @@
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from deep_agents_langchain.storage.pagination import InvalidCursorError, InvalidFieldsError
 from deep_agents_langchain.storage.repositories import (
+    StateConflictError,
     create_thread,
     get_state,
     get_thread,
+    list_messages_page,
+    list_runs_page,
+    list_threads_page,
     upsert_state,
 )
 
@@ -25,7 +30,52 @@ async def read_state(session: AsyncSession, thread_id: str):
     return await get_state(session, thread_id)
 
 
-async def write_state(session: AsyncSession, thread_id: str, kv: dict, replace: bool):
+async def write_state(
+    session: AsyncSession, thread_id: str, kv: dict, replace: bool, expected_version: int | None = None
+):
     await ensure_thread(session, thread_id)
-    return await upsert_state(session, thread_id, kv, replace)
+    try:
+        return await upsert_state(session, thread_id, kv, replace, expected_version=expected_version)
+    except StateConflictError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
 
+
+
+def _page(items: list[dict], next_cursor: str | None) -> dict:
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def list_threads(session: AsyncSession, limit: int, cursor: str | None = None, fields: str | None = None):
+    try:
+        return _page(*await list_threads_page(session, limit, cursor=cursor, fields=fields))
+    except (InvalidCursorError, InvalidFieldsError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+
+async def list_thread_messages(
+    session: AsyncSession,
+    thread_id: str,
+    limit: int,
+    cursor: str | None = None,
+    fields: str | None = None,
+    descending: bool = False,
+):
+    await ensure_thread(session, thread_id)
+    try:
+        return _page(
+            *await list_messages_page(
+                session, thread_id, limit, cursor=cursor, fields=fields, descending=descending
+            )
+        )
+    except (InvalidCursorError, InvalidFieldsError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+
+async def list_thread_runs(
+    session: AsyncSession, thread_id: str, limit: int, cursor: str | None = None, fields: str | None = None
+):
+    await ensure_thread(session, thread_id)
+    try:
+        return _page(*await list_runs_page(session, thread_id, limit, cursor=cursor, fields=fields))
+    except (InvalidCursorError, InvalidFieldsError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
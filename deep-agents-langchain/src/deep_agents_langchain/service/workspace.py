@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from deep_agents_langchain.storage.repositories import list_file_paths, sync_workspace_files
+from deep_agents_langchain.storage.workspace_index import FileEntry, WorkspaceIndex
+
+
+def _file_rows(changed: dict[str, FileEntry]) -> list[dict]:
+    # files_meta 与大结果转存记录一致：使用以 / 开头的工作区路径、UTC 修改时间
+    # （列为不带时区的 DateTime，与其他时间列一样存 naive UTC）
+    return [
+        {
+            "path": "/" + rel,
+            "size": entry.size,
+            "modified_at": datetime.fromtimestamp(entry.mtime_ns / 1e9, timezone.utc).replace(tzinfo=None),
+        }
+        for rel, entry in changed.items()
+    ]
+
+
+class WorkspaceIndexer:
+    """固定目录扫描/索引服务：按 mtime 轮询 WORKSPACE_ROOT，增量更新工作区索引并同步到 files_meta。
+
+    进程内第一次刷新做全量对账（补齐缺失记录、删除已不存在的路径），之后只同步变化的文件；
+    索引有变化时持久化，重启后只需比对 mtime。
+    """
+
+    def __init__(self, index: WorkspaceIndex, sessionmaker: async_sessionmaker[AsyncSession], interval_seconds: float):
+        self.index = index
+        self.sessionmaker = sessionmaker
+        self.interval_seconds = interval_seconds
+        self._task: asyncio.Task | None = None
+        self._refresh_lock = asyncio.Lock()
+        self._reconciled = False
+
+    async def refresh(self) -> dict[str, int]:
+        """立即扫描一次（资源管理器“刷新”也走这里），返回变化计数。"""
+        async with self._refresh_lock:
+            changed, removed = await asyncio.to_thread(self.index.refresh)
+            async with self.sessionmaker() as session:
+                if not self._reconciled:
+                    changed = self.index.entries()
+                    removed = [path[1:] for path in await list_file_paths(session) if path[1:] not in changed]
+                await sync_workspace_files(session, _file_rows(changed), ["/" + rel for rel in removed])
+            self._reconciled = True
+            await asyncio.to_thread(self.index.dump)
+            return {"changed": len(changed), "removed": len(removed), "files": len(self.index)}
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(Exception):  # 单次扫描失败不终止轮询，下一轮重试
+                await self.refresh()
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await asyncio.to_thread(self.index.dump)
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+BLOB_REF_KEY = "$blob"
+
+
+class BlobStore:
+    """内容寻址的本地 blob 存储：sha256 作为键，相同内容只保存一份。"""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if path.exists():
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，并发写同一内容也不会留下半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return self._path(digest).read_bytes()
+
+    def put_json(self, value: Any) -> str:
+        return self.put(_dumps(value))
+
+    def get_json(self, digest: str) -> Any:
+        return json.loads(self.get(digest))
+
+    def offload(self, value: Any, inline_bytes: int) -> Any:
+        """序列化后不超过 inline_bytes 原样返回，否则落盘并返回 {"$blob": digest, "size": n}。"""
+        data = _dumps(value)
+        if len(data) <= inline_bytes:
+            return value
+        return {BLOB_REF_KEY: self.put(data), "size": len(data)}
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Any
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from deep_agents_langchain.storage.models import ToolCall
+
+
+class ToolCallBuffer:
+    """工具调用写后缓冲：运行中只在内存里累积，运行结束时随收尾事务一次性落库。"""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._rows: dict[str, dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def call_ids(self) -> list[str]:
+        return list(self._rows)
+
+    def record_call(self, tool_call: dict) -> None:
+        """记录模型发出的工具调用（pending）。"""
+        call_id = tool_call.get("id")
+        if not call_id:
+            return
+        now = datetime.utcnow()
+        self._rows.setdefault(
+            call_id,
+            {
+                "id": call_id,
+                "name": tool_call.get("name") or "",
+                "args": tool_call.get("args") or {},
+                "status": "pending",
+                "result": None,
+                "error": None,
+                "duration_ms": None,
+                "created_at": now,
+                "updated_at": now,
+            },
+        )
+
+    def record_result(
+        self, tool_call_id: str, name: str | None, status: str, result: Any, duration_ms: float | None = None
+    ) -> None:
+        """记录工具结果与耗时；缺少对应调用时补一条记录，保证 tool_call_id 可追溯。"""
+        if not tool_call_id:
+            return
+        if tool_call_id not in self._rows:
+            self.record_call({"id": tool_call_id, "name": name})
+        row = self._rows[tool_call_id]
+        row["status"] = status
+        if status == "error":
+            row["error"] = result if isinstance(result, str) else str(result)
+        else:
+            row["result"] = result
+        row["duration_ms"] = duration_ms
+        row["updated_at"] = datetime.utcnow()
+
+    def interrupt_pending(self) -> list[dict[str, Any]]:
+        """运行被取消时把仍未返回结果的调用标记为 interrupted，返回这些调用。"""
+        now = datetime.utcnow()
+        interrupted = []
+        for row in self._rows.values():
+            if row["status"] == "pending":
+                row["status"] = "interrupted"
+                row["updated_at"] = now
+                interrupted.append(row)
+        return interrupted
+
+    def flush(self, session: AsyncSession) -> int:
+        """把缓冲行加入 session（不提交），返回写入条数。缓冲行保留，收尾事务回滚后可重新加入。"""
+        session.add_all([ToolCall(run_id=self.run_id, **row) for row in self._rows.values()])
+        return len(self._rows)
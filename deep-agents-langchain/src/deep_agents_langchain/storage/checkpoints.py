@@ -0,0 +1,126 @@
+from typing import Any
+from sqlalchemy.engine import make_url
+
+from deep_agents_langchain.config.settings import Settings
+from deep_agents_langchain.storage.db import resolve_database_url, sqlite_pragmas
+
+try:
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except ImportError:  # pragma: no cover - 可选依赖
+    AsyncSqliteSaver = None  # type: ignore
+
+try:
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # pragma: no cover - 可选依赖
+    AsyncPostgresSaver = None  # type: ignore
+
+# 每个线程的每个 checkpoint_ns（主图与各子图）只保留最近 keep 个 checkpoint，其余连同 pending writes 删除
+_SQLITE_PRUNE = (
+    """
+    DELETE FROM checkpoints WHERE thread_id = ? AND (checkpoint_ns, checkpoint_id) IN (
+        SELECT checkpoint_ns, checkpoint_id FROM (
+            SELECT checkpoint_ns, checkpoint_id,
+                   ROW_NUMBER() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints WHERE thread_id = ?
+        ) WHERE rn > ?
+    )
+    """,
+    """
+    DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns
+          AND c.checkpoint_id = writes.checkpoint_id
+    )
+    """,
+)
+_POSTGRES_PRUNE = (
+    """
+    DELETE FROM checkpoints WHERE thread_id = %(thread_id)s AND (checkpoint_ns, checkpoint_id) IN (
+        SELECT checkpoint_ns, checkpoint_id FROM (
+            SELECT checkpoint_ns, checkpoint_id,
+                   ROW_NUMBER() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints WHERE thread_id = %(thread_id)s
+        ) ranked WHERE rn > %(keep)s
+    )
+    """,
+    """
+    DELETE FROM checkpoint_writes w WHERE w.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns
+          AND c.checkpoint_id = w.checkpoint_id
+    )
+    """,
+    # channel 值按版本存放，剩余 checkpoint 不再引用的版本一并清理
+    """
+    DELETE FROM checkpoint_blobs b WHERE b.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+          AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+    )
+    """,
+)
+
+
+class CheckpointStore:
+    """持有 LangGraph checkpointer 及其连接，运行结束后按保留数裁剪旧 checkpoint。"""
+
+    def __init__(self, saver: Any, dialect: str, conn: Any, retention: int):
+        self.saver = saver
+        self.dialect = dialect
+        self.retention = retention
+        self._conn = conn
+
+    async def has_thread(self, thread_id: str) -> bool:
+        """线程是否已有 checkpoint；没有时调用方需要用库里的历史消息初始化。"""
+        return await self.saver.aget_tuple({"configurable": {"thread_id": thread_id}}) is not None
+
+    async def prune(self, thread_id: str) -> None:
+        if self.retention <= 0:
+            return
+        if self.dialect == "sqlite":
+            # 与 saver 共用连接，借用它的锁避免与写 checkpoint 交错
+            async with self.saver.lock:
+                await self._conn.execute(_SQLITE_PRUNE[0], (thread_id, thread_id, self.retention))
+                await self._conn.execute(_SQLITE_PRUNE[1], (thread_id,))
+                await self._conn.commit()
+            return
+        async with self._conn.connection() as conn:
+            for sql in _POSTGRES_PRUNE:
+                await conn.execute(sql, {"thread_id": thread_id, "keep": self.retention})
+
+    async def aclose(self) -> None:
+        await self._conn.close()
+
+
+async def open_checkpoint_store(settings: Settings) -> CheckpointStore | None:
+    """按存储配置打开 checkpointer：与业务库同一个 SQLite 文件 / Postgres 实例。"""
+    if settings.checkpoint_backend == "none":
+        return None
+    url = make_url(resolve_database_url(settings))
+    if url.get_backend_name() == "sqlite":
+        if AsyncSqliteSaver is None:
+            raise RuntimeError("checkpointer 需要安装 langgraph-checkpoint-sqlite")
+        conn = await aiosqlite.connect(url.database)
+        for pragma in sqlite_pragmas(settings):
+            await conn.execute(pragma)
+        saver = AsyncSqliteSaver(conn)
+        await saver.setup()
+        return CheckpointStore(saver, "sqlite", conn, settings.checkpoint_retention)
+
+    if AsyncPostgresSaver is None:
+        raise RuntimeError("checkpointer 需要安装 langgraph-checkpoint-postgres")
+    # psycopg 使用不带驱动名的 libpq URL
+    conninfo = url.set(drivername="postgresql").render_as_string(hide_password=False)
+    pool = AsyncConnectionPool(
+        conninfo=conninfo,
+        max_size=settings.db_pool_size,
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        open=False,
+    )
+    await pool.open()
+    saver = AsyncPostgresSaver(pool)
+    await saver.setup()
+    return CheckpointStore(saver, "postgresql", pool, settings.checkpoint_retention)
@@ -1,24 +1,159 @@
+import time
 from pathlib import Path
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 from deep_agents_langchain.config.settings import Settings
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.migrations import add_missing_columns, compact_run_outputs
 from deep_agents_langchain.storage.models import Base
+from deep_agents_langchain.utils.metrics import DB_COMMIT, DB_QUERY
 
+_QUERY_OPS = frozenset({"select", "insert", "update", "delete"})
 
-def build_engine(settings: Settings) -> AsyncEngine:
-    """构建异步 SQLite 引擎，保证目录存在。"""
+
+def sqlite_pragmas(settings: Settings) -> list[str]:
+    """按配置生成连接级 PRAGMA；cache_size 取负数表示以 KiB 为单位。"""
+    return [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kb)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def _install_sqlite_pragmas(engine: AsyncEngine, pragmas: list[str]) -> None:
+    """在每个新连接上执行 PRAGMA，池中所有连接配置一致。"""
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):  # noqa: ARG001
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def _statement_op(statement: str) -> str:
+    op = statement.lstrip()[:6].lower()
+    return op if op in _QUERY_OPS else "other"
+
+
+def _install_query_metrics(engine: AsyncEngine) -> None:
+    """按语句类型记录执行耗时；语句类型固定为几种，标签基数有界。"""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):  # noqa: ARG001
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):  # noqa: ARG001
+        started = conn.info["query_started"].pop()
+        DB_QUERY.observe(time.perf_counter() - started, _statement_op(statement))
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _error(context):
+        # 失败的语句不会触发 after_cursor_execute，弹出开始时间避免错配
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class TimedSession(Session):
+    """记录 commit（含 flush）耗时的 Session。"""
+
+    def commit(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            DB_COMMIT.observe(time.perf_counter() - started)
+
+
+def resolve_database_url(settings: Settings) -> str:
+    """DATABASE_URL 优先；postgres:// 等简写统一换成 asyncpg 驱动，否则回落到 SQLite 文件。"""
+    if settings.database_url:
+        url = settings.database_url
+        for prefix in ("postgres://", "postgresql://"):
+            if url.startswith(prefix):
+                return "postgresql+asyncpg://" + url[len(prefix):]
+        return url
     db_path = Path(settings.sqlite_path)
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    return create_async_engine(f"sqlite+aiosqlite:///{db_path}", future=True)
+    return f"sqlite+aiosqlite:///{db_path}"
+
+
+def build_engine(settings: Settings) -> AsyncEngine:
+    """按 URL 构建异步引擎：SQLite 应用 WAL 等性能配置，Postgres 使用连接池多进程共享。"""
+    url = make_url(resolve_database_url(settings))
+    if url.get_backend_name() != "sqlite":
+        engine = create_async_engine(
+            url,
+            future=True,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=True,
+        )
+        _install_query_metrics(engine)
+        return engine
+
+    engine = create_async_engine(
+        url,
+        future=True,
+        # aiosqlite 默认 NullPool，每次请求都重新打开文件并重跑 PRAGMA；改为复用连接
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+    )
+    _install_sqlite_pragmas(engine, sqlite_pragmas(settings))
+    _install_query_metrics(engine)
+    return engine
 
 
 def build_sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
-    """创建异步 Session 工厂。"""
-    return async_sessionmaker(engine, expire_on_commit=False)
+    """创建异步 Session 工厂；commit 耗时计入 /metrics。"""
+    return async_sessionmaker(engine, expire_on_commit=False, sync_session_class=TimedSession)
+
+
+def _create_indexes(sync_conn) -> None:
+    """create_all 不会给已存在的表补索引，这里按反射到的列比对：缺失的创建，同名但列不同的删除重建。
+
+    列恰好是某个声明索引前缀的旧 ix_ 索引（如早期的窄索引）已被覆盖，删除以免重复维护。
+    """
+    inspector = inspect(sync_conn)
+    quote = sync_conn.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        declared = {index.name: [column.name for column in index.columns] for index in table.indexes}
+        existing = {ix["name"]: ix["column_names"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            current = existing.get(index.name)
+            if current == declared[index.name]:
+                continue
+            if current is not None:
+                index.drop(sync_conn)
+            index.create(sync_conn)
+        for name, columns in existing.items():
+            if name in declared or not name.startswith("ix_"):
+                continue
+            if any(wanted[: len(columns)] == columns for wanted in declared.values()):
+                sync_conn.execute(text(f"DROP INDEX {quote(name)}"))
 
 
-async def init_db(engine: AsyncEngine) -> None:
-    """初始化数据库表。"""
+async def init_db(engine: AsyncEngine, blob_store: BlobStore | None = None, inline_bytes: int = 4096) -> None:
+    """初始化数据库表、补齐新增列与二级索引；提供 blob_store 时顺带压缩旧格式的 runs.output。"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(_create_indexes)
+        if blob_store is not None:
+            await conn.run_sync(compact_run_outputs, blob_store, inline_bytes)
 
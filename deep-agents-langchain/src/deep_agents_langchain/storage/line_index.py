@@ -0,0 +1,161 @@
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+# 头部：magic、版本、源文件 mtime_ns、大小、总行数、采样步长（字节）
+_HEADER = struct.Struct("<4sHqqqq")
+_MAGIC = b"LIDX"
+_VERSION = 2
+# str.splitlines 认的换行符（UTF-8 编码）：\r\n、\n、\r、\v、\f、\x1c-\x1e、U+0085、U+2028、U+2029
+_LINE_BREAK = re.compile(rb"\r\n|[\n\r\v\f\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+_TRAILING_BREAK = re.compile(rb"(?:\r\n|[\n\r\v\f\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9])\Z")
+# (首字节, 换行序列)：\n 以外的换行符很少出现，先用 in（memchr）按首字节排除，再 count；
+# \r\n 同时含 \r 与 \n，计数时减去一次
+_RARE_BREAKS = (
+    (b"\r", b"\r"),
+    (b"\v", b"\v"),
+    (b"\f", b"\f"),
+    (b"\x1c", b"\x1c"),
+    (b"\x1d", b"\x1d"),
+    (b"\x1e", b"\x1e"),
+    (b"\xc2", b"\xc2\x85"),
+    (b"\xe2", b"\xe2\x80\xa8"),
+    (b"\xe2", b"\xe2\x80\xa9"),
+)
+
+
+def _count_breaks(chunk: bytes) -> int:
+    """统计 chunk 内 str.splitlines 意义上的换行数。"""
+    total = chunk.count(b"\n")
+    for lead, seq in _RARE_BREAKS:
+        if lead in chunk:
+            total += chunk.count(seq)
+    if b"\r" in chunk:
+        total -= chunk.count(b"\r\n")
+    return total
+
+
+class LineIndex:
+    """稀疏行偏移索引：约每 step 字节记录一个 (行首字节偏移, 行号)。
+
+    定位任意行先二分找到不超过它的采样点，再在 mmap 上向后跳过不超过一个采样块的行，
+    读取 limit 行的代价与文件大小和 offset 无关。
+    """
+
+    def __init__(self, mtime_ns: int, size: int, total_lines: int, step: int, offsets: array, lines: array):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.total_lines = total_lines
+        self.step = step
+        self.offsets = offsets
+        self.lines = lines
+
+    @classmethod
+    def build(cls, mm: mmap.mmap, mtime_ns: int, step: int) -> "LineIndex":
+        """扫描一遍文件建立索引；按块统计换行符，避免逐行的 Python 循环。"""
+        size = len(mm)
+        offsets, lines = array("q", [0]), array("q", [0])
+        breaks = 0
+        prev = 0
+        for block_start in range(step, size, step):
+            found = _LINE_BREAK.search(mm, block_start - 1)
+            if found is None or found.end() >= size:
+                break
+            start = found.end()
+            if start <= prev:
+                continue
+            breaks += _count_breaks(mm[prev:start])
+            offsets.append(start)
+            lines.append(breaks)
+            prev = start
+        breaks += _count_breaks(mm[prev:size])
+        # 与 str.splitlines 一致：末尾没有换行时最后一段也算一行
+        total = breaks + (1 if size and not _TRAILING_BREAK.search(mm[max(0, size - 3) : size]) else 0)
+        return cls(mtime_ns, size, total, step, offsets, lines)
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+
+    def read_lines(self, mm: mmap.mmap, offset: int, limit: int) -> list[str]:
+        """读取 [offset, offset + limit) 行（0 起始），分行规则与 str.splitlines 相同。"""
+        i = bisect.bisect_right(self.lines, offset) - 1
+        pos, line = self.offsets[i], self.lines[i]
+        while line < offset:
+            pos = _LINE_BREAK.search(mm, pos).end()
+            line += 1
+        end = pos
+        for _ in range(limit):
+            found = _LINE_BREAK.search(mm, end)
+            if found is None:
+                end = len(mm)
+                break
+            end = found.end()
+        return mm[pos:end].decode("utf-8").splitlines()
+
+    def dump(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.mtime_ns, self.size, self.total_lines, self.step))
+            self.offsets.tofile(f)
+            self.lines.tofile(f)
+        # 原子替换，并发读不会看到写了一半的索引
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "LineIndex | None":
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, mtime_ns, size, total, step = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            return None
+        values = array("q")
+        values.frombytes(data[_HEADER.size :])
+        half = len(values) // 2
+        return cls(mtime_ns, size, total, step, values[:half], values[half:])
+
+
+class LineIndexStore:
+    """按文件缓存行索引：内存 LRU + 磁盘持久化，源文件 mtime/大小变化时重建。"""
+
+    def __init__(self, root: str, step: int = 65536, max_cached: int = 64):
+        self.root = Path(root)
+        self.step = step
+        self.max_cached = max_cached
+        self._cache: OrderedDict[str, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index_path(self, file_path: Path) -> Path:
+        digest = hashlib.sha256(str(file_path).encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / f"{digest}.idx"
+
+    def get(self, file_path: Path, mm: mmap.mmap, stat: os.stat_result) -> LineIndex:
+        """取 file_path 的有效索引；缓存与磁盘都失效时扫描 mm 重建并落盘。"""
+        key = str(file_path)
+        with self._lock:
+            index = self._cache.get(key)
+            if index is not None:
+                self._cache.move_to_end(key)
+        if index is None or not index.matches(stat):
+            index_path = self._index_path(file_path)
+            index = LineIndex.load(index_path)
+            if index is None or not index.matches(stat) or index.step != self.step:
+                index = LineIndex.build(mm, stat.st_mtime_ns, self.step)
+                index.dump(index_path)
+            with self._lock:
+                self._cache[key] = index
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_cached:
+                    self._cache.popitem(last=False)
+        return index
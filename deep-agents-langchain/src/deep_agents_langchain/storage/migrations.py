@@ -0,0 +1,56 @@
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.schema import CreateColumn
+
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.models import Base, Run
+from deep_agents_langchain.storage.run_output import compact_legacy_output
+
+
+def add_missing_columns(sync_conn) -> list[str]:
+    """给已存在的表补齐模型新增的列（create_all 不会修改已有表）。
+
+    新增列必须可空或带 server_default，返回执行过的 DDL 便于记录。
+    """
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    executed: list[str] = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            spec = CreateColumn(column).compile(dialect=sync_conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {spec}"
+            sync_conn.execute(text(ddl))
+            executed.append(ddl)
+    return executed
+
+
+def compact_run_outputs(sync_conn, blob_store: BlobStore, inline_bytes: int, batch_size: int = 500) -> int:
+    """把旧格式的 runs.output 转为紧凑格式，原始内容转存为 blob；可重复执行，返回改写行数。
+
+    只在 SQL 里选出没有版本号 v 的行（output->>'v' / json_extract(output, '$.v') 为空），
+    全部迁移完后启动时只多一次扫描，不再把每行 output 读进内存。
+    """
+    runs = Run.__table__
+    last_id = ""
+    migrated = 0
+    while True:
+        rows = sync_conn.execute(
+            select(runs.c.id, runs.c.output)
+            .where(runs.c.id > last_id, runs.c.output.is_not(None), runs.c.output["v"].as_string().is_(None))
+            .order_by(runs.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return migrated
+        for run_id, output in rows:
+            # JSON 列里的 Python None 会存成 'null'，SQL 层过滤不掉
+            if output is None:
+                continue
+            compact = compact_legacy_output(output, blob_store, inline_bytes)
+            sync_conn.execute(update(runs).where(runs.c.id == run_id).values(output=compact))
+            migrated += 1
+        last_id = rows[-1][0]
@@ -1,8 +1,12 @@
 from datetime import datetime
 from typing import Any
-from sqlalchemy import JSON, Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import JSON, Column, DateTime, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+# Postgres 下使用 JSONB（支持 || 合并与索引），其他方言保持 JSON
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class Base(DeclarativeBase):
     pass
@@ -10,9 +14,12 @@ class Base(DeclarativeBase):
 
 class Thread(Base):
     __tablename__ = "threads"
+    # 线程列表按 (created_at, id) keyset 分页
+    __table_args__ = (Index("ix_threads_created", "created_at", "id"),)
 
     id: Mapped[str] = mapped_column(String, primary_key=True)
-    metadata: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    # metadata 是 Declarative 保留名，属性改名但列名保持 metadata
+    metadata_: Mapped[Any | None] = mapped_column("metadata", JSONType, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
@@ -23,28 +30,37 @@ class Thread(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # (thread_id, order_num, id) 同时覆盖按线程过滤、按顺序读取历史与 keyset 分页
+    __table_args__ = (Index("ix_messages_thread_order_id", "thread_id", "order_num", "id"),)
 
     id: Mapped[str] = mapped_column(String, primary_key=True)
     thread_id: Mapped[str] = mapped_column(String, ForeignKey("threads.id"))
     role: Mapped[str] = mapped_column(String, nullable=False)
-    content: Mapped[Any] = mapped_column(JSON, nullable=False)
+    content: Mapped[Any] = mapped_column(JSONType, nullable=False)
     order_num: Mapped[int] = mapped_column(Integer, default=0)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # 助手消息发起的工具调用、工具结果对应的调用 id：库中历史与 checkpoint 逐条一致，可直接重放
+    tool_calls: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
+    tool_call_id: Mapped[str | None] = mapped_column(String, nullable=True)
 
     thread: Mapped["Thread"] = relationship("Thread", back_populates="messages")
 
 
 class Run(Base):
     __tablename__ = "runs"
+    # 覆盖按线程过滤与 (started_at, id) keyset 分页
+    __table_args__ = (Index("ix_runs_thread_started", "thread_id", "started_at", "id"),)
 
     id: Mapped[str] = mapped_column(String, primary_key=True)
     thread_id: Mapped[str] = mapped_column(String, ForeignKey("threads.id"))
     status: Mapped[str] = mapped_column(String, default="pending")
-    input: Mapped[Any | None] = mapped_column(JSON, nullable=True)
-    output: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    input: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
+    output: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
     error: Mapped[str | None] = mapped_column(String, nullable=True)
     started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     ended_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # 追踪 ID，SSE 事件与日志中使用同一个值
+    trace_id: Mapped[str | None] = mapped_column(String, nullable=True)
 
     thread: Mapped["Thread"] = relationship("Thread", back_populates="runs")
     tool_calls: Mapped[list["ToolCall"]] = relationship("ToolCall", back_populates="run")
@@ -52,25 +68,46 @@ class Run(Base):
 
 class ToolCall(Base):
     __tablename__ = "tool_calls"
+    __table_args__ = (Index("ix_tool_calls_run_id", "run_id"),)
 
     id: Mapped[str] = mapped_column(String, primary_key=True)
     run_id: Mapped[str] = mapped_column(String, ForeignKey("runs.id"))
     name: Mapped[str] = mapped_column(String, nullable=False)
-    args: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    args: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
     status: Mapped[str] = mapped_column(String, default="pending")
-    result: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    result: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
     error: Mapped[str | None] = mapped_column(String, nullable=True)
+    # 工具执行的墙钟耗时（含并发排队）
+    duration_ms: Mapped[float | None] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     run: Mapped["Run"] = relationship("Run", back_populates="tool_calls")
 
 
+class RunSpan(Base):
+    """运行内的耗时片段：排队、模型调用、工具调用；start_ms 相对运行开始。"""
+
+    __tablename__ = "run_spans"
+    __table_args__ = (Index("ix_run_spans_run_id", "run_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    run_id: Mapped[str] = mapped_column(String, ForeignKey("runs.id"))
+    trace_id: Mapped[str] = mapped_column(String, nullable=False)
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    start_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    duration_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    attributes: Mapped[Any | None] = mapped_column(JSONType, nullable=True)
+
+
 class State(Base):
     __tablename__ = "state"
 
     thread_id: Mapped[str] = mapped_column(String, ForeignKey("threads.id"), primary_key=True)
-    kv: Mapped[Any] = mapped_column(JSON, default=dict)
+    kv: Mapped[Any] = mapped_column(JSONType, default=dict)
+    # 乐观锁版本号，每次写入 +1
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default="1", nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     thread: Mapped["Thread"] = relationship("Thread", back_populates="state")
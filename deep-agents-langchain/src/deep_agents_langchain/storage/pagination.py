@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any
+
+# 每页条数上限，防止一次拉取整个线程
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析或与当前列表不匹配。"""
+
+
+class InvalidFieldsError(ValueError):
+    """fields 投影中包含不支持的字段。"""
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(kind: str, keys: tuple) -> str:
+    """把上一页最后一行的排序键编码成不透明游标（URL 安全 base64）。"""
+    raw = json.dumps({"k": kind, "v": [_encode_value(v) for v in keys]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(kind: str, cursor: str, size: int) -> tuple:
+    """解析游标；类型或键个数不符时抛出 InvalidCursorError。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = tuple(_decode_value(v) for v in data["v"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursorError("invalid cursor") from exc
+    if data.get("k") != kind or len(values) != size:
+        raise InvalidCursorError("cursor does not belong to this listing")
+    return values
+
+
+def parse_fields(fields: str | None, allowed: set[str], required: set[str]) -> list[str]:
+    """解析逗号分隔的字段投影；未指定时返回全部字段，排序键总是包含在内。"""
+    if not fields:
+        return sorted(allowed)
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise InvalidFieldsError(f"unsupported fields: {', '.join(sorted(unknown))}")
+    return sorted(requested | required)
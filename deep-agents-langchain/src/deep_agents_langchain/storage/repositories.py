@@ -1,14 +1,45 @@
 from datetime import datetime
 from typing import Any
 from uuid import uuid4
-from sqlalchemy import select, update
+from sqlalchemy import case, cast, delete, func, literal, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from deep_agents_langchain.storage.models import Message, Run, State, Thread
+from deep_agents_langchain.storage.models import FileMeta, Message, Run, RunSpan, State, Thread
+from deep_agents_langchain.storage.pagination import decode_cursor, encode_cursor, parse_fields
+
+# 列表接口可投影的字段（对外名 -> 列），排序键总是返回以便生成游标
+THREAD_FIELDS = {
+    "id": Thread.id,
+    "metadata": Thread.metadata_,
+    "created_at": Thread.created_at,
+    "updated_at": Thread.updated_at,
+}
+MESSAGE_FIELDS = {
+    "id": Message.id,
+    "role": Message.role,
+    "content": Message.content,
+    "order_num": Message.order_num,
+    "created_at": Message.created_at,
+    "tool_calls": Message.tool_calls,
+    "tool_call_id": Message.tool_call_id,
+}
+RUN_FIELDS = {
+    "id": Run.id,
+    "status": Run.status,
+    "input": Run.input,
+    "output": Run.output,
+    "error": Run.error,
+    "started_at": Run.started_at,
+    "ended_at": Run.ended_at,
+    "trace_id": Run.trace_id,
+}
 
 
 async def create_thread(session: AsyncSession, metadata: dict | None = None) -> Thread:
-    thread = Thread(id=str(uuid4()), metadata=metadata or {}, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    thread = Thread(id=str(uuid4()), metadata_=metadata or {}, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
     session.add(thread)
     await session.commit()
     await session.refresh(thread)
@@ -20,22 +51,85 @@ async def get_thread(session: AsyncSession, thread_id: str) -> Thread | None:
     return result.scalars().first()
 
 
-async def upsert_state(session: AsyncSession, thread_id: str, kv: dict, replace: bool) -> State:
-    existing = await session.execute(select(State).where(State.thread_id == thread_id))
-    state = existing.scalars().first()
+class StateConflictError(Exception):
+    """乐观锁冲突：expected_version 与库中版本不一致。"""
+
+
+def _dialect_name(session: AsyncSession) -> str:
+    return session.get_bind().dialect.name
+
+
+def _dialect_insert(session: AsyncSession, model):
+    """按当前连接方言选择支持 ON CONFLICT 的 insert 构造器。"""
+    if _dialect_name(session) == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+
+def _json_object_merge_sqlite(current, incoming):
+    """SQLite 下的浅合并：incoming 的顶层键覆盖 current，值为 null 的键保留为 null（与 jsonb || 一致）。
+
+    不用 json_patch：它按 RFC 7396 递归合并嵌套对象并删除 null 键。json_each 的 value 列会把
+    true/false 变成 1/0、字符串去掉引号，这里按 type 还原成 JSON 文本后再交给 json_group_object。
+    """
+    old = func.json_each(func.coalesce(current, "{}")).table_valued("key", "value", "type", name="old_kv")
+    new = func.json_each(incoming).table_valued("key", "value", "type", name="new_kv")
+
+    def json_text(each):
+        return case(
+            (each.c.type == "text", func.json_quote(each.c.value)),
+            (each.c.type.in_(("true", "false", "null")), each.c.type),
+            else_=each.c.value,
+        ).label("value")
+
+    merged = union_all(
+        select(old.c.key, json_text(old)).where(old.c.key.not_in(select(new.c.key))),
+        select(new.c.key, json_text(new)),
+    ).subquery("merged")
+    return select(func.json_group_object(merged.c.key, func.json(merged.c.value))).scalar_subquery()
+
+
+def _json_merge(session: AsyncSession, current, incoming):
+    """库内浅合并 JSON 对象：顶层键覆盖、嵌套对象整体替换、null 值保留。Postgres 用 jsonb ||。"""
+    if _dialect_name(session) == "postgresql":
+        return func.coalesce(current, cast("{}", JSONB)).op("||")(incoming)
+    return func.coalesce(_json_object_merge_sqlite(current, incoming), "{}")
+
+
+async def upsert_state(
+    session: AsyncSession, thread_id: str, kv: dict, replace: bool, expected_version: int | None = None
+) -> State:
+    """单条语句完成写入与合并，无读改写竞争。
+
+    expected_version 为 None 时直接 INSERT ... ON CONFLICT DO UPDATE；为 0 表示状态必须尚不存在；
+    其余值只更新该版本的已有状态。不满足时抛出 StateConflictError。
+    """
     now = datetime.utcnow()
-    if state is None:
-        state = State(thread_id=thread_id, kv=kv, updated_at=now)
-        session.add(state)
-    else:
-        merged = kv if replace else {**(state.kv or {}), **kv}
-        await session.execute(
+    if expected_version:
+        incoming = literal(kv, State.kv.type)
+        new_kv = incoming if replace else _json_merge(session, State.kv, incoming)
+        stmt = (
             update(State)
-            .where(State.thread_id == thread_id)
-            .values(kv=merged, updated_at=now)
+            .where(State.thread_id == thread_id, State.version == expected_version)
+            .values(kv=new_kv, version=State.version + 1, updated_at=now)
+            .returning(State)
         )
+    else:
+        stmt = _dialect_insert(session, State).values(thread_id=thread_id, kv=kv, version=1, updated_at=now)
+        new_kv = stmt.excluded.kv if replace else _json_merge(session, State.kv, stmt.excluded.kv)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[State.thread_id],
+            set_={"kv": new_kv, "version": State.version + 1, "updated_at": stmt.excluded.updated_at},
+            # expected_version=0：已存在的状态一律冲突
+            where=(State.version == expected_version) if expected_version is not None else None,
+        ).returning(State)
+    # populate_existing：identity map 里已加载的 State 用 RETURNING 的新值覆盖
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    state = result.scalars().first()
+    # 版本不匹配时语句不写入任何行；用 commit 结束空事务，避免 rollback 让已加载对象全部过期
     await session.commit()
-    await session.refresh(state)
+    if state is None:
+        raise StateConflictError(f"state of thread {thread_id} is not at version {expected_version}")
     return state
 
 
@@ -44,35 +138,58 @@ async def get_state(session: AsyncSession, thread_id: str) -> State | None:
     return result.scalars().first()
 
 
-async def create_run(session: AsyncSession, thread_id: str, payload: Any) -> Run:
+async def create_run(
+    session: AsyncSession,
+    thread_id: str,
+    payload: Any,
+    commit: bool = True,
+    trace_id: str | None = None,
+    run_id: str | None = None,
+) -> Run:
+    """创建运行记录；commit=False 时由调用方在同一事务里统一提交。run_id 可由调用方预先分配。"""
     run = Run(
-        id=str(uuid4()),
+        id=run_id or str(uuid4()),
         thread_id=thread_id,
         input=payload,
         status="running",
         started_at=datetime.utcnow(),
+        trace_id=trace_id,
     )
     session.add(run)
-    await session.commit()
-    await session.refresh(run)
+    if commit:
+        await session.commit()
     return run
 
 
-async def finish_run(session: AsyncSession, run_id: str, status: str, output: Any | None = None, error: str | None = None) -> Run:
-    result = await session.execute(select(Run).where(Run.id == run_id))
-    run = result.scalars().first()
+async def get_run(session: AsyncSession, thread_id: str, run_id: str) -> Run | None:
+    result = await session.execute(select(Run).where(Run.id == run_id, Run.thread_id == thread_id))
+    return result.scalars().first()
+
+
+async def finish_run(
+    session: AsyncSession,
+    run_id: str,
+    status: str,
+    output: Any | None = None,
+    error: str | None = None,
+    commit: bool = True,
+) -> Run:
+    # 同一 session 内创建的 run 直接命中 identity map，不再额外 SELECT
+    run = await session.get(Run, run_id)
     if run is None:
         raise ValueError(f"Run {run_id} not found")
     run.status = status
     run.output = output
     run.error = error
     run.ended_at = datetime.utcnow()
-    await session.commit()
-    await session.refresh(run)
+    if commit:
+        await session.commit()
     return run
 
 
-async def append_message(session: AsyncSession, thread_id: str, role: str, content: Any, order_num: int) -> Message:
+async def append_message(
+    session: AsyncSession, thread_id: str, role: str, content: Any, order_num: int, commit: bool = True
+) -> Message:
     message = Message(
         id=str(uuid4()),
         thread_id=thread_id,
@@ -82,7 +199,183 @@ async def append_message(session: AsyncSession, thread_id: str, role: str, conte
         created_at=datetime.utcnow(),
     )
     session.add(message)
-    await session.commit()
-    await session.refresh(message)
+    if commit:
+        await session.commit()
     return message
 
+
+async def list_messages(session: AsyncSession, thread_id: str) -> list[Message]:
+    """按 order_num 读取线程全部消息（走 ix_messages_thread_order_id）。"""
+    result = await session.execute(
+        select(Message).where(Message.thread_id == thread_id).order_by(Message.order_num, Message.created_at)
+    )
+    return list(result.scalars().all())
+
+
+async def next_order_num(session: AsyncSession, thread_id: str) -> int:
+    """线程内下一条消息的 order_num，保证跨运行单调递增。"""
+    result = await session.execute(
+        select(func.coalesce(func.max(Message.order_num), -1)).where(Message.thread_id == thread_id)
+    )
+    return int(result.scalar_one()) + 1
+
+
+async def append_messages(
+    session: AsyncSession, thread_id: str, messages: list[dict], start_order: int = 0, commit: bool = True
+) -> list[Message]:
+    """批量写入消息，一次 flush/commit 完成，order_num 从 start_order 递增。"""
+    now = datetime.utcnow()
+    rows = [
+        Message(
+            id=str(uuid4()),
+            thread_id=thread_id,
+            role=msg.get("role", "user"),
+            content=msg.get("content"),
+            order_num=start_order + idx,
+            created_at=now,
+            tool_calls=msg.get("tool_calls"),
+            tool_call_id=msg.get("tool_call_id"),
+        )
+        for idx, msg in enumerate(messages)
+    ]
+    session.add_all(rows)
+    if commit:
+        await session.commit()
+    return rows
+
+
+async def upsert_files_meta(session: AsyncSession, thread_id: str, files: list[dict], commit: bool = True) -> None:
+    """记录写入工作区的文件（路径、大小、修改时间、所属线程）；同一路径覆盖旧记录。"""
+    if not files:
+        return
+    now = datetime.utcnow()
+    # 同一批次里重复的路径只保留最后一条，避免 ON CONFLICT 在一条语句内命中两次
+    rows = {f["path"]: {"path": f["path"], "size": f.get("size"), "modified_at": now, "thread_id": thread_id} for f in files}
+    stmt = _dialect_insert(session, FileMeta).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FileMeta.path],
+        set_={
+            "size": stmt.excluded.size,
+            "modified_at": stmt.excluded.modified_at,
+            "thread_id": stmt.excluded.thread_id,
+        },
+    )
+    await session.execute(stmt)
+    if commit:
+        await session.commit()
+
+
+def add_run_spans(session: AsyncSession, run_id: str, rows: list[dict]) -> None:
+    """把运行的耗时片段加入 session（不提交），随运行收尾事务一起写入。"""
+    session.add_all([RunSpan(run_id=run_id, **row) for row in rows])
+
+
+async def list_file_paths(session: AsyncSession) -> list[str]:
+    result = await session.execute(select(FileMeta.path))
+    return list(result.scalars().all())
+
+
+async def sync_workspace_files(
+    session: AsyncSession,
+    files: list[dict],
+    removed: list[str],
+    commit: bool = True,
+    batch_size: int = 200,
+) -> None:
+    """把工作区扫描结果同步到 files_meta：更新大小与修改时间（保留所属线程），删除已不存在的路径。
+
+    分批写入，避免单条语句超过 SQLite 的参数上限。
+    """
+    for start in range(0, len(files), batch_size):
+        rows = [
+            {"path": f["path"], "size": f.get("size"), "modified_at": f.get("modified_at")}
+            for f in files[start : start + batch_size]
+        ]
+        stmt = _dialect_insert(session, FileMeta).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FileMeta.path],
+            set_={"size": stmt.excluded.size, "modified_at": stmt.excluded.modified_at},
+        )
+        await session.execute(stmt)
+    for start in range(0, len(removed), batch_size):
+        await session.execute(delete(FileMeta).where(FileMeta.path.in_(removed[start : start + batch_size])))
+    if commit:
+        await session.commit()
+
+
+async def _keyset_page(
+    session: AsyncSession,
+    kind: str,
+    columns: dict,
+    sort_keys: tuple[str, ...],
+    filters: list,
+    limit: int,
+    cursor: str | None,
+    fields: str | None,
+    descending: bool,
+) -> tuple[list[dict], str | None]:
+    """按 sort_keys 做 keyset 分页：WHERE (k1, k2) > 游标 ORDER BY k1, k2 LIMIT n+1，耗时与页码无关。"""
+    names = parse_fields(fields, set(columns), set(sort_keys))
+    key_columns = [columns[key] for key in sort_keys]
+    stmt = select(*[columns[name].label(name) for name in names]).where(*filters)
+    if cursor:
+        after = tuple_(*key_columns)
+        values = tuple_(*decode_cursor(kind, cursor, len(sort_keys)))
+        stmt = stmt.where(after < values if descending else after > values)
+    order_by = [col.desc() if descending else col.asc() for col in key_columns]
+    # 多取一行判断是否还有下一页
+    rows = (await session.execute(stmt.order_by(*order_by).limit(limit + 1))).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(kind, tuple(items[-1][key] for key in sort_keys))
+    return items, next_cursor
+
+
+async def list_threads_page(
+    session: AsyncSession, limit: int, cursor: str | None = None, fields: str | None = None
+) -> tuple[list[dict], str | None]:
+    """按 (created_at, id) 倒序分页列出线程（走 ix_threads_created）。"""
+    return await _keyset_page(
+        session, "threads", THREAD_FIELDS, ("created_at", "id"), [], limit, cursor, fields, descending=True
+    )
+
+
+async def list_messages_page(
+    session: AsyncSession,
+    thread_id: str,
+    limit: int,
+    cursor: str | None = None,
+    fields: str | None = None,
+    descending: bool = False,
+) -> tuple[list[dict], str | None]:
+    """按 (order_num, id) 分页读取线程消息（走 ix_messages_thread_order_id）。"""
+    return await _keyset_page(
+        session,
+        # 游标绑定排序方向，换方向时旧游标直接判为无效
+        "messages.desc" if descending else "messages",
+        MESSAGE_FIELDS,
+        ("order_num", "id"),
+        [Message.thread_id == thread_id],
+        limit,
+        cursor,
+        fields,
+        descending=descending,
+    )
+
+
+async def list_runs_page(
+    session: AsyncSession, thread_id: str, limit: int, cursor: str | None = None, fields: str | None = None
+) -> tuple[list[dict], str | None]:
+    """按 (started_at, id) 倒序分页列出线程的运行（走 ix_runs_thread_started）。"""
+    return await _keyset_page(
+        session,
+        "runs",
+        RUN_FIELDS,
+        ("started_at", "id"),
+        [Run.thread_id == thread_id],
+        limit,
+        cursor,
+        fields,
+        descending=True,
+    )
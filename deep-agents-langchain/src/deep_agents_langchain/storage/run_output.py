@@ -0,0 +1,75 @@
+from typing import Any
+
+from deep_agents_langchain.storage.blobs import BlobStore
+
+# runs.output 的紧凑格式版本号；没有 v 字段的是旧格式
+RUN_OUTPUT_VERSION = 1
+
+
+def empty_usage() -> dict[str, int]:
+    return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+
+def add_usage(total: dict[str, int], usage: dict | None) -> None:
+    """累加 usage_metadata 中的 token 计数。"""
+    if not usage:
+        return
+    for key in ("input_tokens", "output_tokens", "total_tokens"):
+        total[key] = total.get(key, 0) + int(usage.get(key) or 0)
+
+
+def compact_run_output(
+    *,
+    message_id: str | None,
+    usage: dict[str, int],
+    tool_call_ids: list[str],
+    state_delta: dict,
+    blob_store: BlobStore | None,
+    inline_bytes: int,
+) -> dict:
+    """构造紧凑的运行输出：只引用最终消息行，大字段转存为 blob。"""
+    if blob_store is not None and state_delta:
+        state_delta = blob_store.offload(state_delta, inline_bytes)
+    return {
+        "v": RUN_OUTPUT_VERSION,
+        "final_message_id": message_id,
+        "usage": usage,
+        "tool_call_ids": tool_call_ids,
+        "state_delta": state_delta,
+    }
+
+
+def _field(message: Any, key: str, default: Any = None) -> Any:
+    if isinstance(message, dict):
+        return message.get(key, default)
+    return getattr(message, key, default)
+
+
+def compact_legacy_output(output: Any, blob_store: BlobStore, inline_bytes: int) -> dict:
+    """把旧格式（整个 agent 结果或 {message_id, content}）转换为紧凑格式，原始内容整体存为 blob。"""
+    usage = empty_usage()
+    tool_call_ids: list[str] = []
+    state_delta: dict = {}
+    message_id = None
+    if isinstance(output, dict):
+        message_id = output.get("message_id")
+        messages = output.get("messages")
+        if isinstance(messages, list):
+            for message in messages:
+                add_usage(usage, _field(message, "usage_metadata"))
+                for tool_call in _field(message, "tool_calls") or []:
+                    if isinstance(tool_call, dict) and tool_call.get("id"):
+                        tool_call_ids.append(tool_call["id"])
+            if messages:
+                message_id = _field(messages[-1], "id")
+        state_delta = {k: v for k, v in output.items() if k not in ("messages", "message_id", "content")}
+    compact = compact_run_output(
+        message_id=message_id,
+        usage=usage,
+        tool_call_ids=tool_call_ids,
+        state_delta=state_delta,
+        blob_store=blob_store,
+        inline_bytes=inline_bytes,
+    )
+    compact["legacy_blob"] = blob_store.put_json(output)
+    return compact
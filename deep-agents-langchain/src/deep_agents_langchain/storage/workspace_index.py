@@ -0,0 +1,365 @@
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from wcmatch import glob as wcglob
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_parse  # type: ignore[no-redef]
+
+_VERSION = 1
+# 判断二进制文件只看开头这些字节
+_BINARY_SNIFF_BYTES = 8192
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None))
+
+
+class FileEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    # 内容三元组（ASCII 小写后的 3 字节按大端转成整数）；None 表示超过大小上限未建内容索引，grep 总是打开
+    grams: array | None
+    binary: bool = False
+
+    @property
+    def modified_at(self) -> datetime:
+        # 与 os.stat_result.st_mtime 的换算一致，保证和直接 stat 得到的时间相同
+        seconds, nanos = divmod(self.mtime_ns, 1_000_000_000)
+        return datetime.fromtimestamp(seconds + nanos * 1e-9)
+
+
+def _trigrams(data: bytes) -> array:
+    data = data.lower()
+    # zip 在 C 层逐字节滑动，比逐个切片快一倍；只对去重后的三元组做整数换算
+    unique = set(zip(data, data[1:], data[2:]))
+    return array("I", [(a << 16) | (b << 8) | c for a, b, c in unique])
+
+
+def _flush(runs: list[bytes], current: list[str]) -> None:
+    if current:
+        runs.append("".join(current).encode("utf-8").lower())
+        current.clear()
+
+
+def _walk(items, ignore_case: bool, runs: list[bytes], current: list[str]) -> None:
+    for op, av in items:
+        # 忽略大小写时非 ASCII 字符的大小写变体字节不同，不能当作字面量
+        if op == sre_parse.LITERAL and not (ignore_case and av > 0x7F):
+            current.append(chr(av))
+        elif op == sre_parse.SUBPATTERN:
+            _group, add_flags, _del_flags, sub = av
+            _walk(sub, ignore_case or bool(add_flags & re.IGNORECASE), runs, current)
+        else:
+            _flush(runs, current)
+            if op in _REPEATS and av[0] >= 1:
+                # 至少重复一次的部分必然出现，但与前后不相邻
+                inner: list[str] = []
+                _walk(av[2], ignore_case, runs, inner)
+                _flush(runs, inner)
+
+
+def required_literals(pattern: str) -> list[bytes]:
+    """提取任何匹配都必须包含的字面量片段（UTF-8、ASCII 小写）；分支等无法确定的部分直接跳过。"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return []
+    runs: list[bytes] = []
+    current: list[str] = []
+    _walk(parsed, bool(parsed.state.flags & re.IGNORECASE), runs, current)
+    _flush(runs, current)
+    return [run for run in runs if len(run) >= 3]
+
+
+class _Dir:
+    """路径 trie 的目录节点。"""
+
+    __slots__ = ("dirs", "files")
+
+    def __init__(self):
+        self.dirs: dict[str, _Dir] = {}
+        self.files: dict[str, FileEntry] = {}
+
+
+class WorkspaceIndex:
+    """工作区文件索引：路径 trie + 三元组内容倒排索引，供 glob/grep 使用。
+
+    glob 在 trie 上匹配路径，不再遍历磁盘；grep 先用正则中的必含字面量求候选文件，只打开候选文件。
+    refresh 按 mtime/大小增量扫描，只重建变化的文件；经后端写入的文件由 update 立即更新。
+    变化记录在 dirty 中，由 drain_changes 取出同步到 files_meta。
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_file_bytes: int = 1024 * 1024,
+        persist_path: str | None = None,
+        ignore: Iterable[str] = (),
+    ):
+        self.root = Path(root).resolve()
+        self.max_file_bytes = max_file_bytes
+        self.persist_path = Path(persist_path) if persist_path else None
+        # 不纳入索引的相对路径（如放在工作区里的 SQLite 库文件，频繁变化且对 agent 无意义）
+        self.ignore = frozenset(ignore)
+        self._tree = _Dir()
+        self._entries: dict[str, FileEntry] = {}
+        self._postings: dict[int, set[str]] = {}
+        self._dirty: dict[str, FileEntry | None] = {}
+        self._lock = threading.Lock()
+        self._saved = True
+        self.ready = False
+        self.refreshes = 0
+        self.last_refresh_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "files": len(self._entries),
+            "content_indexed": sum(1 for entry in self._entries.values() if entry.grams is not None),
+            "trigrams": len(self._postings),
+            "refreshes": self.refreshes,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 3),
+        }
+
+    def relative(self, path: Path) -> str | None:
+        """绝对路径转为索引内的相对路径（posix），不在根目录下返回 None；根目录本身为空串。"""
+        try:
+            rel = path.relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+        return "" if rel == "." else rel
+
+    def _read_entry(self, path: Path, stat: os.stat_result) -> FileEntry:
+        if stat.st_size > self.max_file_bytes:
+            return FileEntry(stat.st_size, stat.st_mtime_ns, None)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return FileEntry(stat.st_size, stat.st_mtime_ns, None)
+        if b"\0" in data[:_BINARY_SNIFF_BYTES]:
+            return FileEntry(stat.st_size, stat.st_mtime_ns, None, binary=True)
+        return FileEntry(stat.st_size, stat.st_mtime_ns, _trigrams(data))
+
+    def _node(self, rel_dir: str, create: bool = False) -> _Dir | None:
+        node = self._tree
+        for part in rel_dir.split("/") if rel_dir else ():
+            child = node.dirs.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.dirs[part] = _Dir()
+            node = child
+        return node
+
+    def _unlink(self, rel: str) -> None:
+        """在锁内调用：从 trie 与倒排表中移除文件。"""
+        entry = self._entries.pop(rel, None)
+        if entry is None:
+            return
+        if entry.grams is not None:
+            for gram in entry.grams:
+                files = self._postings.get(gram)
+                if files is not None:
+                    files.discard(rel)
+                    if not files:
+                        del self._postings[gram]
+        rel_dir, _, name = rel.rpartition("/")
+        node = self._node(rel_dir)
+        if node is not None:
+            node.files.pop(name, None)
+
+    def _link(self, rel: str, entry: FileEntry) -> None:
+        """在锁内调用：写入（或替换）文件条目。"""
+        self._unlink(rel)
+        self._entries[rel] = entry
+        if entry.grams is not None:
+            postings = self._postings
+            for gram in entry.grams:
+                files = postings.get(gram)
+                if files is None:
+                    postings[gram] = {rel}
+                else:
+                    files.add(rel)
+        rel_dir, _, name = rel.rpartition("/")
+        self._node(rel_dir, create=True).files[name] = entry
+
+    def _put(self, rel: str, entry: FileEntry | None) -> None:
+        with self._lock:
+            if entry is None:
+                if rel not in self._entries:
+                    return
+                self._unlink(rel)
+            else:
+                self._link(rel, entry)
+            self._dirty[rel] = entry
+            self._saved = False
+
+    def update(self, path: Path) -> None:
+        """立即重建单个文件的条目（后端写入/编辑后调用）；文件已不存在时移除。"""
+        rel = self.relative(path)
+        if not rel or rel in self.ignore:
+            return
+        try:
+            stat = path.stat()
+        except OSError:
+            self._put(rel, None)
+            return
+        if os.path.isfile(path):
+            self._put(rel, self._read_entry(path, stat))
+
+    def _scan(self) -> Iterator[tuple[str, Path, os.stat_result]]:
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for item in entries:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        stack.append(Path(item.path))
+                    elif item.is_file():
+                        path = Path(item.path)
+                        rel = path.relative_to(self.root).as_posix()
+                        if rel not in self.ignore:
+                            yield rel, path, item.stat()
+                except OSError:
+                    continue
+
+    def refresh(self) -> tuple[dict[str, FileEntry], list[str]]:
+        """增量扫描根目录：mtime 与大小都未变的文件不重新读取。返回 (新增/变化的文件, 已删除的路径)。"""
+        started = time.perf_counter()
+        seen: set[str] = set()
+        for rel, path, stat in self._scan():
+            seen.add(rel)
+            entry = self._entries.get(rel)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                continue
+            self._put(rel, self._read_entry(path, stat))
+        for rel in [rel for rel in self._entries if rel not in seen]:
+            self._put(rel, None)
+        self.ready = True
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - started
+        return self.drain_changes()
+
+    def drain_changes(self) -> tuple[dict[str, FileEntry], list[str]]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        changed = {rel: entry for rel, entry in dirty.items() if entry is not None}
+        removed = [rel for rel, entry in dirty.items() if entry is None]
+        return changed, removed
+
+    def entries(self) -> dict[str, FileEntry]:
+        with self._lock:
+            return dict(self._entries)
+
+    def _iter_files(self, base: str) -> Iterator[tuple[str, FileEntry]]:
+        """在锁内调用：按路径顺序列出 base（目录或文件）下的文件，返回相对 base 的路径。"""
+        entry = self._entries.get(base)
+        if entry is not None:
+            yield base.rpartition("/")[2], entry
+            return
+        node = self._node(base)
+        if node is None:
+            return
+        stack: list[tuple[str, _Dir]] = [("", node)]
+        while stack:
+            prefix, node = stack.pop()
+            for name in sorted(node.files):
+                yield prefix + name, node.files[name]
+            for name in sorted(node.dirs, reverse=True):
+                stack.append((f"{prefix}{name}/", node.dirs[name]))
+
+    def _join(self, base: str, rel: str) -> str:
+        if base in self._entries:
+            return base
+        return f"{base}/{rel}" if base else rel
+
+    def glob(self, pattern: str, base: str = "") -> list[tuple[str, FileEntry]]:
+        """与 Path.rglob(pattern) 语义一致：pattern 匹配 base 下任意深度的路径结尾。"""
+        flags = wcglob.GLOBSTAR | wcglob.DOTGLOB
+        full = f"**/{pattern}"
+        with self._lock:
+            if base in self._entries:
+                return []
+            return sorted(
+                (self._join(base, rel), entry)
+                for rel, entry in self._iter_files(base)
+                if wcglob.globmatch(rel, full, flags=flags)
+            )
+
+    def candidates(self, pattern: str, base: str = "", include_glob: str | None = None) -> list[tuple[str, FileEntry]]:
+        """grep 需要打开的文件：内容包含正则全部必含三元组的文件，加上未建内容索引的文本文件。"""
+        grams: set[int] = set()
+        for literal in required_literals(pattern):
+            grams.update(int.from_bytes(literal[i : i + 3], "big") for i in range(len(literal) - 2))
+        with self._lock:
+            hits: set[str] | None = None
+            if grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                hits = set(postings[0]).intersection(*postings[1:])
+            result = []
+            for rel, entry in self._iter_files(base):
+                if entry.binary:
+                    continue
+                if include_glob and not wcglob.globmatch(rel.rpartition("/")[2], include_glob, flags=wcglob.BRACE):
+                    continue
+                path = self._join(base, rel)
+                if hits is None or entry.grams is None or path in hits:
+                    result.append((path, entry))
+            return result
+
+    def dump(self) -> None:
+        """持久化到 persist_path；没有变化时跳过。重启后 refresh 只需比对 mtime。"""
+        if self.persist_path is None or self._saved:
+            return
+        with self._lock:
+            entries = {
+                rel: (e.size, e.mtime_ns, e.grams.tobytes() if e.grams is not None else None, e.binary)
+                for rel, e in self._entries.items()
+            }
+            self._saved = True
+        payload = {"version": _VERSION, "root": str(self.root), "max_file_bytes": self.max_file_bytes, "entries": entries}
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.persist_path.with_name(f"{self.persist_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.persist_path)
+
+    def load(self) -> bool:
+        """从 persist_path 恢复；版本、根目录或大小上限不一致时忽略。载入的条目不记为变化。"""
+        if self.persist_path is None:
+            return False
+        try:
+            with open(self.persist_path, "rb") as f:
+                payload = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        if (
+            not isinstance(payload, dict)
+            or payload.get("version") != _VERSION
+            or payload.get("root") != str(self.root)
+            or payload.get("max_file_bytes") != self.max_file_bytes
+        ):
+            return False
+        with self._lock:
+            for rel, (size, mtime_ns, raw, binary) in payload["entries"].items():
+                grams = None
+                if raw is not None:
+                    grams = array("I")
+                    grams.frombytes(raw)
+                self._link(rel, FileEntry(size, mtime_ns, grams, binary))
+        return True
@@ -0,0 +1,237 @@
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable
+
+
+# 发起请求的调用被取消（而不是失败）时交给等待者的信号：重新抢占，由其中一个接手请求
+_RETRY = object()
+
+
+def search_cache_key(query: str, topic: str, max_results: int, include_raw_content: bool) -> tuple:
+    """规范化搜索参数：大小写与多余空白不同的查询视为同一个。"""
+    normalized = " ".join(query.split()).casefold()
+    return (normalized, topic, int(max_results), bool(include_raw_content))
+
+
+class TTLCache:
+    """带 TTL 的 LRU 缓存，并合并进行中的相同请求：并发的同 key 调用只触发一次上游请求。
+
+    失败不缓存，异常会传给所有等待者；发起请求的调用被取消时等待者不受影响，改由其中一个重新请求。
+    提供 persist_path 时以 JSON 落盘（异步调用在线程里写盘），重启后继续命中；
+    写盘做了去抖，persist_interval 秒内至多写一次，剩余的变更由 flush 在关闭时写入。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        persist_path: str | Path | None = None,
+        persist_interval: float = 30.0,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.persist_interval = persist_interval
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # 内存中条目的版本与已写盘的版本
+        self._version = 0
+        self._saved_version = 0
+        self._saved_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+    def _lookup(self, key: Hashable) -> tuple[bool, Any]:
+        """在锁内调用：命中则移到 LRU 尾部，过期则删除。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _claim(self, key: Hashable) -> tuple[bool, Any, Future, bool]:
+        """返回 (命中, 值, future, 是否由本调用负责请求上游)。"""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return True, value, None, False  # type: ignore[return-value]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, None, future, False
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return False, None, future, True
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._version += 1
+
+    def _persist(self) -> None:
+        """把最新快照写盘；排队中的多次写入只有第一次真正落盘，其余发现版本未变直接返回。"""
+        if self.persist_path is None:
+            return
+        # 快照与写盘在同一把锁内，避免旧快照覆盖新快照
+        with self._save_lock:
+            with self._lock:
+                if self._saved_version == self._version:
+                    return
+                version = self._version
+                snapshot = list(self._entries.items())
+            self._save(snapshot)
+            self._saved_version = version
+            self._saved_at = time.monotonic()
+
+    def _persist_due(self) -> bool:
+        """有未写盘的变更，且距上次写盘已超过 persist_interval。"""
+        return (
+            self.persist_path is not None
+            and self._saved_version != self._version
+            and time.monotonic() - self._saved_at >= self.persist_interval
+        )
+
+    def flush(self) -> None:
+        """立即写入未保存的变更，服务关闭时调用。"""
+        self._persist()
+
+    def _settle(self, key: Hashable, future: Future, value: Any = None, error: BaseException | None = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """同步读取；未命中时调用 fetch，同 key 的并发调用等待同一个结果。"""
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if not owner:
+                value = future.result()
+                if value is _RETRY:
+                    continue
+                return value
+            try:
+                value = fetch()
+            except Exception as exc:
+                self._settle(key, future, error=exc)
+                raise
+            except BaseException:
+                self._settle(key, future, _RETRY)
+                raise
+            self._store(key, value)
+            self._settle(key, future, value)
+            if self._persist_due():
+                self._persist()
+            return value
+
+    async def aget_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """异步版本，与同步调用共享缓存和进行中的请求。
+
+        等待者被取消只影响自己（shield 防止取消传到共享的 future）；发起请求的调用被取消时，
+        等待者收到重试信号，由第一个重新抢占的接手请求。
+        """
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if not owner:
+                value = await asyncio.shield(asyncio.wrap_future(future))
+                if value is _RETRY:
+                    continue
+                return value
+            try:
+                value = await fetch()
+            except Exception as exc:
+                self._settle(key, future, error=exc)
+                raise
+            except BaseException:
+                # CancelledError 属于本次调用，不能传给其他运行
+                self._settle(key, future, _RETRY)
+                raise
+            self._store(key, value)
+            self._settle(key, future, value)
+            if self._persist_due():
+                # 写盘放到线程里，不阻塞事件循环；等待者在此之前已拿到结果
+                await asyncio.to_thread(self._persist)
+            return value
+
+    def _load(self) -> None:
+        if self.persist_path is None or not self.persist_path.exists():
+            return
+        try:
+            rows = json.loads(self.persist_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(rows, list):
+            return
+        now = time.time()
+        for row in rows:
+            # 跳过格式不对的行，不因一行损坏丢掉整个文件
+            try:
+                key, expires_at, value = row
+                if float(expires_at) > now:
+                    self._entries[tuple(key)] = (float(expires_at), value)
+            except (TypeError, ValueError):
+                continue
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self, snapshot: list) -> None:
+        """整体写临时文件后原子替换；写失败只影响持久化，不影响缓存本身。"""
+        rows = [[list(key), expires_at, value] for key, (expires_at, value) in snapshot]
+        tmp_path = None
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.persist_path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.persist_path)
+            tmp_path = None
+        except OSError:
+            return
+        finally:
+            # 写入或替换失败时删除临时文件
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_path)
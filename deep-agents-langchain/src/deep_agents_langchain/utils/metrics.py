@@ -0,0 +1,153 @@
+import asyncio
+import bisect
+import threading
+import time
+from typing import Iterable
+
+# 标签组合超过上限后统一归入该值，防止模型名、工具名等把时间序列数撑爆
+OVERFLOW_LABEL = "other"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), max_label_sets: int = 50):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_label_sets = max_label_sets
+        self._values: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and self.type_name != "histogram":
+            # 无标签的计数器/仪表从 0 开始输出
+            self._values[()] = 0.0
+
+    def _key(self, labels: tuple[str, ...]) -> tuple[str, ...]:
+        """在锁内调用：新的标签组合超过上限时归入 other。"""
+        if labels in self._values or len(self._values) < self.max_label_sets:
+            return labels
+        return (OVERFLOW_LABEL,) * len(self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """固定分桶直方图；observe 只做一次二分与计数，桶在输出时才累加。"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数..., +Inf 桶计数, 总和]
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = self._header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, None), state[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound is None else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+RUN_DURATION = Histogram("deep_agents_run_duration_seconds", "Run wall time from request to end event.", ["status"])
+RUNS_ACTIVE = Gauge("deep_agents_runs_active", "Runs currently executing.")
+RUNS_QUEUED = Gauge("deep_agents_runs_queued", "Runs waiting for their thread or a global slot.")
+RUN_QUEUE_WAIT = Histogram("deep_agents_run_queue_wait_seconds", "Time a run waited in the scheduler queue.")
+RUNS_REJECTED = Counter("deep_agents_runs_rejected_total", "Runs rejected at admission.", ["reason"], max_label_sets=5)
+MODEL_LATENCY = Histogram("deep_agents_model_call_duration_seconds", "Model call latency.", ["model"], max_label_sets=20)
+TOOL_LATENCY = Histogram("deep_agents_tool_call_duration_seconds", "Tool call wall time.", ["tool"], max_label_sets=50)
+DB_QUERY = Histogram("deep_agents_db_query_duration_seconds", "Database statement time.", ["op"], buckets=DB_BUCKETS)
+DB_COMMIT = Histogram("deep_agents_db_commit_duration_seconds", "Session commit time (flush + commit).", buckets=DB_BUCKETS)
+SSE_ACTIVE = Gauge("deep_agents_sse_streams_active", "Open SSE streams.")
+SSE_EVENTS = Counter("deep_agents_sse_events_total", "SSE events sent.", ["event"], max_label_sets=20)
+SSE_BYTES = Counter("deep_agents_sse_bytes_sent_total", "SSE bytes sent.")
+LOOP_LAG = Histogram("deep_agents_event_loop_lag_seconds", "Event loop scheduling delay.", buckets=LAG_BUCKETS)
+
+REGISTRY: list[_Metric] = [
+    RUN_DURATION,
+    RUNS_ACTIVE,
+    RUNS_QUEUED,
+    RUN_QUEUE_WAIT,
+    RUNS_REJECTED,
+    MODEL_LATENCY,
+    TOOL_LATENCY,
+    DB_QUERY,
+    DB_COMMIT,
+    SSE_ACTIVE,
+    SSE_EVENTS,
+    SSE_BYTES,
+    LOOP_LAG,
+]
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式（0.0.4）。"""
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """定时睡眠并记录实际唤醒比预期晚了多久；阻塞事件循环的同步调用会直接体现在这里。"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(time.perf_counter() - started - interval, 0.0))
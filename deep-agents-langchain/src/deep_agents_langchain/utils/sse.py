@@ -1,15 +1,26 @@
 from typing import AsyncIterator
 
+from deep_agents_langchain.utils.metrics import SSE_ACTIVE, SSE_BYTES, SSE_EVENTS
 
-def format_sse(event: str, data: str) -> str:
-    """构造 SSE 字符串，保持最小化依赖。"""
-    return f"event: {event}\ndata: {data}\n\n"
+
+def format_sse(event: str, data: str, event_id: int | str | None = None) -> str:
+    """构造 SSE 字符串，保持最小化依赖；带 id 时浏览器重连会在 Last-Event-ID 里带回。"""
+    if event_id is None:
+        return f"event: {event}\ndata: {data}\n\n"
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
 
 
 async def sse_stream(generator: AsyncIterator[dict]) -> AsyncIterator[bytes]:
-    """将事件 dict 序列化为 SSE 字节流。"""
+    """将事件 dict 序列化为 SSE 字节流，并统计打开的流、事件数与发送字节数。"""
     import json
 
-    async for item in generator:
-        yield format_sse(item["event"], json.dumps(item["data"], ensure_ascii=False)).encode("utf-8")
+    SSE_ACTIVE.inc()
+    try:
+        async for item in generator:
+            chunk = format_sse(item["event"], json.dumps(item["data"], ensure_ascii=False), item.get("id")).encode("utf-8")
+            SSE_EVENTS.inc(item["event"])
+            SSE_BYTES.inc(amount=len(chunk))
+            yield chunk
+    finally:
+        SSE_ACTIVE.dec()
 
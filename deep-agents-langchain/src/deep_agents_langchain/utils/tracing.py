@@ -0,0 +1,166 @@
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, NamedTuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 当前运行的追踪；图内的节点任务与工具线程都会复制上下文，中间件据此找到所属运行
+current_trace: ContextVar["RunTrace | None"] = ContextVar("current_trace", default=None)
+# 正在执行的模型调用；TracingMiddleware 在调用期间设置，并发的模型调用各自处在自己的上下文里
+current_model_call: ContextVar["ModelCall | None"] = ContextVar("current_model_call", default=None)
+
+
+class Span(NamedTuple):
+    kind: str  # queue / model / tool
+    name: str
+    start_ns: int  # 相对运行开始
+    duration_ns: int
+    attrs: dict[str, Any] | None
+
+
+def _ms(ns: int | None) -> float | None:
+    return None if ns is None else round(ns / 1e6, 3)
+
+
+class ModelCall:
+    """一次模型调用的开始时间与首个流式分片到达时间。"""
+
+    __slots__ = ("start_ns", "first_token_ns")
+
+    def __init__(self) -> None:
+        self.start_ns = time.perf_counter_ns()
+        self.first_token_ns: int | None = None
+
+
+class FirstTokenCallback(BaseCallbackHandler):
+    """按 LangChain run_id 记录每次模型调用的首 token 时间。
+
+    模型开始时把 run_id 关联到当前上下文里的 ModelCall，之后的 token 回调只按 run_id 查找，
+    并行的模型调用（如多个子 agent）互不干扰。
+    """
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self._calls: dict[UUID, ModelCall] = {}
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any) -> None:
+        call = current_model_call.get()
+        if call is not None:
+            self._calls[run_id] = call
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        call = self._calls.get(run_id)
+        if call is not None and call.first_token_ns is None:
+            call.first_token_ns = time.perf_counter_ns()
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._calls.pop(run_id, None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._calls.pop(run_id, None)
+
+
+class RunTrace:
+    """单次运行的耗时追踪：排队等待、每次模型调用（含首 token 延迟）与每次工具调用。
+
+    记录只做 perf_counter_ns 与列表追加，单个 span 开销在微秒级，可常开。
+    """
+
+    def __init__(self, trace_id: str | None = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started_ns = time.perf_counter_ns()
+        self.agent_started_ns: int | None = None
+        self.first_token_ns: int | None = None
+        self.spans: list[Span] = []
+        self.tool_durations: dict[str, float] = {}
+        # 运行的 config callbacks：测量每次模型调用的首 token 延迟
+        self.callback = FirstTokenCallback()
+
+    def _add(self, kind: str, name: str, start_ns: int, end_ns: int, attrs: dict[str, Any] | None) -> None:
+        self.spans.append(Span(kind, name, start_ns - self.started_ns, end_ns - start_ns, attrs))
+
+    def agent_started(self) -> None:
+        """agent 开始执行；此前的时间（建图、读历史、落库）记为排队等待。"""
+        now = time.perf_counter_ns()
+        self.agent_started_ns = now
+        self._add("queue", "queue_wait", self.started_ns, now, None)
+
+    def first_token(self) -> None:
+        """整个运行推给客户端的首个 token。"""
+        if self.first_token_ns is None:
+            self.first_token_ns = time.perf_counter_ns()
+
+    def begin_model(self) -> ModelCall:
+        return ModelCall()
+
+    def end_model(self, call: ModelCall, name: str, attrs: dict[str, Any]) -> None:
+        if call.first_token_ns is not None:
+            attrs["ttft_ms"] = _ms(call.first_token_ns - call.start_ns)
+        self._add("model", name, call.start_ns, time.perf_counter_ns(), attrs)
+
+    def end_tool(self, start_ns: int, name: str, tool_call_id: str | None, status: str) -> None:
+        end = time.perf_counter_ns()
+        if tool_call_id:
+            self.tool_durations[tool_call_id] = _ms(end - start_ns)
+        self._add("tool", name, start_ns, end, {"tool_call_id": tool_call_id, "status": status})
+
+    def rows(self) -> list[dict[str, Any]]:
+        """span 落库行：时间统一为毫秒。"""
+        return [
+            {
+                "trace_id": self.trace_id,
+                "kind": span.kind,
+                "name": span.name,
+                "start_ms": _ms(span.start_ns),
+                "duration_ms": _ms(span.duration_ns),
+                "attributes": span.attrs,
+            }
+            for span in self.spans
+        ]
+
+    def summary(self, run_id: str, usage: dict | None = None) -> dict[str, Any]:
+        """metrics 事件内容：总耗时、排队、首 token、模型/工具耗时汇总与按顺序的步骤明细。"""
+        now = time.perf_counter_ns()
+        models = [span for span in self.spans if span.kind == "model"]
+        tools = [span for span in self.spans if span.kind == "tool"]
+        ttft = None
+        if self.first_token_ns is not None and self.agent_started_ns is not None:
+            ttft = self.first_token_ns - self.agent_started_ns
+        queue = (self.agent_started_ns or now) - self.started_ns
+        return {
+            "run_id": run_id,
+            "trace_id": self.trace_id,
+            "total_ms": _ms(now - self.started_ns),
+            "queue_ms": _ms(queue),
+            "ttft_ms": _ms(ttft),
+            "model_calls": len(models),
+            "model_ms": _ms(sum(span.duration_ns for span in models)),
+            "tool_calls": len(tools),
+            "tool_ms": _ms(sum(span.duration_ns for span in tools)),
+            "usage": usage,
+            "steps": [
+                {"kind": span.kind, "name": span.name, "start_ms": _ms(span.start_ns), "duration_ms": _ms(span.duration_ns), **(span.attrs or {})}
+                for span in sorted(self.spans, key=lambda span: span.start_ns)
+                if span.kind != "queue"
+            ],
+        }
+
+
+def install_trace_log_records() -> None:
+    """给所有日志记录加上 trace_id 字段（不在运行中为 "-"），格式串里可直接使用 %(trace_id)s。"""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "_with_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        trace = current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        return record
+
+    record_factory._with_trace_id = True  # type: ignore[attr-defined]
+    logging.setLogRecordFactory(record_factory)
@@ -0,0 +1,27 @@
+"""Pytest 配置与公共 fixture。"""
+
+import os
+import sys
+
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from deep_agents_langchain.storage.models import Base  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def sessionmaker(tmp_path):
+    """每个测试一个独立的 SQLite 库。"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session(sessionmaker):
+    async with sessionmaker() as session:
+        yield session
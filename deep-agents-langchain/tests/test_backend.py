@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("deepagents")
+
+from deep_agents_langchain.agent.backend import IndexedFilesystemBackend
+from deep_agents_langchain.service.workspace import _file_rows
+from deep_agents_langchain.storage.line_index import LineIndexStore
+from deep_agents_langchain.storage.workspace_index import FileEntry, WorkspaceIndex
+
+
+@pytest.fixture
+def backend(tmp_path):
+    root = tmp_path / "ws"
+    (root / "src").mkdir(parents=True)
+    (root / "src" / "a.py").write_text("import os\nvalue = compute()\n")
+    (root / "src" / "b.py").write_text("abc = 1\n")
+    index = WorkspaceIndex(str(root))
+    index.refresh()
+    return IndexedFilesystemBackend(
+        str(root), LineIndexStore(str(tmp_path / "idx")), workspace_index=index, virtual_mode=True
+    )
+
+
+def test_grep_opens_only_index_candidates(backend, monkeypatch):
+    candidates = backend.workspace_index.candidates
+    seen = []
+
+    def tracking(*args):
+        result = candidates(*args)
+        seen.extend(rel for rel, _ in result)
+        return result
+
+    monkeypatch.setattr(backend.workspace_index, "candidates", tracking)
+    matches = backend.grep_raw(r"compute\(")
+    assert [(m["path"], m["line"]) for m in matches] == [("/src/a.py", 2)]
+    assert seen == ["src/a.py"]
+
+
+def test_grep_without_literals_falls_back_to_parent(backend, monkeypatch):
+    def fail(*args):
+        raise AssertionError("index should not be used without required literals")
+
+    monkeypatch.setattr(backend.workspace_index, "candidates", fail)
+    matches = backend.grep_raw("a.c")
+    assert [(m["path"], m["line"]) for m in matches] == [("/src/b.py", 1)]
+
+
+def test_file_rows_store_naive_utc():
+    mtime_ns = 1_700_000_000_250_000_000
+    row = _file_rows({"src/a.py": FileEntry(10, mtime_ns, None)})[0]
+    assert row["path"] == "/src/a.py"
+    assert row["modified_at"] == datetime(2023, 11, 14, 22, 13, 20, 250000)
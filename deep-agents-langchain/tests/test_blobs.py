@@ -0,0 +1,62 @@
+import pytest
+from langchain_core.messages import AIMessage
+from sqlalchemy import select
+
+from deep_agents_langchain.service.runs import run_and_stream
+from deep_agents_langchain.storage.blobs import BLOB_REF_KEY, BlobStore
+from deep_agents_langchain.storage.models import Run
+from deep_agents_langchain.storage.repositories import create_thread
+from deep_agents_langchain.storage.run_output import compact_run_output, empty_usage
+
+
+def test_small_values_stay_inline(tmp_path):
+    store = BlobStore(tmp_path)
+    value = {"todos": ["a"]}
+    assert store.offload(value, inline_bytes=1024) is value
+    assert not any(tmp_path.iterdir())
+
+
+def test_large_values_are_content_addressed(tmp_path):
+    store = BlobStore(tmp_path)
+    value = {"todos": ["x" * 100], "step": 1}
+    ref = store.offload(value, inline_bytes=16)
+    assert set(ref) == {BLOB_REF_KEY, "size"}
+    assert store.get_json(ref[BLOB_REF_KEY]) == value
+    # 相同内容（键顺序不同）只保存一份
+    assert store.offload({"step": 1, "todos": ["x" * 100]}, inline_bytes=16) == ref
+    assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+
+
+def test_compact_output_offloads_state_delta(tmp_path):
+    store = BlobStore(tmp_path)
+    output = compact_run_output(
+        message_id="m1",
+        usage=empty_usage(),
+        tool_call_ids=[],
+        state_delta={"files": {"/a.txt": "y" * 200}},
+        blob_store=store,
+        inline_bytes=64,
+    )
+    assert output["final_message_id"] == "m1"
+    assert store.get_json(output["state_delta"][BLOB_REF_KEY]) == {"files": {"/a.txt": "y" * 200}}
+
+
+class StateAgent:
+    """最终回答同时带一个较大的状态增量。"""
+
+    async def astream(self, agent_input, config, stream_mode):
+        yield "updates", {"model": {"messages": [AIMessage(content="done", id="ai-1")], "todos": ["t" * 500]}}
+
+
+@pytest.mark.asyncio
+async def test_run_output_references_blob(tmp_path, sessionmaker, session):
+    store = BlobStore(tmp_path / "blobs")
+    thread = await create_thread(session)
+    payload = {"messages": [{"role": "user", "content": "hi"}]}
+    events = [item async for item in run_and_stream(StateAgent(), session, thread.id, payload, blob_store=store, inline_bytes=128)]
+    assert events[-1]["data"]["status"] == "completed"
+    async with sessionmaker() as check:
+        run = (await check.execute(select(Run))).scalars().one()
+    ref = run.output["state_delta"]
+    assert ref["size"] > 128
+    assert store.get_json(ref[BLOB_REF_KEY]) == {"todos": ["t" * 500]}
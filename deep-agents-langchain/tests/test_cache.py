@@ -0,0 +1,45 @@
+import json
+import os
+import time
+
+from deep_agents_langchain.utils.cache import TTLCache
+
+
+def test_persist_is_debounced_until_flush(tmp_path, monkeypatch):
+    path = tmp_path / "cache.json"
+    cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path, persist_interval=60)
+    writes = []
+    save = cache._save
+
+    def counting_save(snapshot):
+        writes.append(len(snapshot))
+        save(snapshot)
+
+    monkeypatch.setattr(cache, "_save", counting_save)
+    for key in ("a", "b", "c"):
+        cache.get_or_fetch(key, lambda: 1)
+    # 第一次写入立即落盘，间隔内的后续写入留到 flush
+    assert writes == [1]
+    cache.flush()
+    assert writes == [1, 3]
+    assert len(TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)) == 3
+
+
+def test_load_skips_malformed_rows(tmp_path):
+    path = tmp_path / "cache.json"
+    expires_at = time.time() + 60
+    path.write_text(json.dumps([[["ok"], expires_at, 1], ["short"], [5, expires_at, 2], [["bad"], "soon", 3]]))
+    cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=path)
+    assert len(cache) == 1
+    assert cache.get_or_fetch(("ok",), lambda: None) == 1
+
+
+def test_failed_replace_removes_temp_file(tmp_path, monkeypatch):
+    cache = TTLCache(ttl_seconds=60, max_entries=10, persist_path=tmp_path / "cache.json")
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail_replace)
+    assert cache.get_or_fetch("k", lambda: 1) == 1
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,46 @@
+import aiosqlite
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite")
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from deep_agents_langchain.storage.checkpoints import CheckpointStore
+
+
+async def _put(saver: AsyncSqliteSaver, thread_id: str, ns: str, count: int) -> list[str]:
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns}}
+    ids = []
+    for _ in range(count):
+        checkpoint = empty_checkpoint()
+        config = await saver.aput(config, checkpoint, {}, {})
+        await saver.aput_writes(config, [("messages", "x")], task_id="t")
+        ids.append(checkpoint["id"])
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_sqlite_prune_keeps_latest_per_namespace(tmp_path):
+    conn = await aiosqlite.connect(str(tmp_path / "checkpoints.db"))
+    saver = AsyncSqliteSaver(conn)
+    await saver.setup()
+    store = CheckpointStore(saver, "sqlite", conn, retention=2)
+    try:
+        root = await _put(saver, "t1", "", 4)
+        sub = await _put(saver, "t1", "tools:abc", 3)
+        other = await _put(saver, "t2", "", 3)
+
+        await store.prune("t1")
+
+        async with conn.execute("SELECT thread_id, checkpoint_ns, checkpoint_id FROM checkpoints") as cursor:
+            kept = set(await cursor.fetchall())
+        assert kept == {
+            *(("t1", "", cid) for cid in root[-2:]),
+            *(("t1", "tools:abc", cid) for cid in sub[-2:]),
+            *(("t2", "", cid) for cid in other),
+        }
+        async with conn.execute("SELECT DISTINCT thread_id, checkpoint_ns, checkpoint_id FROM writes") as cursor:
+            assert set(await cursor.fetchall()) == kept
+    finally:
+        await store.aclose()
@@ -0,0 +1,131 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import inspect, text
+
+from deep_agents_langchain.storage.db import build_engine, init_db, resolve_database_url, sqlite_pragmas
+
+
+def _settings(**overrides) -> SimpleNamespace:
+    """db 模块只读取这些配置项，用 SimpleNamespace 代替完整的 Settings。"""
+    values = {
+        "database_url": None,
+        "sqlite_path": "./state.db",
+        "sqlite_journal_mode": "WAL",
+        "sqlite_synchronous": "NORMAL",
+        "sqlite_busy_timeout_ms": 5000,
+        "sqlite_cache_size_kb": 20000,
+        "sqlite_mmap_size": 268435456,
+        "db_pool_size": 2,
+        "db_max_overflow": 0,
+        "db_pool_timeout": 5,
+        "db_pool_recycle": 1800,
+    }
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def test_sqlite_pragmas_follow_settings():
+    pragmas = sqlite_pragmas(_settings(sqlite_synchronous="FULL", sqlite_cache_size_kb=1024))
+    assert "PRAGMA synchronous=FULL" in pragmas
+    # 负数表示以 KiB 为单位
+    assert "PRAGMA cache_size=-1024" in pragmas
+    assert "PRAGMA temp_store=MEMORY" in pragmas
+
+
+@pytest.mark.asyncio
+async def test_every_pooled_connection_is_tuned(tmp_path):
+    engine = build_engine(_settings(sqlite_path=str(tmp_path / "data" / "state.db")))
+    try:
+        # 同时持有两个连接，确认池里的每个连接都执行了 PRAGMA
+        async with engine.connect() as first, engine.connect() as second:
+            for conn in (first, second):
+                assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+                assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1
+                assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+                assert (await conn.execute(text("PRAGMA temp_store"))).scalar() == 2
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_init_db_creates_secondary_indexes(tmp_path):
+    engine = build_engine(_settings(sqlite_path=str(tmp_path / "state.db")))
+    try:
+        await init_db(engine)
+        async with engine.connect() as conn:
+            indexes = await conn.run_sync(
+                lambda sync_conn: {
+                    table: {ix["name"]: ix["column_names"] for ix in inspect(sync_conn).get_indexes(table)}
+                    for table in ("messages", "runs")
+                }
+            )
+    finally:
+        await engine.dispose()
+    assert indexes["messages"]["ix_messages_thread_order_id"] == ["thread_id", "order_num", "id"]
+    assert indexes["runs"]["ix_runs_thread_started"] == ["thread_id", "started_at", "id"]
+
+
+@pytest.mark.asyncio
+async def test_init_db_upgrades_existing_indexes(tmp_path):
+    engine = build_engine(_settings(sqlite_path=str(tmp_path / "state.db")))
+    legacy = [
+        # 早期的窄索引，已被新的复合索引覆盖
+        "CREATE INDEX ix_messages_thread_order ON messages (thread_id, order_num)",
+        "CREATE INDEX ix_runs_thread_id ON runs (thread_id)",
+        # 同名但列不同的声明索引
+        "CREATE INDEX ix_tool_calls_run_id ON tool_calls (status)",
+        # 不是任何声明索引前缀的索引保持不动
+        "CREATE INDEX ix_messages_role ON messages (role)",
+    ]
+    try:
+        await init_db(engine)
+        async with engine.begin() as conn:
+            for name in ("ix_messages_thread_order_id", "ix_runs_thread_started", "ix_tool_calls_run_id"):
+                await conn.execute(text(f"DROP INDEX {name}"))
+            for statement in legacy:
+                await conn.execute(text(statement))
+        await init_db(engine)
+        async with engine.connect() as conn:
+            indexes = await conn.run_sync(
+                lambda sync_conn: {
+                    ix["name"]: ix["column_names"]
+                    for table in ("messages", "runs", "tool_calls")
+                    for ix in inspect(sync_conn).get_indexes(table)
+                }
+            )
+    finally:
+        await engine.dispose()
+    assert indexes == {
+        "ix_messages_thread_order_id": ["thread_id", "order_num", "id"],
+        "ix_messages_role": ["role"],
+        "ix_runs_thread_started": ["thread_id", "started_at", "id"],
+        "ix_tool_calls_run_id": ["run_id"],
+    }
+
+
+@pytest.mark.parametrize(
+    ("database_url", "expected"),
+    [
+        ("postgres://u:p@db:5432/app", "postgresql+asyncpg://u:p@db:5432/app"),
+        ("postgresql://u:p@db/app", "postgresql+asyncpg://u:p@db/app"),
+        # 已指定驱动的 URL 原样使用
+        ("postgresql+asyncpg://u:p@db/app", "postgresql+asyncpg://u:p@db/app"),
+        ("sqlite+aiosqlite:///custom.db", "sqlite+aiosqlite:///custom.db"),
+    ],
+)
+def test_database_url_takes_precedence(database_url, expected):
+    assert resolve_database_url(_settings(database_url=database_url)) == expected
+
+
+def test_sqlite_path_is_the_fallback(tmp_path):
+    path = tmp_path / "nested" / "state.db"
+    assert resolve_database_url(_settings(sqlite_path=str(path))) == f"sqlite+aiosqlite:///{path}"
+    assert path.parent.is_dir()
+
+
+def test_postgres_engine_uses_pool_settings():
+    pytest.importorskip("asyncpg")
+    engine = build_engine(_settings(database_url="postgres://u:p@db/app", db_pool_size=7, db_max_overflow=3))
+    assert engine.dialect.driver == "asyncpg"
+    assert (engine.pool.size(), engine.pool._max_overflow) == (7, 3)
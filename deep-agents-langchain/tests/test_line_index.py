@@ -0,0 +1,97 @@
+import mmap
+import os
+
+import pytest
+
+pytest.importorskip("deepagents")
+
+from deep_agents_langchain.agent.backend import IndexedFilesystemBackend
+from deep_agents_langchain.storage.line_index import LineIndex, LineIndexStore
+
+
+def _backends(tmp_path):
+    root = tmp_path / "ws"
+    root.mkdir()
+    store = LineIndexStore(str(tmp_path / "idx"), step=16)
+    indexed = IndexedFilesystemBackend(str(root), store, min_indexed_bytes=0, virtual_mode=True)
+    plain = IndexedFilesystemBackend(str(root), store, min_indexed_bytes=1 << 30, virtual_mode=True)
+    return root, indexed, plain
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "first\r\nsecond\r\nthird\r\n",
+        "mixed\nline\r\nold mac\rtail without newline",
+        "form\ffeed\vtab\x1cfs ls ps\x85nel sep\n\n\nblank lines",
+        "x" * 40 + "\r\n" + "y" * 40 + "\r" + "z" * 40,
+        "“中文”段落\u2029" * 10 + "\r\n",
+    ],
+)
+def test_indexed_read_matches_splitlines(tmp_path, content):
+    root, indexed, plain = _backends(tmp_path)
+    (root / "f.txt").write_bytes(content.encode("utf-8"))
+    total = len(content.splitlines())
+    for offset in range(total + 1):
+        for limit in (1, 2, total + 1):
+            assert indexed.read("/f.txt", offset, limit) == plain.read("/f.txt", offset, limit)
+
+
+def _get(store: LineIndexStore, path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            return store.get(path, mm, os.fstat(fd))
+    finally:
+        os.close(fd)
+
+
+def test_store_reuses_memory_and_disk_indexes(tmp_path, monkeypatch):
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"line {i}\n" for i in range(1000)))
+    store = LineIndexStore(str(tmp_path / "idx"), step=256)
+    builds = []
+    build = LineIndex.build
+
+    def counting_build(cls, *args):
+        builds.append(args)
+        return build(*args)
+
+    monkeypatch.setattr(LineIndex, "build", classmethod(counting_build))
+
+    index = _get(store, path)
+    assert index.total_lines == 1000
+    assert _get(store, path) is index
+    # 新的 store（如重启后）从磁盘载入，不重新扫描
+    reloaded = _get(LineIndexStore(str(tmp_path / "idx"), step=256), path)
+    assert (reloaded.total_lines, list(reloaded.offsets)) == (1000, list(index.offsets))
+    assert len(builds) == 1
+
+    # 源文件变化后重建
+    with path.open("a") as f:
+        f.write("tail")
+    assert _get(store, path).total_lines == 1001
+    assert len(builds) == 2
+
+
+def test_store_lru_is_bounded(tmp_path):
+    store = LineIndexStore(str(tmp_path / "idx"), max_cached=2)
+    for i in range(3):
+        path = tmp_path / f"{i}.log"
+        path.write_text("a\nb\n")
+        _get(store, path)
+    assert list(store._cache) == [str(tmp_path / "1.log"), str(tmp_path / "2.log")]
+
+
+def test_read_lines_from_sparse_samples(tmp_path):
+    path = tmp_path / "big.log"
+    lines = [f"{i:05d}" + "x" * (i % 37) for i in range(5000)]
+    path.write_text("\n".join(lines))
+    store = LineIndexStore(str(tmp_path / "idx"), step=512)
+    index = _get(store, path)
+    assert len(index.offsets) > 1
+    fd = os.open(path, os.O_RDONLY)
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+        for offset in (0, 1, 777, 4998, 4999):
+            assert index.read_lines(mm, offset, 3) == lines[offset : offset + 3]
+    os.close(fd)
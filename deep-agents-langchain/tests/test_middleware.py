@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("deepagents")
+
+from langchain_core.tools import tool
+
+from deep_agents_langchain.agent.middleware import ToolConcurrencyMiddleware
+
+release = threading.Event()
+
+
+@tool
+def block(seconds: float) -> str:
+    """阻塞工作线程直到 release。"""
+    release.wait(seconds)
+    return "late"
+
+
+@tool
+async def hang(seconds: float) -> str:
+    """异步等待。"""
+    await asyncio.sleep(seconds)
+    return "late"
+
+
+async def _call(middleware, target, call_id: str):
+    request = SimpleNamespace(tool_call={"name": target.name, "id": call_id}, tool=target)
+
+    async def handler(req):
+        return await req.tool.ainvoke({"seconds": 5})
+
+    return await middleware.awrap_tool_call(request, handler)
+
+
+async def _value(middleware, name: str) -> int:
+    await asyncio.sleep(0.01)
+    return middleware._async_limits(name)[0]._value
+
+
+@pytest.mark.asyncio
+async def test_slot_wait_counts_against_timeout():
+    middleware = ToolConcurrencyMiddleware(max_concurrency=1, default_timeout=0.1)
+    try:
+        first = asyncio.create_task(_call(middleware, hang, "a"))
+        await asyncio.sleep(0)
+        # 名额被占满时等待名额也计入超时
+        assert (await _call(middleware, hang, "b")).status == "error"
+        # 超时的异步工具被取消，收尾后归还名额
+        assert (await first).status == "error"
+        assert await _value(middleware, "hang") == 1
+    finally:
+        middleware.close()
+
+
+@pytest.mark.asyncio
+async def test_timed_out_thread_tool_keeps_its_slot():
+    middleware = ToolConcurrencyMiddleware(max_concurrency=1, default_timeout=0.1)
+    release.clear()
+    try:
+        assert (await _call(middleware, block, "a")).status == "error"
+        # 线程仍在执行，名额不归还
+        assert await _value(middleware, "block") == 0
+        release.set()
+        for _ in range(100):
+            if await _value(middleware, "block") == 1:
+                break
+        assert await _value(middleware, "block") == 1
+    finally:
+        release.set()
+        middleware.close()
@@ -0,0 +1,50 @@
+import json
+
+from sqlalchemy import create_engine, event, insert, select
+
+from deep_agents_langchain.storage.blobs import BlobStore
+from deep_agents_langchain.storage.migrations import compact_run_outputs
+from deep_agents_langchain.storage.models import Base, Run, Thread
+from deep_agents_langchain.storage.run_output import RUN_OUTPUT_VERSION
+
+
+def test_compact_run_outputs_selects_only_legacy_rows(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    Base.metadata.create_all(engine)
+    compact = {"v": RUN_OUTPUT_VERSION, "final_message_id": "m", "usage": {}, "tool_call_ids": [], "state_delta": {}}
+    legacy = {"messages": [{"id": "m1", "content": "hi", "tool_calls": [{"id": "c1"}]}], "todos": ["a"]}
+    with engine.begin() as conn:
+        conn.execute(insert(Thread).values(id="t"))
+        conn.execute(
+            insert(Run),
+            [
+                {"id": "r1", "thread_id": "t", "output": compact},
+                {"id": "r2", "thread_id": "t", "output": legacy},
+                {"id": "r3", "thread_id": "t", "output": None},
+                {"id": "r4", "thread_id": "t", "output": {"message_id": "m2", "content": "x"}},
+            ],
+        )
+
+    fetched: list[str] = []
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_select(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            fetched.append(statement)
+
+    blob_store = BlobStore(tmp_path / "blobs")
+    with engine.begin() as conn:
+        assert compact_run_outputs(conn, blob_store, inline_bytes=4096, batch_size=1) == 2
+    event.remove(engine, "after_cursor_execute", record_select)
+    with engine.begin() as conn:
+        outputs = dict(conn.execute(select(Run.id, Run.output)).all())
+        assert outputs["r1"] == compact
+        assert outputs["r2"]["v"] == RUN_OUTPUT_VERSION
+        assert outputs["r2"]["tool_call_ids"] == ["c1"]
+        assert json.loads(blob_store.get(outputs["r2"]["legacy_blob"])) == legacy
+        assert outputs["r4"]["final_message_id"] == "m2"
+        # 再次执行时已经没有需要迁移的行
+        assert compact_run_outputs(conn, blob_store, inline_bytes=4096) == 0
+    # 一行一批：r2、r3（存成 JSON null，选出后跳过）、r4 各一次，加上最后一次空查询；r1 不会被读出
+    assert len(fetched) == 4
+    assert "json_extract" in fetched[0].lower()
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+
+from deep_agents_langchain.storage.models import Message, Thread
+from deep_agents_langchain.storage.pagination import InvalidCursorError, InvalidFieldsError
+from deep_agents_langchain.storage.repositories import (
+    create_run,
+    create_thread,
+    list_messages_page,
+    list_runs_page,
+    list_threads_page,
+)
+
+
+async def _all_pages(fetch, limit: int) -> list[list[dict]]:
+    pages, cursor = [], None
+    while True:
+        items, cursor = await fetch(limit, cursor)
+        pages.append(items)
+        if cursor is None:
+            return pages
+
+
+@pytest_asyncio.fixture
+async def thread_with_messages(session):
+    thread = await create_thread(session)
+    now = datetime.utcnow()
+    # order_num 相同的消息按 id 排序，分页边界落在同一 order_num 内也不会重复或遗漏
+    session.add_all(
+        Message(id=f"m{i}", thread_id=thread.id, role="user", content=str(i), order_num=i // 2, created_at=now)
+        for i in range(7)
+    )
+    await session.commit()
+    return thread
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("descending", [False, True])
+async def test_message_cursor_walks_every_row_once(session, thread_with_messages, descending):
+    async def fetch(limit, cursor):
+        return await list_messages_page(session, thread_with_messages.id, limit, cursor=cursor, descending=descending)
+
+    pages = await _all_pages(fetch, 3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [item["id"] for page in pages for item in page]
+    expected = [f"m{i}" for i in range(7)]
+    assert ids == (expected[::-1] if descending else expected)
+
+
+@pytest.mark.asyncio
+async def test_cursor_is_bound_to_direction(session, thread_with_messages):
+    _, cursor = await list_messages_page(session, thread_with_messages.id, 2)
+    with pytest.raises(InvalidCursorError):
+        await list_messages_page(session, thread_with_messages.id, 2, cursor=cursor, descending=True)
+    with pytest.raises(InvalidCursorError):
+        await list_threads_page(session, 2, cursor=cursor)
+    with pytest.raises(InvalidCursorError):
+        await list_threads_page(session, 2, cursor="not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_field_projection_keeps_sort_keys(session, thread_with_messages):
+    items, _ = await list_messages_page(session, thread_with_messages.id, 1, fields="content")
+    assert set(items[0]) == {"content", "order_num", "id"}
+    with pytest.raises(InvalidFieldsError):
+        await list_messages_page(session, thread_with_messages.id, 1, fields="secret")
+
+
+@pytest.mark.asyncio
+async def test_threads_are_listed_newest_first(session):
+    created_at = datetime(2024, 1, 1)
+    session.add_all(Thread(id=f"t{i}", created_at=created_at if i < 3 else datetime(2024, 1, 2)) for i in range(5))
+    await session.commit()
+
+    async def fetch(limit, cursor):
+        return await list_threads_page(session, limit, cursor=cursor, fields="id")
+
+    ids = [item["id"] for page in await _all_pages(fetch, 2) for item in page]
+    assert ids == ["t4", "t3", "t2", "t1", "t0"]
+
+
+@pytest.mark.asyncio
+async def test_runs_are_listed_newest_first(session):
+    thread = await create_thread(session)
+    for i in range(3):
+        await create_run(session, thread.id, {"n": i}, run_id=f"r{i}")
+
+    async def fetch(limit, cursor):
+        return await list_runs_page(session, thread.id, limit, cursor=cursor, fields="id")
+
+    ids = [item["id"] for page in await _all_pages(fetch, 2) for item in page]
+    assert ids == ["r2", "r1", "r0"]
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from deep_agents_langchain.service.threads import write_state
+from deep_agents_langchain.storage.repositories import StateConflictError, create_thread, get_state, upsert_state
+
+
+@pytest.mark.asyncio
+async def test_merge_is_shallow_and_keeps_nulls(session):
+    thread = await create_thread(session)
+    await upsert_state(session, thread.id, {"a": 1, "nested": {"x": 1}, "flag": True, "s": "v"}, replace=False)
+    state = await upsert_state(session, thread.id, {"a": None, "nested": {"y": 2}, 'q"k': [1, None]}, replace=False)
+    assert state.kv == {"a": None, "nested": {"y": 2}, "flag": True, "s": "v", 'q"k': [1, None]}
+    assert state.version == 2
+
+
+@pytest.mark.asyncio
+async def test_replace_overwrites_state(session):
+    thread = await create_thread(session)
+    await upsert_state(session, thread.id, {"a": 1}, replace=False)
+    state = await upsert_state(session, thread.id, {"b": None}, replace=True)
+    assert state.kv == {"b": None}
+
+
+@pytest.mark.asyncio
+async def test_versioned_upsert(session):
+    thread = await create_thread(session)
+    state = await upsert_state(session, thread.id, {"a": 1}, replace=False, expected_version=0)
+    assert state.version == 1
+    state = await upsert_state(session, thread.id, {"b": 2}, replace=False, expected_version=1)
+    assert (state.kv, state.version) == ({"a": 1, "b": 2}, 2)
+    state = await upsert_state(session, thread.id, {"c": 3}, replace=True, expected_version=2)
+    assert (state.kv, state.version) == ({"c": 3}, 3)
+
+
+@pytest.mark.asyncio
+async def test_version_conflict(session):
+    thread = await create_thread(session)
+    await upsert_state(session, thread.id, {"a": 1}, replace=False)
+    with pytest.raises(StateConflictError):
+        await upsert_state(session, thread.id, {"a": 2}, replace=False, expected_version=5)
+    with pytest.raises(StateConflictError):
+        await upsert_state(session, thread.id, {"a": 2}, replace=False, expected_version=0)
+    state = await upsert_state(session, thread.id, {}, replace=False)
+    assert (state.kv, state.version) == ({"a": 1}, 2)
+
+
+@pytest.mark.asyncio
+async def test_expected_version_requires_existing_state(session):
+    thread = await create_thread(session)
+    with pytest.raises(StateConflictError):
+        await upsert_state(session, thread.id, {"a": 1}, replace=False, expected_version=3)
+    state = await upsert_state(session, thread.id, {"a": 1}, replace=False)
+    assert state.version == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_merges_keep_every_key(sessionmaker, session):
+    thread = await create_thread(session)
+
+    async def merge(i: int):
+        async with sessionmaker() as own:
+            await upsert_state(own, thread.id, {f"k{i}": i}, replace=False)
+
+    # 合并在数据库内完成，并发写入不会互相覆盖
+    await asyncio.gather(*(merge(i) for i in range(5)))
+    async with sessionmaker() as check:
+        state = await get_state(check, thread.id)
+    assert state.kv == {f"k{i}": i for i in range(5)}
+    assert state.version == 5
+
+
+@pytest.mark.asyncio
+async def test_write_state_maps_conflict_to_409(session):
+    thread = await create_thread(session)
+    await write_state(session, thread.id, {"a": 1}, replace=False)
+    with pytest.raises(HTTPException) as exc:
+        await write_state(session, thread.id, {"a": 2}, replace=False, expected_version=0)
+    assert exc.value.status_code == 409
+    with pytest.raises(HTTPException) as exc:
+        await write_state(session, "missing", {"a": 1}, replace=False)
+    assert exc.value.status_code == 404
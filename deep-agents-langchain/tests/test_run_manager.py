@@ -0,0 +1,220 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from deep_agents_langchain.service.run_manager import RunEventLog, RunManager
+from deep_agents_langchain.service.runs import cancel_run, open_run_stream, run_and_stream
+from deep_agents_langchain.storage.repositories import create_thread
+
+
+def _delta(text: str, message_id: str = "m1") -> dict:
+    return {"event": "message", "data": {"message_id": message_id, "delta": text}}
+
+
+async def _drain(log: RunEventLog, after: int = -1) -> list[dict]:
+    return [item async for item in log.follow(after)]
+
+
+@pytest.mark.asyncio
+async def test_replay_after_offset_and_window():
+    log = RunEventLog(max_events=3)
+    for i in range(10):
+        log.append({"event": "tool", "data": {"n": i}})
+    log.close()
+    assert log.first_id == 7
+    assert not log.available(5)
+    assert [item["id"] for item in await _drain(log, 7)] == [8, 9]
+    # 起点已被挤出窗口时先报告过期，再从最早的保留事件继续
+    events = await _drain(log, 2)
+    assert events[0]["data"]["code"] == "EVENTS_EXPIRED"
+    assert [item["id"] for item in events[1:]] == [7, 8, 9]
+    # 窗口外的事件成批删除，列表最多保留两个窗口
+    assert len(log._events) < 2 * log.max_events
+
+
+@pytest.mark.asyncio
+async def test_undelivered_deltas_are_merged():
+    log = RunEventLog(max_events=100)
+    log.append({"event": "metadata", "data": {}})
+    for token in ("Hel", "lo", " wor", "ld"):
+        log.append(_delta(token))
+    log.append(_delta("x", message_id="m2"))
+    log.close()
+    events = await _drain(log)
+    assert [item["id"] for item in events] == [0, 1, 2]
+    assert events[1]["data"]["delta"] == "Hello world"
+    assert events[2]["data"]["delta"] == "x"
+
+
+@pytest.mark.asyncio
+async def test_delivered_deltas_are_not_modified():
+    log = RunEventLog(max_events=100)
+    received: list[dict] = []
+
+    async def follow():
+        async for item in log.follow():
+            received.append({**item, "data": dict(item["data"])})
+
+    follower = asyncio.create_task(follow())
+    log.append(_delta("a"))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    log.append(_delta("b"))
+    log.append(_delta("c"))
+    log.close()
+    await follower
+    # 已读到的 "a" 保持原样，之后未读的增量合并成一条
+    assert [item["data"]["delta"] for item in received] == ["a", "bc"]
+    assert "".join(item["data"]["delta"] for item in await _drain(log)) == "abc"
+
+
+class _Events:
+    """可控的事件源：每次 release 放出一个事件，记录是否被取消。"""
+
+    def __init__(self, count: int):
+        self.count = count
+        self.gate = asyncio.Semaphore(0)
+        self.cancelled = False
+
+    async def __call__(self, session):
+        try:
+            for i in range(self.count):
+                await self.gate.acquire()
+                yield {"event": "tool", "data": {"n": i}}
+            yield {"event": "end", "data": {"status": "completed"}}
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    def release(self, n: int = 1) -> None:
+        for _ in range(n):
+            self.gate.release()
+
+
+def _manager(sessionmaker, **kwargs) -> RunManager:
+    kwargs.setdefault("max_events", 100)
+    kwargs.setdefault("retention_seconds", 60)
+    return RunManager(sessionmaker, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replays_after_last_event_id(sessionmaker, session):
+    manager = _manager(sessionmaker)
+    source = _Events(4)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="continue")
+    first = manager.follow(run)
+    source.release(2)
+    assert [(await anext(first))["id"] for _ in range(2)] == [0, 1]
+    # 客户端断开：运行继续
+    await first.aclose()
+    source.release(2)
+    await run.task
+
+    stream = await open_run_stream(manager, session, "t1", "r1", last_event_id=1)
+    events = [item async for item in stream]
+    assert [item["id"] for item in events] == [2, 3, 4]
+    assert events[-1]["event"] == "end"
+    # 不传 Last-Event-ID 时从头回放
+    assert len([item async for item in await open_run_stream(manager, session, "t1", "r1")]) == 5
+
+
+@pytest.mark.asyncio
+async def test_reconnect_to_expired_offset_returns_410(sessionmaker, session):
+    manager = _manager(sessionmaker, max_events=2)
+    source = _Events(5)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="continue")
+    source.release(5)
+    await run.task
+    with pytest.raises(HTTPException) as exc:
+        await open_run_stream(manager, session, "t1", "r1", last_event_id=0)
+    assert exc.value.status_code == 410
+    with pytest.raises(HTTPException) as exc:
+        await open_run_stream(manager, session, "other-thread", "r1")
+    assert exc.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_finished_runs_are_evicted_after_retention(sessionmaker):
+    manager = _manager(sessionmaker, retention_seconds=0.01)
+    source = _Events(1)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="continue")
+    source.release()
+    await run.task
+    assert manager.get("t1", "r1") is run
+    assert manager.stats() == {"live": 0, "retained": 1}
+    await asyncio.sleep(0.05)
+    assert manager.get("t1", "r1") is None
+
+
+@pytest.mark.asyncio
+async def test_abandoned_run_is_cancelled_after_grace(sessionmaker):
+    manager = _manager(sessionmaker, disconnect_grace_seconds=0.05)
+    source = _Events(3)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="cancel")
+    follower = manager.follow(run)
+    source.release()
+    await anext(follower)
+    await follower.aclose()
+    await asyncio.sleep(0.1)
+    assert run.task.cancelled()
+    assert source.cancelled
+
+
+@pytest.mark.asyncio
+async def test_reconnect_within_grace_keeps_run(sessionmaker):
+    manager = _manager(sessionmaker, disconnect_grace_seconds=0.05)
+    source = _Events(2)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="cancel")
+    # 从未有跟随者时同样计时；宽限期内重连取消计时
+    await asyncio.sleep(0.01)
+    follower = manager.follow(run)
+    source.release()
+    await anext(follower)
+    await asyncio.sleep(0.1)
+    assert not run.task.done()
+    source.release()
+    assert [item["event"] async for item in follower] == ["tool", "end"]
+    await run.task
+    assert not source.cancelled
+
+
+@pytest.mark.asyncio
+async def test_continue_runs_survive_disconnect(sessionmaker):
+    manager = _manager(sessionmaker, disconnect_grace_seconds=0.01)
+    source = _Events(1)
+    run = manager.start("r1", "t1", "trace", source, on_disconnect="continue")
+    await asyncio.sleep(0.05)
+    assert not run.task.done()
+    source.release()
+    await run.task
+    assert run.log.closed and not source.cancelled
+
+
+@pytest.mark.asyncio
+async def test_cancel_waits_for_the_run_to_record_its_status(sessionmaker, session):
+    thread = await create_thread(session)
+    manager = _manager(sessionmaker)
+    started = asyncio.Event()
+
+    class SlowAgent:
+        async def astream(self, agent_input, config, stream_mode):
+            started.set()
+            await asyncio.sleep(10)
+            yield "updates", {}
+
+    def events(run_session):
+        payload = {"messages": [{"role": "user", "content": "hi"}]}
+        return run_and_stream(SlowAgent(), run_session, thread.id, payload, run_id="r1")
+
+    run = manager.start("r1", thread.id, "trace", events, on_disconnect="continue")
+    await started.wait()
+    result = await cancel_run(manager, session, thread.id, "r1", wait_seconds=5)
+    assert result == {"run_id": "r1", "status": "cancelled"}
+    assert run.task.done()
+    assert [item["event"] for item in run.log._events][-1] == "end"
+    # 已结束的运行再次取消直接返回其状态
+    assert await cancel_run(manager, session, thread.id, "r1") == {"run_id": "r1", "status": "cancelled"}
+    with pytest.raises(HTTPException) as exc:
+        await cancel_run(manager, session, thread.id, "missing")
+    assert exc.value.status_code == 404
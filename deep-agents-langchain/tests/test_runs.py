@@ -0,0 +1,212 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from sqlalchemy import select
+
+from deep_agents_langchain.service import runs
+from deep_agents_langchain.service.runs import _strip_replayed_prefix, run_and_stream
+from deep_agents_langchain.storage.models import Run, Thread, ToolCall
+from deep_agents_langchain.storage.repositories import create_thread, list_messages
+from deep_agents_langchain.utils.sse import sse_stream
+
+
+class ScriptedAgent:
+    """按脚本产出 updates 的假 agent：一次工具调用后给出最终回答。"""
+
+    async def astream(self, agent_input, config, stream_mode):
+        call = {"name": "lookup", "args": {"q": "x"}, "id": "call-1"}
+        yield "updates", {"model": {"messages": [AIMessage(content="", id="ai-1", tool_calls=[call])]}}
+        yield "updates", {"tools": {"messages": [ToolMessage(content="found", tool_call_id="call-1", name="lookup")]}}
+        yield "updates", {"model": {"messages": [AIMessage(content="done", id="ai-2")]}}
+
+
+class TokenAgent(ScriptedAgent):
+    """先逐 token 产出 messages 模式的增量，再产出完整的 updates。"""
+
+    async def astream(self, agent_input, config, stream_mode):
+        model = {"langgraph_node": "model"}
+        yield "messages", (AIMessageChunk(content="do", id="ai-2"), model)
+        # 摘要等中间件里的模型调用不推给前端
+        yield "messages", (AIMessageChunk(content="summary", id="s-1"), {"langgraph_node": "SummarizationMiddleware.before_model"})
+        yield "messages", (AIMessageChunk(content=[{"type": "text", "text": "ne"}], id="ai-2"), model)
+        async for item in super().astream(agent_input, config, stream_mode):
+            yield item
+
+
+class RecordingAgent:
+    """记录每次运行收到的输入，直接给出回答。"""
+
+    def __init__(self):
+        self.inputs: list[list] = []
+
+    async def astream(self, agent_input, config, stream_mode):
+        self.inputs.append([(m["role"], m["content"]) for m in agent_input["messages"]])
+        yield "updates", {"model": {"messages": [AIMessage(content=f"answer {len(self.inputs)}")]}}
+
+
+async def _collect(gen) -> list[dict]:
+    return [item async for item in gen]
+
+
+def _end(events: list[dict]) -> dict:
+    assert events[-1]["event"] == "end"
+    return events[-1]["data"]
+
+
+@pytest.mark.asyncio
+async def test_run_completes(sessionmaker, session):
+    thread = await create_thread(session)
+    events = await _collect(run_and_stream(ScriptedAgent(), session, thread.id, {"messages": [{"role": "user", "content": "hi"}]}))
+    assert _end(events)["status"] == "completed"
+    async with sessionmaker() as check:
+        run = (await check.execute(select(Run))).scalars().one()
+        assert run.status == "completed"
+        assert [(c.id, c.status) for c in (await check.execute(select(ToolCall))).scalars()] == [("call-1", "completed")]
+        # 运行产出的每条消息按顺序落库，与 checkpoint 中的消息一一对应
+        rows = await list_messages(check, thread.id)
+    assert [(row.order_num, row.role, row.content, row.tool_call_id) for row in rows] == [
+        (0, "user", "hi", None),
+        (1, "assistant", "", None),
+        (2, "tool", "found", "call-1"),
+        (3, "assistant", "done", None),
+    ]
+    assert rows[1].tool_calls == [{"id": "call-1", "name": "lookup", "args": {"q": "x"}}]
+    assert run.output["final_message_id"] == rows[3].id
+
+
+@pytest.mark.asyncio
+async def test_failed_commit_is_rolled_back_before_recording_error(sessionmaker, session, monkeypatch):
+    thread = await create_thread(session)
+
+    async def broken_upsert(session, thread_id, files, commit=True):
+        # 主键冲突：flush 失败后事务只能回滚
+        session.add(Thread(id=thread_id))
+        await session.flush()
+
+    monkeypatch.setattr(runs, "upsert_files_meta", broken_upsert)
+    events = await _collect(run_and_stream(ScriptedAgent(), session, thread.id, {"messages": [{"role": "user", "content": "hi"}]}))
+    assert [e["event"] for e in events][-3:] == ["error", "metrics", "end"]
+    assert _end(events)["status"] == "error"
+    async with sessionmaker() as check:
+        run = (await check.execute(select(Run))).scalars().one()
+        assert run.status == "error"
+        assert "UNIQUE" in run.error
+        # 回滚掉的收尾事务里的工具调用在错误事务中重新写入
+        assert [(c.id, c.status) for c in (await check.execute(select(ToolCall))).scalars()] == [("call-1", "completed")]
+
+
+@pytest.mark.asyncio
+async def test_cancel_before_first_agent_event_records_cancelled_run(sessionmaker, session, monkeypatch):
+    thread = await create_thread(session)
+    preparing = asyncio.Event()
+
+    async def slow_append(*args, **kwargs):
+        # 准备阶段的事务尚未提交时被取消，回滚会丢掉刚加入的运行记录
+        preparing.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(runs, "append_messages", slow_append)
+    gen = run_and_stream(ScriptedAgent(), session, thread.id, {"messages": [{"role": "user", "content": "hi"}]}, run_id="r1")
+    task = asyncio.create_task(_collect(gen))
+    await preparing.wait()
+    task.cancel()
+    events = await task
+
+    assert [e["event"] for e in events] == ["metadata", "metrics", "end"]
+    assert _end(events)["status"] == "cancelled"
+    async with sessionmaker() as check:
+        run = await check.get(Run, "r1")
+        assert run.status == "cancelled"
+        assert run.ended_at is not None
+
+
+@pytest.mark.asyncio
+async def test_tokens_and_tool_events_are_streamed(session):
+    thread = await create_thread(session)
+    events = await _collect(run_and_stream(TokenAgent(), session, thread.id, {"messages": [{"role": "user", "content": "hi"}]}))
+    assert [e["event"] for e in events] == ["metadata", "message", "message", "message", "tool", "message", "metrics", "end"]
+    assert [e["data"]["delta"] for e in events[1:3]] == ["do", "ne"]
+    assert events[3]["data"]["tool_calls"] == [{"id": "call-1", "name": "lookup", "args": {"q": "x"}, "status": "pending"}]
+    tool = events[4]["data"]
+    assert (tool["tool_call_id"], tool["status"], tool["result"]) == ("call-1", "completed", "found")
+    assert events[5]["data"]["content"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_sse_stream_encodes_each_event():
+    async def events():
+        yield {"event": "message", "data": {"delta": "你好"}, "id": 3}
+        yield {"event": "end", "data": {"status": "completed"}}
+
+    chunks = [chunk async for chunk in sse_stream(events())]
+    assert chunks[0] == f"id: 3\nevent: message\ndata: {json.dumps({'delta': '你好'}, ensure_ascii=False)}\n\n".encode()
+    assert chunks[1] == b'event: end\ndata: {"status": "completed"}\n\n'
+
+
+def test_strip_replayed_prefix():
+    history = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+    new = {"role": "user", "content": "q2"}
+    assert _strip_replayed_prefix(history, [new]) == [new]
+    assert _strip_replayed_prefix(history, [*history, new]) == [new]
+    # 前缀与已存历史不一致时视为新的一轮，原样写入
+    edited = [{"role": "user", "content": "q1 edited"}, history[1], new]
+    assert _strip_replayed_prefix(history, edited) == edited
+
+
+@pytest.mark.asyncio
+async def test_history_is_loaded_server_side(sessionmaker, session):
+    thread = await create_thread(session)
+    agent = RecordingAgent()
+    first = {"role": "user", "content": "q1"}
+    await _collect(run_and_stream(agent, session, thread.id, {"messages": [first]}))
+    await _collect(run_and_stream(agent, session, thread.id, {"messages": [{"role": "user", "content": "q2"}]}))
+    # 旧客户端提交完整历史：已存的前缀不重复写入
+    replayed = [
+        first,
+        {"role": "assistant", "content": "answer 1"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "answer 2"},
+        {"role": "user", "content": "q3"},
+    ]
+    await _collect(run_and_stream(agent, session, thread.id, {"messages": replayed}))
+
+    assert agent.inputs[1] == [("user", "q1"), ("assistant", "answer 1"), ("user", "q2")]
+    assert agent.inputs[2][-1] == ("user", "q3") and len(agent.inputs[2]) == 5
+    async with sessionmaker() as check:
+        rows = await list_messages(check, thread.id)
+    assert [(row.order_num, row.role, row.content) for row in rows] == [
+        (0, "user", "q1"),
+        (1, "assistant", "answer 1"),
+        (2, "user", "q2"),
+        (3, "assistant", "answer 2"),
+        (4, "user", "q3"),
+        (5, "assistant", "answer 3"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_replayed_history_includes_tool_messages(sessionmaker, session):
+    thread = await create_thread(session)
+    await _collect(run_and_stream(ScriptedAgent(), session, thread.id, {"messages": [{"role": "user", "content": "q1"}]}))
+    agent = RecordingAgent()
+    # 旧客户端只持有用户消息与最终回答：跳过工具调用与工具结果比对，已存前缀不重复写入
+    replayed = [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "done"},
+        {"role": "user", "content": "q2"},
+    ]
+    await _collect(run_and_stream(agent, session, thread.id, {"messages": replayed}))
+
+    assert agent.inputs[0] == [("user", "q1"), ("assistant", ""), ("tool", "found"), ("assistant", "done"), ("user", "q2")]
+    async with sessionmaker() as check:
+        rows = await list_messages(check, thread.id)
+    assert [(row.order_num, row.role) for row in rows] == [
+        (0, "user"),
+        (1, "assistant"),
+        (2, "tool"),
+        (3, "assistant"),
+        (4, "user"),
+        (5, "assistant"),
+    ]
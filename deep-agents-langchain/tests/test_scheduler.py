@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from deep_agents_langchain.service.runs import RunScheduler
+
+
+async def _run(scheduler: RunScheduler, ticket, order: list, name: str, hold: asyncio.Event | None = None) -> str:
+    """拿到执行权后记录顺序，可选地等待 hold 再释放；被打断时返回 interrupted。"""
+    try:
+        await scheduler.acquire(ticket)
+        order.append(name)
+        if hold is not None:
+            await hold.wait()
+        return "done"
+    except asyncio.CancelledError:
+        return "interrupted" if ticket.interrupted else "cancelled"
+    finally:
+        scheduler.release(ticket)
+
+
+@pytest.mark.asyncio
+async def test_runs_on_one_thread_are_fifo():
+    scheduler = RunScheduler(max_concurrency=0, max_queued=0)
+    hold = asyncio.Event()
+    order: list[str] = []
+    tickets = [scheduler.submit("t1") for _ in range(3)]
+    assert [scheduler.position(t) for t in tickets] == [-1, 0, 1]
+    tasks = [asyncio.create_task(_run(scheduler, t, order, str(i), hold)) for i, t in enumerate(tickets)]
+    await asyncio.sleep(0)
+    assert order == ["0"]
+    assert scheduler.stats()["running"] == 1
+    hold.set()
+    assert await asyncio.gather(*tasks) == ["done"] * 3
+    assert order == ["0", "1", "2"]
+    assert scheduler.stats() == {"running": 0, "queued": 0, "threads": 0, "max_concurrency": 0}
+
+
+@pytest.mark.asyncio
+async def test_reject_returns_409_when_thread_is_busy():
+    scheduler = RunScheduler(max_concurrency=0, max_queued=0)
+    ticket = scheduler.submit("t1", "reject")
+    with pytest.raises(HTTPException) as exc:
+        scheduler.submit("t1", "reject")
+    assert exc.value.status_code == 409
+    # 其他线程不受影响；释放后同一线程可以再次提交
+    scheduler.submit("t2", "reject")
+    scheduler.release(ticket)
+    scheduler.submit("t1", "reject")
+
+
+@pytest.mark.asyncio
+async def test_interrupt_cancels_active_run_and_jumps_the_queue():
+    scheduler = RunScheduler(max_concurrency=0, max_queued=0)
+    hold = asyncio.Event()
+    order: list[str] = []
+    first = scheduler.submit("t1")
+    queued = scheduler.submit("t1")
+    first_task = asyncio.create_task(_run(scheduler, first, order, "first", hold))
+    queued_task = asyncio.create_task(_run(scheduler, queued, order, "queued", hold))
+    await asyncio.sleep(0)
+
+    urgent = scheduler.submit("t1", "interrupt")
+    assert scheduler.position(urgent) == 0
+    urgent_task = asyncio.create_task(_run(scheduler, urgent, order, "urgent", hold))
+    assert await first_task == "interrupted"
+    hold.set()
+    assert await urgent_task == "done"
+    assert await queued_task == "done"
+    assert order == ["first", "urgent", "queued"]
+
+
+@pytest.mark.asyncio
+async def test_max_queued_returns_429():
+    scheduler = RunScheduler(max_concurrency=1, max_queued=2)
+    scheduler.submit("t1")
+    scheduler.submit("t2")
+    scheduler.submit("t3")
+    with pytest.raises(HTTPException) as exc:
+        scheduler.submit("t4")
+    assert exc.value.status_code == 429
+    assert scheduler.stats()["queued"] == 2
+
+
+@pytest.mark.asyncio
+async def test_global_limit_rotates_between_threads():
+    scheduler = RunScheduler(max_concurrency=2, max_queued=0)
+    order: list[str] = []
+    holds = {name: asyncio.Event() for name in ("a1", "a2", "b1", "c1")}
+    submitted = [("t1", "a1"), ("t1", "a2"), ("t2", "b1"), ("t3", "c1")]
+    tasks = {
+        name: asyncio.create_task(_run(scheduler, scheduler.submit(thread_id), order, name, holds[name]))
+        for thread_id, name in submitted
+    }
+    await asyncio.sleep(0)
+    assert order == ["a1", "b1"]
+    assert scheduler.stats()["running"] == 2
+
+    # t1 跑完一次后排到队尾：空位先给等待中的 t3
+    holds["a1"].set()
+    await tasks["a1"]
+    await asyncio.sleep(0)
+    assert order == ["a1", "b1", "c1"]
+    for hold in holds.values():
+        hold.set()
+    await asyncio.gather(*tasks.values())
+    assert order == ["a1", "b1", "c1", "a2"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    scheduler = RunScheduler(max_concurrency=0, max_queued=0)
+    active = scheduler.submit("t1")
+    waiting = scheduler.submit("t1")
+    task = asyncio.create_task(scheduler.acquire(waiting))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert scheduler.stats()["queued"] == 0
+    scheduler.release(active)
+    assert scheduler.stats()["threads"] == 0
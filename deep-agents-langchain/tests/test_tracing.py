@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from langchain.agents.middleware import ModelResponse
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from deep_agents_langchain.agent.middleware import TracingMiddleware
+from deep_agents_langchain.utils.tracing import RunTrace, current_trace
+
+
+class DelayedStreamModel(GenericFakeChatModel):
+    """首个分片前等待 delay 秒的流式假模型。"""
+
+    delay: float = 0.0
+
+    async def _astream(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+def _model_call(trace: RunTrace, name: str, delay: float, tail: float):
+    model = DelayedStreamModel(messages=iter([AIMessage(content="one two three")]), delay=delay)
+
+    async def handler(request):
+        chunks = [chunk async for chunk in model.astream("hi", config={"callbacks": [trace.callback]})]
+        await asyncio.sleep(tail)
+        return ModelResponse(result=[AIMessage(content="".join(c.content for c in chunks))])
+
+    return TracingMiddleware().awrap_model_call(SimpleNamespace(model=SimpleNamespace(model_name=name)), handler)
+
+
+@pytest.mark.asyncio
+async def test_ttft_is_measured_per_concurrent_model_call():
+    trace = RunTrace()
+    token = current_trace.set(trace)
+    try:
+        # 慢调用先开始、快调用后开始：单个“等待首 token”槽位会把两次调用的首 token 记混
+        await asyncio.gather(_model_call(trace, "slow", delay=0.2, tail=0.0), _model_call(trace, "fast", delay=0.02, tail=0.3))
+    finally:
+        current_trace.reset(token)
+
+    ttft = {span.name: span.attrs["ttft_ms"] for span in trace.spans if span.kind == "model"}
+    assert 200 <= ttft["slow"] < 300
+    assert 20 <= ttft["fast"] < 150
+    assert trace.callback._calls == {}
+
+
+@pytest.mark.asyncio
+async def test_model_call_without_streaming_has_no_ttft():
+    trace = RunTrace()
+    token = current_trace.set(trace)
+
+    async def handler(request):
+        return ModelResponse(result=[AIMessage(content="done")])
+
+    try:
+        await TracingMiddleware().awrap_model_call(SimpleNamespace(model=SimpleNamespace(model_name="m")), handler)
+    finally:
+        current_trace.reset(token)
+    (span,) = trace.spans
+    assert "ttft_ms" not in span.attrs
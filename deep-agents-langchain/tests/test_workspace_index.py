@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+pytest.importorskip("wcmatch")
+
+from deep_agents_langchain.storage.workspace_index import WorkspaceIndex, required_literals
+
+
+@pytest.mark.parametrize(
+    ("pattern", "expected"),
+    [
+        ("def handler", [b"def handler"]),
+        (r"Foo\.bar\(", [b"foo.bar("]),
+        ("error: .* timeout", [b"error: ", b" timeout"]),
+        ("(?i)ConnectionError", [b"connectionerror"]),
+        # 分支与短片段无法确定必含内容
+        ("foo|bar", []),
+        ("ab.cd", []),
+        # 至少重复一次的分组必然出现，但不与前后相邻
+        ("x(retry)+y", [b"retry"]),
+        ("x(retry)*y", []),
+        # 忽略大小写时非 ASCII 字面量不可靠
+        ("(?i)ÄÖÜabc", [b"abc"]),
+        ("[", []),
+    ],
+)
+def test_required_literals(pattern, expected):
+    assert required_literals(pattern) == expected
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    root = tmp_path / "ws"
+    (root / "pkg" / "sub").mkdir(parents=True)
+    (root / "pkg" / "app.py").write_text("def handler(event):\n    return event\n")
+    (root / "pkg" / "sub" / "util.py").write_text("def helper():\n    pass\n")
+    (root / "README.md").write_text("Handler docs\n")
+    (root / "data.bin").write_bytes(b"\0handler")
+    (root / "big.txt").write_text("z" * 64)
+    return root
+
+
+def test_candidates_use_trigrams(workspace):
+    index = WorkspaceIndex(str(workspace), max_file_bytes=32)
+    index.refresh()
+    paths = lambda pattern, base="", glob=None: [rel for rel, _ in index.candidates(pattern, base, glob)]  # noqa: E731
+    # 超过大小上限的文件没有内容索引，总是候选；二进制文件总是排除
+    assert paths("def handler") == ["big.txt", "pkg/app.py"]
+    assert paths("(?i)HANDLER") == ["README.md", "big.txt", "pkg/app.py"]
+    assert paths("def h", base="pkg") == ["pkg/app.py", "pkg/sub/util.py"]
+    assert paths("def", glob="util.*") == ["pkg/sub/util.py"]
+    # 没有必含字面量时不做过滤
+    assert len(paths("a|b")) == 4
+
+
+def test_refresh_is_incremental(workspace):
+    index = WorkspaceIndex(str(workspace), ignore={"README.md"})
+    changed, removed = index.refresh()
+    assert sorted(changed) == ["big.txt", "data.bin", "pkg/app.py", "pkg/sub/util.py"]
+    assert removed == []
+    assert index.refresh() == ({}, [])
+
+    app = workspace / "pkg" / "app.py"
+    app.write_text("def renamed(event):\n    return event\n")
+    stat = app.stat()
+    os.utime(app, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    (workspace / "pkg" / "sub" / "util.py").unlink()
+    (workspace / "new.py").write_text("def handler():\n    pass\n")
+    changed, removed = index.refresh()
+    assert sorted(changed) == ["new.py", "pkg/app.py"]
+    assert removed == ["pkg/sub/util.py"]
+    assert [rel for rel, _ in index.candidates("def handler")] == ["new.py"]
+    assert [rel for rel, _ in index.glob("*.py")] == ["new.py", "pkg/app.py"]
+
+
+def test_update_and_persistence(workspace, tmp_path):
+    persist = tmp_path / "index.pkl"
+    index = WorkspaceIndex(str(workspace), persist_path=str(persist))
+    index.refresh()
+    (workspace / "pkg" / "app.py").write_text("def handler_v2():\n    pass\n")
+    index.update(workspace / "pkg" / "app.py")
+    assert index.drain_changes()[0].keys() == {"pkg/app.py"}
+    index.dump()
+
+    reloaded = WorkspaceIndex(str(workspace), persist_path=str(persist))
+    assert reloaded.load()
+    assert reloaded.entries() == index.entries()
+    # 载入后首次 refresh 只比对 mtime，没有变化的文件不再读取
+    assert reloaded.refresh() == ({}, [])